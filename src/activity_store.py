@@ -0,0 +1,363 @@
+import argparse
+import glob
+import json
+import os
+import sqlite3
+import sys
+from datetime import datetime, timedelta, timezone
+
+import signatures
+import training_load
+import workout_stream
+
+STORE_FILE = os.path.join(os.path.dirname(__file__), '..', 'data', 'activities.sqlite')
+PROCESSED_DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'processed')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS activities (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    start_time REAL,
+    analysis_type TEXT NOT NULL,
+    duration_seconds REAL,
+    number_of_intervals INTEGER NOT NULL,
+    title TEXT
+);
+CREATE TABLE IF NOT EXISTS interval_groups (
+    activity_id INTEGER NOT NULL REFERENCES activities(id) ON DELETE CASCADE,
+    group_index INTEGER NOT NULL,
+    number_of_intervals INTEGER NOT NULL,
+    average_duration REAL NOT NULL,
+    PRIMARY KEY (activity_id, group_index)
+);
+CREATE TABLE IF NOT EXISTS intervals (
+    activity_id INTEGER NOT NULL REFERENCES activities(id) ON DELETE CASCADE,
+    group_index INTEGER NOT NULL,
+    interval_index INTEGER NOT NULL,
+    start_time REAL,
+    duration REAL NOT NULL,
+    average_value REAL NOT NULL,
+    max_value REAL NOT NULL,
+    zones TEXT NOT NULL,
+    PRIMARY KEY (activity_id, group_index, interval_index)
+);
+CREATE TABLE IF NOT EXISTS zone_time (
+    activity_id INTEGER NOT NULL REFERENCES activities(id) ON DELETE CASCADE,
+    zone TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    PRIMARY KEY (activity_id, zone)
+);
+CREATE TABLE IF NOT EXISTS daily_zone_time (
+    day TEXT NOT NULL,
+    analysis_type TEXT NOT NULL,
+    zone TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    PRIMARY KEY (day, analysis_type, zone)
+);
+CREATE TABLE IF NOT EXISTS activity_load (
+    activity_id INTEGER PRIMARY KEY REFERENCES activities(id) ON DELETE CASCADE,
+    basis TEXT NOT NULL,
+    normalized_power REAL,
+    intensity_factor REAL NOT NULL,
+    tss REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS daily_load (
+    day TEXT PRIMARY KEY,
+    tss REAL NOT NULL,
+    ctl REAL NOT NULL,
+    atl REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS signatures (
+    activity_id INTEGER PRIMARY KEY REFERENCES activities(id) ON DELETE CASCADE,
+    vector BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS activities_start_time ON activities(start_time);
+CREATE INDEX IF NOT EXISTS activities_type_start_time ON activities(analysis_type, start_time);
+CREATE INDEX IF NOT EXISTS zone_time_zone ON zone_time(zone, activity_id, seconds);
+CREATE INDEX IF NOT EXISTS intervals_average_value ON intervals(average_value, activity_id);
+"""
+
+PERIOD_FORMATS = {
+    "day": "%Y-%m-%d",
+    "week": "%Y-W%W",
+    "month": "%Y-%m",
+    "year": "%Y",
+}
+
+def connect(path=STORE_FILE):
+    """Opens (and if needed creates) the activity store."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+def parse_duration(text):
+    """Parses 'H:MM:SS' or 'N days, H:MM:SS' (as written in summaries) into seconds."""
+    if not text or text == "N/A":
+        return None
+    days = 0
+    if "day" in text:
+        day_part, text = text.split(",", 1)
+        days = int(day_part.split()[0])
+    hours, minutes, seconds = (float(part) for part in text.strip().split(":"))
+    return days * 86400 + hours * 3600 + minutes * 60 + seconds
+
+def _start_seconds(summary):
+    """Workout start as epoch seconds; older summaries fall back to the first interval."""
+    start_time = summary.get('start_time')
+    if not start_time:
+        groups = summary.get('grouped_intervals') or []
+        start_time = groups[0]['intervals'][0]['start_time'] if groups and groups[0]['intervals'] else None
+    return workout_stream.parse_timestamp(start_time) if start_time else None
+
+def store_summary(conn, name, summary):
+    """
+    Writes one workout summary into the normalized tables, replacing any previous version.
+
+    Args:
+        conn (sqlite3.Connection): Store connection.
+        name (str): Activity name (raw file name without extension).
+        summary (dict): Summary as produced by `summary_generation.generate_summary`.
+    """
+    with conn:
+        _update_daily_zone_time(conn, name, sign=-1)  # Take the previous version out of the rollup
+        load_changes = {}
+        _collect_daily_load(conn, name, load_changes, sign=-1)
+        conn.execute("DELETE FROM activities WHERE name = ?", (name,))
+        activity_id = conn.execute(
+            "INSERT INTO activities (name, start_time, analysis_type, duration_seconds, number_of_intervals, title) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (name, _start_seconds(summary), summary.get('analysis_type', "none"),
+             parse_duration(summary.get('workout_duration')), summary.get('number_of_intervals', 0),
+             summary.get('title'))).lastrowid
+
+        group_rows, interval_rows = [], []
+        for group_index, group in enumerate(summary.get('grouped_intervals') or []):
+            group_rows.append((activity_id, group_index, group['number_of_intervals'], group['average_duration']))
+            for interval_index, interval in enumerate(group['intervals']):
+                interval_rows.append((
+                    activity_id, group_index, interval_index,
+                    workout_stream.parse_timestamp(interval['start_time']),
+                    interval['duration'], interval['average_value'], interval['max_value'],
+                    ",".join(interval['zones'])))
+        conn.executemany("INSERT INTO interval_groups VALUES (?, ?, ?, ?)", group_rows)
+        conn.executemany("INSERT INTO intervals VALUES (?, ?, ?, ?, ?, ?, ?, ?)", interval_rows)
+
+        zone_rows = [(activity_id, zone, parse_duration(duration))
+                     for zone, duration in (summary.get('zone_analysis') or {}).items()
+                     if "Reference Value" not in zone]
+        conn.executemany("INSERT INTO zone_time VALUES (?, ?, ?)", zone_rows)
+        _update_daily_zone_time(conn, name, sign=1)
+
+        signature = signatures.summary_signature(summary)
+        if signature is not None:
+            conn.execute("INSERT INTO signatures VALUES (?, ?)", (activity_id, signature.tobytes()))
+
+        load = summary.get('training_load')
+        if load:
+            conn.execute("INSERT INTO activity_load VALUES (?, ?, ?, ?, ?)",
+                         (activity_id, load['basis'], load.get('normalized_power'), load['intensity_factor'], load['tss']))
+        _collect_daily_load(conn, name, load_changes, sign=1)
+        training_load.apply_daily_tss(conn, load_changes)
+
+def _update_daily_zone_time(conn, name, sign):
+    """Adds (sign=1) or removes (sign=-1) one activity's zone time in the daily rollup."""
+    conn.execute(
+        "INSERT INTO daily_zone_time (day, analysis_type, zone, seconds) "
+        "SELECT date(a.start_time, 'unixepoch'), a.analysis_type, z.zone, ? * z.seconds "
+        "FROM zone_time z JOIN activities a ON a.id = z.activity_id "
+        "WHERE a.name = ? AND a.start_time IS NOT NULL "
+        "ON CONFLICT (day, analysis_type, zone) DO UPDATE SET seconds = seconds + excluded.seconds",
+        (sign, name))
+
+def _collect_daily_load(conn, name, changes, sign):
+    """Adds (sign=1) or removes (sign=-1) one activity's TSS in `changes`, a day -> TSS dict."""
+    row = conn.execute(
+        "SELECT date(a.start_time, 'unixepoch'), l.tss FROM activity_load l JOIN activities a ON a.id = l.activity_id "
+        "WHERE a.name = ? AND a.start_time IS NOT NULL", (name,)).fetchone()
+    if row:
+        changes[row[0]] = changes.get(row[0], 0.0) + sign * row[1]
+
+def import_summaries(conn, processed_dir=PROCESSED_DATA_DIR):
+    """
+    Imports every existing *_summary.json in `processed_dir`.
+
+    Returns:
+        int: Number of summaries imported.
+    """
+    summaries = []
+    for path in sorted(glob.glob(os.path.join(processed_dir, "*_summary.json"))):
+        with open(path, 'r') as f:
+            summaries.append((os.path.basename(path)[:-len("_summary.json")], json.load(f)))
+    # Oldest first, so the daily load series is only ever appended to
+    summaries.sort(key=lambda item: _start_seconds(item[1]) or 0.0)
+    for name, summary in summaries:
+        store_summary(conn, name, summary)
+    return len(summaries)
+
+def _date_filter(start, end, analysis_type, alias="a"):
+    clauses, params = [], []
+    if start is not None:
+        clauses.append(f"{alias}.start_time >= ?")
+        params.append(start)
+    if end is not None:
+        clauses.append(f"{alias}.start_time < ?")
+        params.append(end)
+    if analysis_type:
+        clauses.append(f"{alias}.analysis_type = ?")
+        params.append(analysis_type)
+    return (" AND ".join(clauses) or "1"), params
+
+def zone_time_by_period(conn, zone=None, start=None, end=None, period="week", analysis_type=None):
+    """
+    Sums time in zone per period.
+
+    Args:
+        conn (sqlite3.Connection): Store connection.
+        zone (str): Only this zone (e.g. "zone4"); all zones if None.
+        start, end (float): Epoch seconds bounding the activity start day, end exclusive.
+        period (str): "day", "week", "month" or "year".
+        analysis_type (str): "power" or "heart_rate"; both if None.
+
+    Returns:
+        list of tuples: (period, zone, seconds), ordered by period and zone.
+    """
+    clauses, params = [], []
+    if start is not None:
+        clauses.append("day >= date(?, 'unixepoch')")
+        params.append(start)
+    if end is not None:
+        clauses.append("day < date(?, 'unixepoch')")
+        params.append(end)
+    if analysis_type:
+        clauses.append("analysis_type = ?")
+        params.append(analysis_type)
+    if zone:
+        clauses.append("zone = ?")
+        params.append(zone)
+    where = " AND ".join(clauses) or "1"
+    # Served from the daily rollup, so the cost depends on the number of days, not activities
+    query = (f"SELECT strftime('{PERIOD_FORMATS[period]}', day) AS period, zone, SUM(seconds) "
+             f"FROM daily_zone_time WHERE {where} GROUP BY period, zone ORDER BY period, zone")
+    return conn.execute(query, params).fetchall()
+
+def find_interval_sessions(conn, min_intervals=1, min_average=0, start=None, end=None, analysis_type=None):
+    """
+    Finds activities with at least `min_intervals` intervals averaging `min_average` or more.
+
+    Returns:
+        list of tuples: (activity name, start time ISO, title, matching interval count), newest first.
+    """
+    where, params = _date_filter(start, end, analysis_type)
+    # Aggregate over the average_value index first, then join the few matching activities
+    query = (f"SELECT a.name, a.start_time, a.title, m.matching FROM "
+             f"(SELECT activity_id, COUNT(*) AS matching FROM intervals WHERE average_value >= ? "
+             f"GROUP BY activity_id HAVING matching >= ?) m "
+             f"JOIN activities a ON a.id = m.activity_id "
+             f"WHERE {where} ORDER BY a.start_time DESC")
+    rows = conn.execute(query, [min_average, min_intervals] + params).fetchall()
+    return [(name, workout_stream.format_timestamp(start_time) if start_time is not None else None, title, matching)
+            for name, start_time, title, matching in rows]
+
+def find_similar(conn, like=None, structure=None, limit=10, analysis_type=None, index=None):
+    """
+    Finds the activities whose interval structure is closest to another activity's or to a description.
+
+    Args:
+        conn (sqlite3.Connection): Store connection.
+        like (str): Name of a stored activity to compare with; it is left out of the results.
+        structure (str): Structure description instead, see `signatures.parse_structure`.
+        limit (int): Number of results.
+        analysis_type (str): "power" or "heart_rate"; both if None.
+        index (SignatureIndex): An index already loaded from `conn`, to reuse across queries.
+
+    Returns:
+        list of tuples: (activity name, start time ISO, title, distance), closest first.
+
+    Raises:
+        KeyError: If `like` has no stored signature.
+        ValueError: If `structure` cannot be parsed.
+    """
+    index = index or signatures.SignatureIndex.load(conn)
+    if like is not None:
+        matches = index.query(index.signature_of(like), limit, analysis_type, exclude=(like,))
+    else:
+        matches = index.query(signatures.structure_signature(signatures.parse_structure(structure)), limit, analysis_type)
+    details = {name: (start_time, title) for name, start_time, title in conn.execute(
+        f"SELECT name, start_time, title FROM activities WHERE name IN ({','.join('?' * len(matches))})",
+        [name for name, _ in matches])}
+    results = []
+    for name, distance in matches:
+        start_time, title = details[name]
+        results.append((name, workout_stream.format_timestamp(start_time) if start_time is not None else None,
+                        title, distance))
+    return results
+
+def _parse_date(text):
+    return datetime.fromisoformat(text).replace(tzinfo=timezone.utc).timestamp() if text else None
+
+def main(argv=None):
+    """Command line access to the activity store. Returns the process exit status."""
+    parser = argparse.ArgumentParser(description="Query the local activity store.")
+    parser.add_argument('--db', default=STORE_FILE, help="Path to the store.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = subparsers.add_parser('import', help="Import existing *_summary.json files.")
+    import_parser.add_argument('--dir', default=PROCESSED_DATA_DIR)
+
+    zone_parser = subparsers.add_parser('zone-time', help="Time in zone per period.")
+    zone_parser.add_argument('--zone')
+    zone_parser.add_argument('--period', choices=sorted(PERIOD_FORMATS), default="week")
+
+    sessions_parser = subparsers.add_parser('sessions', help="Activities with repeated intervals above a value.")
+    sessions_parser.add_argument('--min-intervals', type=int, default=1)
+    sessions_parser.add_argument('--min-average', type=float, default=0)
+
+    similar_parser = subparsers.add_parser('similar', help="Activities with the most similar interval structure.")
+    query_group = similar_parser.add_mutually_exclusive_group(required=True)
+    query_group.add_argument('--like', help="Activity name (raw file name without extension) to compare with.")
+    query_group.add_argument('--structure', help="Structure to look for, e.g. '5x4min zone4, 4x30sec zone5'.")
+    similar_parser.add_argument('--limit', type=int, default=10)
+
+    load_parser = subparsers.add_parser('load', help="Daily training load: TSS, fitness (CTL), fatigue (ATL) and form (TSB).")
+
+    for subparser in (zone_parser, sessions_parser, load_parser):
+        subparser.add_argument('--from', dest='start', help="Start date (YYYY-MM-DD), inclusive.")
+        subparser.add_argument('--to', dest='end', help="End date (YYYY-MM-DD), exclusive.")
+    for subparser in (zone_parser, sessions_parser, similar_parser):
+        subparser.add_argument('--type', dest='analysis_type', choices=["power", "heart_rate"])
+
+    args = parser.parse_args(argv)
+    conn = connect(args.db)
+
+    if args.command == 'import':
+        print(f"Imported {import_summaries(conn, args.dir)} summaries into {args.db}")
+    elif args.command == 'zone-time':
+        for period, zone, seconds in zone_time_by_period(conn, args.zone, _parse_date(args.start), _parse_date(args.end),
+                                                         args.period, args.analysis_type):
+            print(f"{period}  {zone}  {seconds / 60:.1f} min")
+    elif args.command == 'sessions':
+        for name, start_time, title, matching in find_interval_sessions(
+                conn, args.min_intervals, args.min_average, _parse_date(args.start), _parse_date(args.end), args.analysis_type):
+            print(f"{start_time}  {name}  {matching} intervals  {title}")
+    elif args.command == 'similar':
+        try:
+            similar = find_similar(conn, args.like, args.structure, args.limit, args.analysis_type)
+        except KeyError:
+            print(f"Unknown activity '{args.like}': it is not in {args.db}, or has no intervals.", file=sys.stderr)
+            return 1
+        except ValueError as e:  # An unparsable --structure
+            print(str(e), file=sys.stderr)
+            return 1
+        for name, start_time, title, distance in similar:
+            print(f"{distance:5.2f}  {start_time}  {name}  {title}")
+    elif args.command == 'load':
+        end = (datetime.fromisoformat(args.end) - timedelta(days=1)).date().isoformat() if args.end else None
+        for day, tss, ctl, atl, tsb in training_load.load_series(conn, args.start, end):
+            print(f"{day}  TSS {tss:6.1f}  CTL {ctl:6.1f}  ATL {atl:6.1f}  TSB {tsb:6.1f}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,211 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import data_parser
+import grouping
+import interval_detection
+import main
+import metric_analysis
+import resampling
+import summary_generation
+import utils
+import workout_generator
+import zones
+
+# name -> (file format, generate_workout arguments)
+SCENARIOS = {
+    "ride_1h_1hz": ("tcx", dict(duration=3600, sample_rate=1)),
+    "ride_4h_1hz_dropouts": ("tcx", dict(duration=14400, sample_rate=1, dropouts=10, missing_power=0.01,
+                                         intervals=[(4, 1200, 300, 300)])),
+    "ride_1h_10hz": ("tcx", dict(duration=3600, sample_rate=10)),
+    "hr_only_2h_1hz": ("tcx", dict(duration=7200, sample_rate=1, missing_power=1.0)),
+    "gpx_1h_4hz": ("gpx", dict(duration=3600, sample_rate=4)),
+    "fit_4h_1hz_dropouts": ("fit", dict(duration=14400, sample_rate=1, dropouts=10, missing_power=0.01,
+                                        intervals=[(4, 1200, 300, 300)])),
+    "ultra_24h_1hz": ("tcx", dict(duration=86400, sample_rate=1, dropouts=40, intervals=[(6, 1800, 600, 280)])),
+}
+
+QUICK_SCENARIOS = ("ride_1h_1hz", "hr_only_2h_1hz", "gpx_1h_4hz", "fit_4h_1hz_dropouts")
+
+# Samples per chunk fed to the online analysis stage
+ONLINE_CHUNK_SIZE = 3600
+
+WRITERS = {"tcx": workout_generator.write_tcx, "gpx": workout_generator.write_gpx, "fit": workout_generator.write_fit}
+
+def pipeline_stages(file_path, settings):
+    """
+    Returns the analysis pipeline as a list of (stage name, function) pairs.
+
+    Each function takes the previous stage's state dict and fills in its own output, so a stage
+    can be timed in isolation by rerunning it against a copy of the state.
+    """
+    def parse(state):
+        state['stream'] = data_parser.parse_workout_stream(file_path)
+        state['metric'] = state['stream'].primary_metric()
+        state['series'] = state['stream'].series(state['metric'])
+
+    def resample(state):
+        resampling_config = settings['resampling_config']
+        state['stream'] = resampling.resample(state['stream'], interval=resampling_config.get('interval', 1.0),
+                                              max_gap=resampling_config.get('max_gap', 10.0),
+                                              fill=resampling_config.get('fill'))
+        state['series'] = state['stream'].series(state['metric'])
+
+    def smooth(state):
+        smoothing_config = settings['smoothing_config']
+        window = smoothing_config.get('power_window' if state['metric'] == 'power' else 'heart_rate_window', 5)
+        state['smoothed'] = utils.smooth_data(state['series'], window, method=smoothing_config.get('method', 'sample'))
+
+    def detect(state):
+        prefix = 'power' if state['metric'] == 'power' else 'heart_rate'
+        state['intervals'] = interval_detection.detect_intervals(state['smoothed'], settings[f'{prefix}_interval_config'],
+                                                                 zones=settings[f'{prefix}_zone_table'])
+
+    def zone(state):
+        prefix = 'power' if state['metric'] == 'power' else 'heart_rate'
+        state['zones'] = zones.analyze_zones(state['series'], settings[f'{prefix}_zone_table'], state['metric'])
+
+    def group(state):
+        state['groups'] = grouping.group_intervals(state['intervals'])
+
+    def summarize(state):
+        summary = summary_generation.generate_summary(state['series'], state['intervals'], state['groups'],
+                                                      state['metric'], zone_analysis=state['zones'])
+        summary['title'] = summary_generation.generate_workout_title(summary)
+        state['summary'] = summary
+
+    def online(state):
+        # smooth, detect, zones and group again, chunk by chunk, for comparison with the batch stages
+        analysis = metric_analysis.OnlineMetricAnalysis(state['metric'], settings)
+        timestamps, values = state['series'].timestamps, state['series'].values
+        for start in range(0, len(values), ONLINE_CHUNK_SIZE):
+            analysis.update(timestamps[start:start + ONLINE_CHUNK_SIZE], values[start:start + ONLINE_CHUNK_SIZE])
+        state['online'] = analysis.finish()
+
+    return [("parse", parse), ("resample", resample), ("smooth", smooth), ("detect", detect), ("zones", zone),
+            ("group", group), ("summarize", summarize), ("online", online)]
+
+def run_scenario(name, file_format, arguments, settings, work_dir, repeat=3):
+    """
+    Generates one synthetic workout and times every pipeline stage on it.
+
+    Wall time is the best of `repeat` runs. Peak memory is measured in a separate run under
+    tracemalloc so its overhead does not distort the timings.
+
+    Returns:
+        dict: Scenario description and per-stage 'seconds', 'samples_per_second' and 'peak_bytes'.
+    """
+    workout = workout_generator.generate_workout(**arguments)
+    file_path = os.path.join(work_dir, f"{name}.{file_format}")
+    WRITERS[file_format](workout, file_path)
+    samples = len(workout['timestamps'])
+
+    stages = pipeline_stages(file_path, settings)
+    state = {}
+    results = []
+    for stage_name, stage in stages:
+        timings = []
+        for _ in range(repeat):
+            trial = dict(state)
+            started = time.perf_counter()
+            stage(trial)
+            timings.append(time.perf_counter() - started)
+
+        trial = dict(state)
+        tracemalloc.start()
+        stage(trial)
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        state = trial
+        best = min(timings)
+        results.append({
+            'stage': stage_name,
+            'seconds': best,
+            'samples_per_second': samples / best if best > 0 else None,
+            'peak_bytes': peak_bytes,
+        })
+
+    return {
+        'scenario': name,
+        'format': file_format,
+        'samples': samples,
+        'file_bytes': os.path.getsize(file_path),
+        'stages': results,
+        'total_seconds': sum(result['seconds'] for result in results),
+    }
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_report(report, baseline=None):
+    """Prints a table of the results, with the ratio to `baseline` where the stage exists in it."""
+    previous = {}
+    for scenario in (baseline or {}).get('scenarios', []):
+        for stage in scenario['stages']:
+            previous[(scenario['scenario'], stage['stage'])] = stage['seconds']
+
+    for scenario in report['scenarios']:
+        print(f"{scenario['scenario']} ({scenario['samples']} samples, {scenario['file_bytes'] / 1e6:.1f} MB)")
+        for stage in scenario['stages']:
+            line = (f"  {stage['stage']:<10} {stage['seconds'] * 1000:9.2f} ms "
+                    f"{(stage['samples_per_second'] or 0) / 1e6:8.2f} M samples/s "
+                    f"{stage['peak_bytes'] / 1e6:8.2f} MB peak")
+            before = previous.get((scenario['scenario'], stage['stage']))
+            if before:
+                line += f"  x{stage['seconds'] / before:.2f} vs baseline"
+            print(line)
+
+def main_benchmark(argv=None):
+    """Runs the benchmark suite and saves the results as JSON."""
+    parser = argparse.ArgumentParser(description="Benchmark the analysis pipeline on synthetic workouts.")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help="Scenario to run (repeatable). Defaults to all but the 24 h ride.")
+    parser.add_argument('--quick', action='store_true', help="Run a small subset.")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per stage (best is kept).")
+    parser.add_argument('--output', default="benchmark_results.json", help="Where to save the JSON results.")
+    parser.add_argument('--compare', help="Earlier results JSON to compare against.")
+    args = parser.parse_args(argv)
+
+    if args.scenario:
+        names = args.scenario
+    elif args.quick:
+        names = list(QUICK_SCENARIOS)
+    else:
+        names = [name for name in SCENARIOS if name != "ultra_24h_1hz"]
+
+    settings = main.compile_settings(main.load_config())
+    with tempfile.TemporaryDirectory() as work_dir:
+        scenarios = [run_scenario(name, *SCENARIOS[name], settings, work_dir, args.repeat) for name in names]
+
+    report = {
+        'revision': _git_revision(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scenarios': scenarios,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to: {args.output}")
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -0,0 +1,162 @@
+import argparse
+import json
+import os
+import sys
+
+import instrumentation
+
+# main (and through it the config, manifest and analysis modules) is imported by the commands
+# themselves, so parsing the arguments and --help load nothing beyond argparse and logging.
+
+logger = instrumentation.get_logger("cli")
+
+def _stored_summary(name):
+    """Loads the stored summary of a raw file path, file name or activity name, or returns None."""
+    import main
+    summary_path = os.path.join(main.PROCESSED_DATA_DIR, main.summary_filename(os.path.basename(name)))
+    try:
+        with open(summary_path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _existing_files(paths):
+    """Returns the absolute paths of `paths`, logging the ones that do not exist."""
+    found = []
+    for path in paths:
+        if os.path.isfile(path):
+            found.append(os.path.abspath(path))
+        else:
+            logger.error(f"File '{path}' not found.")
+    return found
+
+def batch_command(args):
+    """Analyzes new or changed files in the raw data directory, once or continuously."""
+    import main
+    config, settings = main.configure_from_args(args)
+    if not os.path.exists(main.RAW_DATA_DIR):
+        logger.error(f"Raw data directory '{main.RAW_DATA_DIR}' not found.")
+        return 1
+    main.set_settings(settings)
+
+    if args.watch:
+        import signal
+        import watcher
+        os.makedirs(main.PROCESSED_DATA_DIR, exist_ok=True)
+        file_watcher = watcher.Watcher(main.RAW_DATA_DIR, config=config, settings=settings, workers=args.workers,
+                                       use_inotify=not args.poll)
+        signal.signal(signal.SIGTERM, lambda *_: file_watcher.stop())
+        file_watcher.run()
+        return 0
+
+    reports = main.run_batch(config, settings, workers=args.workers, force=args.force)
+    return 1 if any(report['status'] == "failed" for report in reports) else 0
+
+def analyze_command(args):
+    """Analyzes the given files (when new or changed) and records them like a batch run."""
+    import main
+    file_paths = _existing_files(args.files)
+    config, settings = main.configure_from_args(args)
+    main.set_settings(settings)
+    reports = main.run_batch(config, settings, workers=args.workers, force=args.force, file_paths=file_paths) if file_paths else []
+    failed = len(file_paths) < len(args.files) or any(report['status'] == "failed" for report in reports)
+    return 1 if failed else 0
+
+def title_command(args):
+    """
+    Prints the title of each file.
+
+    Titles of files the manifest shows as analyzed with the current code and config are read
+    from their summaries, without loading the analysis modules; the others are analyzed and
+    recorded first.
+    """
+    import main
+    import manifest
+    file_paths = _existing_files(args.files)
+    config = main.configure_logging_from_args(args, default_level="WARNING")
+    processed_manifest = manifest.load_manifest(main.PROCESSED_DATA_DIR)
+    stale, _ = manifest.find_stale(file_paths, processed_manifest, config, main.PROCESSED_DATA_DIR,
+                                   force=args.force, prune=False)
+    if stale:
+        settings = main.compile_settings(config)
+        main.set_settings(settings)
+        main.run_batch(config, settings, workers=args.workers, force=args.force, file_paths=stale)
+
+    status = 0 if len(file_paths) == len(args.files) else 1
+    for file_path in file_paths:
+        name = os.path.basename(file_path)
+        summary = _stored_summary(name)
+        if not summary or not summary.get('title'):
+            logger.warning(f"No title for {name}: no power or heart rate data, or the analysis failed.")
+            status = 1
+        elif len(args.files) == 1:
+            print(summary['title'])
+        else:
+            print(f"{name}\t{summary['title']}")
+    return status
+
+def show_command(args):
+    """Prints a stored summary, or one of its fields, as JSON."""
+    import main
+    main.configure_logging_from_args(args)
+    summary = _stored_summary(args.name)
+    if summary is None:
+        logger.error(f"No summary for '{args.name}' in {main.PROCESSED_DATA_DIR}. Analyze it first.")
+        return 1
+    if args.field:
+        if args.field not in summary:
+            logger.error(f"The summary of '{args.name}' has no field '{args.field}'. Fields: {', '.join(summary)}.")
+            return 1
+        value = summary[args.field]
+        print(value if isinstance(value, str) else json.dumps(value, indent=2))
+    else:
+        print(json.dumps(summary, indent=2))
+    return 0
+
+def build_parser():
+    """Builds the argument parser. Kept free of the config and analysis imports so --help answers quickly."""
+    parser = argparse.ArgumentParser(description="Analyze workout files and query their summaries.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_analysis_arguments(subparser):
+        subparser.add_argument('--workers', type=int, default=None,
+                               help="Number of worker processes (default: batch.workers from config, else CPU count).")
+        subparser.add_argument('--force', action='store_true', help="Reanalyze, ignoring the manifest.")
+        instrumentation.add_logging_arguments(subparser)
+
+    analyze_parser = subparsers.add_parser('analyze', help="Analyze the given workout files.")
+    analyze_parser.add_argument('files', nargs='+', metavar='FILE', help="A .tcx, .gpx or .fit file.")
+    add_analysis_arguments(analyze_parser)
+    analyze_parser.set_defaults(handler=analyze_command)
+
+    batch_parser = subparsers.add_parser('batch', help="Analyze new or changed files in the raw data directory.")
+    batch_parser.add_argument('--watch', action='store_true',
+                              help="Keep running and analyze files as they land in the raw data directory.")
+    batch_parser.add_argument('--poll', action='store_true',
+                              help="With --watch, poll the directory instead of using inotify.")
+    add_analysis_arguments(batch_parser)
+    batch_parser.set_defaults(handler=batch_command)
+
+    title_parser = subparsers.add_parser('title-only', help="Print the title of workout files, analyzing them if needed.")
+    title_parser.add_argument('files', nargs='+', metavar='FILE', help="A .tcx, .gpx or .fit file.")
+    add_analysis_arguments(title_parser)
+    title_parser.set_defaults(handler=title_command)
+
+    show_parser = subparsers.add_parser('show', help="Print a stored summary.")
+    show_parser.add_argument('name', help="Raw file path, file name or activity name (e.g. activity_123).")
+    show_parser.add_argument('--field', help="Print only this summary field (e.g. title, training_load).")
+    instrumentation.add_logging_arguments(show_parser)
+    show_parser.set_defaults(handler=show_command)
+    return parser
+
+def main_cli(argv=None):
+    """Runs one subcommand and returns the process exit status."""
+    args = build_parser().parse_args(argv)
+    try:
+        return args.handler(args)
+    except ValueError as e:  # e.g. an invalid config.yaml
+        logger.error(str(e))
+        return 2
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
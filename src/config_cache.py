@@ -0,0 +1,164 @@
+import json
+import numbers
+import os
+
+import instrumentation
+
+CONFIG_FILE = os.path.join(os.path.dirname(__file__), '..', 'config', 'config.yaml')
+CACHE_FILE = os.path.join(os.path.dirname(__file__), '..', 'data', 'cache', 'config.json')
+
+# Bump when validation or the cached layout change.
+CACHE_VERSION = 1
+
+# Sections whose values must all be numbers (or empty)
+INTERVAL_SECTIONS = ("power_interval_thresholds", "heart_rate_interval_thresholds")
+NUMERIC_SECTIONS = INTERVAL_SECTIONS + ("training_load",)
+# Interval threshold keys that are no longer read, and what replaced them
+RETIRED_KEYS = {'increase': "enter_above", 'decrease': "exit_below"}
+ZONE_SECTIONS = ("power_zones", "heart_rate_zones")
+COUNT_KEYS = {'batch': ("workers",), 'watch': ("queue_size",), 'server': ("workers", "queue_size", "port")}
+
+logger = instrumentation.get_logger("config_cache")
+
+def _section(config, name):
+    """A config section as a dict; empty when missing or not a mapping (reported separately)."""
+    value = config.get(name)
+    return value if isinstance(value, dict) else {}
+
+def _is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+def validate_config(config):
+    """
+    Checks the structure and value types of a loaded config.yaml.
+
+    Only what the analysis would otherwise trip over (or silently ignore) deep inside a run is
+    checked: sections are mappings, thresholds are numbers, zones are non-overlapping [lower, upper] pairs,
+    and the smoothing method, fill rules and worker counts are valid. Unknown sections and keys
+    are left alone; the retired `increase`/`decrease` interval thresholds are logged.
+
+    Args:
+        config (dict): The parsed config.
+
+    Returns:
+        dict: The config, unchanged.
+
+    Raises:
+        ValueError: Listing every problem found.
+    """
+    # Imported here: validation only runs when config.yaml changed, and these pull in numpy
+    import resampling
+    import utils
+    import zones
+
+    if not isinstance(config, dict):
+        raise ValueError(f"Invalid config: expected a mapping at the top level, got {type(config).__name__}.")
+    problems = []
+    for section, value in config.items():
+        if value is not None and not isinstance(value, dict):
+            problems.append(f"{section} must be a mapping")
+    for section in NUMERIC_SECTIONS:
+        for key, value in _section(config, section).items():
+            if value is not None and not _is_number(value):
+                problems.append(f"{section}.{key} must be a number")
+    for section in INTERVAL_SECTIONS:
+        thresholds = _section(config, section)
+        enter_above, exit_below = thresholds.get('enter_above'), thresholds.get('exit_below')
+        if _is_number(enter_above) and _is_number(exit_below) and enter_above < exit_below:
+            problems.append(f"{section}.enter_above must not be below {section}.exit_below")
+        for key, replacement in RETIRED_KEYS.items():
+            if key in thresholds:
+                logger.warning(f"{section}.{key} is no longer used; set {section}.{replacement} "
+                               f"(an absolute level) instead.")
+    for section in ZONE_SECTIONS:
+        found = len(problems)
+        for zone, bounds in _section(config, section).items():
+            if zone in zones.REFERENCE_KEYS:
+                if bounds is not None and not (_is_number(bounds) and bounds > 0):
+                    problems.append(f"{section}.{zone} must be a positive number")
+            elif not (isinstance(bounds, list) and len(bounds) == 2 and all(map(_is_number, bounds))):
+                problems.append(f"{section}.{zone} must be a [lower, upper] pair of numbers")
+        if len(problems) == found:  # Well-formed zones: check they do not overlap
+            try:
+                zones.compile_zones(_section(config, section), analysis_type=None)
+            except ValueError as error:
+                problems.append(f"{section}: {error}")
+    for section, keys in COUNT_KEYS.items():
+        for key, value in _section(config, section).items():
+            if key in keys and value is not None and not (_is_number(value) and value == int(value) and value >= 0):
+                problems.append(f"{section}.{key} must be a whole number of at least 0")
+    method = _section(config, 'smoothing').get('method')
+    if method is not None and method not in utils.SMOOTHING_METHODS:
+        problems.append(f"smoothing.method must be one of {utils.SMOOTHING_METHODS}")
+    fill = _section(config, 'resampling').get('fill') or {}
+    if not isinstance(fill, dict):
+        problems.append("resampling.fill must be a mapping of metric to fill rule")
+        fill = {}
+    for metric, rule in fill.items():
+        if rule not in resampling.FILL_RULES:
+            problems.append(f"resampling.fill.{metric} must be one of {resampling.FILL_RULES}")
+
+    if problems:
+        raise ValueError("Invalid config: " + "; ".join(problems) + ".")
+    return config
+
+def _source_key(config_file):
+    stat = os.stat(config_file)
+    return {'version': CACHE_VERSION, 'path': os.path.abspath(config_file),
+            'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def _read_cache(cache_file, key):
+    try:
+        with open(cache_file, 'r') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return cached['config'] if cached.get('key') == key else None
+
+def _write_cache(cache_file, key, config):
+    encoded = json.dumps({'key': key, 'config': config})
+    if json.loads(encoded)['config'] != config:
+        return  # Not plain JSON data (e.g. dates or numeric keys): keep parsing the YAML instead
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        temp_path = f"{cache_file}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            f.write(encoded)
+        os.replace(temp_path, cache_file)
+    except OSError as e:
+        logger.debug(f"Could not write the config cache: {e}")
+
+def load_config(config_file=CONFIG_FILE, cache_file=CACHE_FILE):
+    """
+    Loads and validates config.yaml, through a JSON cache of the parsed result.
+
+    The cache is keyed on the file's path, size and mtime, so it is only rebuilt after the
+    config changes. A cache hit costs a JSON read: neither PyYAML nor the validation (which
+    imports the analysis modules) are loaded.
+
+    Args:
+        config_file (str): Path to config.yaml.
+        cache_file (str): Path to the cache, or None to always parse the YAML.
+
+    Returns:
+        dict: The config, or an empty config if the file is missing.
+
+    Raises:
+        ValueError: If the config is invalid (see `validate_config`).
+    """
+    try:
+        key = _source_key(config_file)
+    except FileNotFoundError:
+        logger.warning(f"Configuration file '{config_file}' not found. Using default settings.")
+        return {}
+    if cache_file:
+        cached = _read_cache(cache_file, key)
+        if cached is not None:
+            return cached
+
+    import yaml
+    with open(config_file, 'r') as f:
+        config = validate_config(yaml.safe_load(f) or {})
+    if cache_file:
+        _write_cache(cache_file, key, config)
+    return config
@@ -1,87 +1,685 @@
-import xml.etree.ElementTree as ET
-import gpxpy
-import gpxpy.gpx
-
-def parse_tcx_file(file_path):
-    """Parses a TCX file and extracts timestamp, power, and heart rate data."""
-    data = []
-    try:
-        tree = ET.parse(file_path)
-        root = tree.getroot()
-        namespace = {'ns': 'http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2',
-                     'ns3': 'http://www.garmin.com/xmlschemas/ActivityExtension/v2'}  # Add the ns3 namespace
-
-        for lap in root.findall('.//ns:Lap', namespace):
-            for track in lap.findall('.//ns:Track', namespace):
-                for trackpoint in track.findall('.//ns:Trackpoint', namespace):
-                    timestamp_elem = trackpoint.find('ns:Time', namespace)
-                    hr_elem = trackpoint.find('ns:HeartRateBpm/ns:Value', namespace)
-                    power_elem = trackpoint.find('ns:Extensions/ns3:TPX/ns3:Watts', namespace) # Use the namespace
-
-                    timestamp = timestamp_elem.text if timestamp_elem is not None else None
-                    heart_rate = int(hr_elem.text) if hr_elem is not None and hr_elem.text.isdigit() else None
-                    power = int(power_elem.text) if power_elem is not None and power_elem.text.isdigit() else None
-
-                    if timestamp:
-                        data.append({'timestamp': timestamp, 'power': power, 'heart_rate': heart_rate})
-
-    except FileNotFoundError:
-        print(f"Error: TCX file not found at {file_path}")
-    except ET.ParseError:
-        print(f"Error: Could not parse TCX file at {file_path}")
-    return data
-
-def parse_gpx_file(file_path):
-    """Parses a GPX file and extracts timestamp and heart rate data (if available)."""
-    data = []
-    try:
-        with open(file_path, 'r') as f:
-            gpx = gpxpy.parse(f)
-            for track in gpx.tracks:
-                for segment in track.segments:
-                    for point in segment.points:
-                        timestamp = point.time.isoformat() if point.time else None
-                        heart_rate = None
-                        for extension in point.extensions:
-                            if extension.tag.endswith('TrackPointExtension'):
-                                for child in extension:
-                                    if child.tag.endswith('hr'):
-                                        if child.text and child.text.isdigit():
-                                            heart_rate = int(child.text)
-                                        break
-                                break
-                        if timestamp:
-                            data.append({'timestamp': timestamp, 'power': None, 'heart_rate': heart_rate})
-
-    except FileNotFoundError:
-        print(f"Error: GPX file not found at {file_path}")
-    except gpxpy.gpx.GPXException as e:
-        print(f"Error parsing GPX file at {file_path}: {e}")
-    return data
-
-def parse_workout_file(file_path):
-    """Parses a workout file and returns a list of data points."""
-    if file_path.lower().endswith('.tcx'):
-        return parse_tcx_file(file_path)
-    elif file_path.lower().endswith('.gpx'):
-        return parse_gpx_file(file_path)
-    else:
-        print(f"Warning: Unsupported file format for {file_path}. Skipping.")
-        return []
-
-if __name__ == "__main__":
-    # Example usage (assuming you have sample TCX and GPX files in the data/raw directory)
-    tcx_file = '../data/raw/activity_18223135043.tcx'  # Use your actual file name
-    gpx_file = '../data/raw/workout2.gpx'
-
-    tcx_data = parse_tcx_file(tcx_file)
-    if tcx_data:
-        print(f"Parsed {len(tcx_data)} data points from {tcx_file}. First 10:")
-        for item in tcx_data[:10]:
-            print(item)
-
-    gpx_data = parse_gpx_file(gpx_file)
-    if gpx_data:
-        print(f"\nParsed {len(gpx_data)} data points from {gpx_file}. First 5:")
-        for item in gpx_data[:5]:
+import itertools
+import mmap
+import os
+import struct
+import xml.etree.ElementTree as ET
+import numpy as np
+from workout_stream import METRICS, WorkoutStream, format_timestamp
+import instrumentation
+
+logger = instrumentation.get_logger("data_parser")
+
+TCX_NAMESPACE = '{http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2}'
+TCX_EXTENSION_NAMESPACE = '{http://www.garmin.com/xmlschemas/ActivityExtension/v2}'
+
+def iter_tcx_trackpoints(file_path):
+    """
+    Streams trackpoints from a TCX file one at a time.
+
+    The document is walked once with incremental XML parsing. Each finished
+    Trackpoint element is cleared and detached from its parent, so peak memory
+    stays flat regardless of how long the activity is.
+
+    Args:
+        file_path (str): Path to the TCX file.
+
+    Yields:
+        dict: {'timestamp', 'power', 'heart_rate', 'cadence', 'distance', 'speed', 'temperature'}
+              for every trackpoint with a time. Power, heart rate and cadence are ints; TCX has
+              no temperature, so it is always None.
+    """
+    trackpoint_tag = TCX_NAMESPACE + 'Trackpoint'
+    time_tag = TCX_NAMESPACE + 'Time'
+    value_tag = TCX_NAMESPACE + 'Value'
+    heart_rate_tag = TCX_NAMESPACE + 'HeartRateBpm'
+    watts_tag = TCX_EXTENSION_NAMESPACE + 'Watts'
+    cadence_tags = (TCX_NAMESPACE + 'Cadence', TCX_EXTENSION_NAMESPACE + 'RunCadence')
+    distance_tag = TCX_NAMESPACE + 'DistanceMeters'
+    speed_tag = TCX_EXTENSION_NAMESPACE + 'Speed'
+
+    parents = []
+    dropped = 0
+    in_trackpoint = False
+    in_heart_rate = False
+    timestamp = heart_rate = power = cadence = distance = speed = None
+
+    for event, elem in ET.iterparse(file_path, events=('start', 'end')):
+        tag = elem.tag
+        if event == 'start':
+            parents.append(elem)
+            if tag == trackpoint_tag:
+                in_trackpoint = True
+                timestamp = heart_rate = power = cadence = distance = speed = None
+            elif tag == heart_rate_tag and in_trackpoint:
+                in_heart_rate = True
+            continue
+
+        parents.pop()
+        if not in_trackpoint:
+            continue
+
+        if tag == time_tag:
+            timestamp = elem.text
+        elif tag == value_tag and in_heart_rate:
+            text = elem.text
+            heart_rate = int(text) if text and text.isdigit() else None
+        elif tag == heart_rate_tag:
+            in_heart_rate = False
+        elif tag == watts_tag:
+            text = elem.text
+            power = int(text) if text and text.isdigit() else None
+        elif tag in cadence_tags:
+            text = elem.text
+            cadence = int(text) if text and text.isdigit() else None
+        elif tag == distance_tag:
+            try:
+                distance = float(elem.text)
+            except (TypeError, ValueError):
+                distance = None
+        elif tag == speed_tag:
+            try:
+                speed = float(elem.text)
+            except (TypeError, ValueError):
+                speed = None
+        elif tag == trackpoint_tag:
+            in_trackpoint = False
+            elem.clear()
+            if parents:
+                parents[-1].remove(elem)  # Drop the finished point from the tree
+            if timestamp:
+                yield {'timestamp': timestamp, 'power': power, 'heart_rate': heart_rate,
+                       'cadence': cadence, 'distance': distance, 'speed': speed, 'temperature': None}
+            else:
+                dropped += 1
+
+    if dropped:
+        instrumentation.count('points_dropped', dropped)
+
+def parse_tcx_file(file_path):
+    """Parses a TCX file and extracts timestamp, power, and heart rate data."""
+    data = []
+    try:
+        data.extend(iter_tcx_trackpoints(file_path))
+    except FileNotFoundError:
+        logger.error(f"TCX file not found at {file_path}")
+    except ET.ParseError:
+        logger.error(f"Could not parse TCX file at {file_path}")
+        data = []
+    return data
+
+# Local names of GPX extension elements -> metric. Matched without namespace, so Garmin
+# TrackPointExtension (hr, cad, atemp), PowerExtension (PowerInWatts), Cluetrust gpxdata
+# (hr, cadence, temp) and the bare <power> written by Strava and others are all recognized.
+GPX_EXTENSION_FIELDS = {
+    'hr': 'heart_rate', 'heartrate': 'heart_rate', 'heart_rate': 'heart_rate',
+    'power': 'power', 'powerinwatts': 'power', 'watts': 'power',
+    'cad': 'cadence', 'cadence': 'cadence',
+    'atemp': 'temperature', 'temp': 'temperature', 'temperature': 'temperature',
+    'speed': 'speed', 'distance': 'distance',
+}
+
+# Read as ints, as in TCX files (decimal values, which some writers emit, are rounded)
+GPX_INTEGER_FIELDS = ('power', 'heart_rate', 'cadence')
+
+_gpx_tag_fields = {}
+
+def _gpx_field(tag):
+    """Maps an element tag to 'trkpt', 'time', a metric name or None, memoized per distinct tag."""
+    try:
+        return _gpx_tag_fields[tag]
+    except KeyError:
+        local_name = tag.rpartition('}')[2].lower()
+        field = local_name if local_name in ('trkpt', 'time') else GPX_EXTENSION_FIELDS.get(local_name)
+        _gpx_tag_fields[tag] = field
+        return field
+
+class _GpxTarget:
+    """
+    XMLParser target collecting trackpoints. Expat calls it directly, so no Element objects
+    (and no tree) are ever built; only the text of recognized fields inside a trkpt is kept.
+    """
+
+    def __init__(self):
+        self.points = []
+        self.point = None
+        self.field = None
+        self.text = ''
+        self.dropped = 0
+
+    def start(self, tag, attrib):
+        field = _gpx_field(tag)
+        if field == 'trkpt':
+            self.point = {}
+        elif field is not None and self.point is not None:
+            self.field = field
+            self.text = ''
+
+    def data(self, text):
+        if self.field is not None:
+            self.text += text
+
+    def end(self, tag):
+        field = self.field
+        if field is not None:
+            self.field = None
+            if field in self.point:
+                return  # The first value found for a field wins
+            if field == 'time':
+                self.point['timestamp'] = self.text.strip() or None
+                self.point[field] = True
+            else:
+                try:
+                    value = float(self.text)
+                except ValueError:
+                    return
+                if field in GPX_INTEGER_FIELDS:
+                    value = int(round(value)) if np.isfinite(value) else None
+                self.point[field] = value
+        elif self.point is not None and _gpx_field(tag) == 'trkpt':
+            point = self.point
+            self.point = None
+            if point.get('timestamp'):
+                self.points.append({'timestamp': point['timestamp'], 'power': point.get('power'),
+                                    'heart_rate': point.get('heart_rate'), 'cadence': point.get('cadence'),
+                                    'distance': point.get('distance'), 'speed': point.get('speed'),
+                                    'temperature': point.get('temperature')})
+            else:
+                self.dropped += 1
+
+    def close(self):
+        pass
+
+def iter_gpx_trackpoints(file_path, chunk_size=1 << 16):
+    """
+    Streams trackpoints from a GPX file.
+
+    The file is fed to expat in chunks in a single pass, and points are yielded after every chunk,
+    so memory stays bounded by the chunk size regardless of the track length. Extension values
+    are recognized by element name in any namespace (see GPX_EXTENSION_FIELDS).
+
+    Args:
+        file_path (str): Path to the GPX file.
+        chunk_size (int): Bytes read per step.
+
+    Yields:
+        dict: {'timestamp', 'power', 'heart_rate', 'cadence', 'distance', 'speed', 'temperature'}
+              for every trackpoint with a time, with the same keys and types as
+              `iter_tcx_trackpoints`.
+    """
+    target = _GpxTarget()
+    parser = ET.XMLParser(target=target)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            parser.feed(chunk)
+            if target.points:
+                yield from target.points
+                target.points = []
+    parser.close()
+    yield from target.points
+    if target.dropped:
+        instrumentation.count('points_dropped', target.dropped)
+
+def parse_gpx_file(file_path):
+    """Parses a GPX file and extracts timestamp, power, heart rate, cadence and temperature data."""
+    data = []
+    try:
+        data.extend(iter_gpx_trackpoints(file_path))
+    except FileNotFoundError:
+        logger.error(f"GPX file not found at {file_path}")
+    except ET.ParseError as e:
+        logger.error(f"Could not parse GPX file at {file_path}: {e}")
+        data = []
+    return data
+
+# --- FIT ---
+
+# FIT timestamps count seconds from 1989-12-31T00:00:00Z.
+FIT_EPOCH = 631065600
+
+FIT_RECORD_MESSAGE = 20
+FIT_FIELD_DESCRIPTION_MESSAGE = 206
+FIT_TIMESTAMP_FIELD = 253
+
+# Base type number -> (NumPy type code, invalid value)
+FIT_BASE_TYPES = {
+    0x00: ('u1', 0xFF), 0x01: ('i1', 0x7F), 0x02: ('u1', 0xFF), 0x83: ('i2', 0x7FFF),
+    0x84: ('u2', 0xFFFF), 0x85: ('i4', 0x7FFFFFFF), 0x86: ('u4', 0xFFFFFFFF), 0x88: ('f4', None),
+    0x89: ('f8', None), 0x0A: ('u1', 0), 0x8B: ('u2', 0), 0x8C: ('u4', 0), 0x0D: ('u1', 0xFF),
+    0x8E: ('i8', 0x7FFFFFFFFFFFFFFF), 0x8F: ('u8', 0xFFFFFFFFFFFFFFFF), 0x90: ('u8', 0),
+}
+FIT_STRING = 0x07
+
+# Record message field number -> (metric, scale). Enhanced speed wins over speed when both exist.
+FIT_RECORD_FIELDS = {
+    7: ('power', 1.0),
+    3: ('heart_rate', 1.0),
+    4: ('cadence', 1.0),
+    5: ('distance', 100.0),
+    6: ('speed', 1000.0),
+    73: ('speed', 1000.0),
+    13: ('temperature', 1.0),
+}
+
+# Developer field names (lowercase) recognized as metrics, e.g. running power from a foot pod.
+FIT_DEVELOPER_NAMES = {
+    'power': 'power', 'watts': 'power', 'heart_rate': 'heart_rate', 'heart rate': 'heart_rate',
+    'cadence': 'cadence', 'speed': 'speed', 'distance': 'distance', 'temperature': 'temperature',
+}
+
+_FIT_HEADER = struct.Struct("<BBHI4s")
+
+def _fit_crc_table():
+    crc = np.arange(256, dtype=np.uint16)
+    for _ in range(8):
+        crc = np.where(crc & 1, (crc >> 1) ^ 0xA001, crc >> 1).astype(np.uint16)
+    return crc
+
+_FIT_CRC_TABLE = _fit_crc_table()
+_FIT_CRC_BLOCK = 16
+
+def _fit_crc(data):
+    """
+    Returns FIT's CRC-16 (CRC-16/ARC) of a uint8 array.
+
+    The CRC starts at 0 and has no final xor, so it is linear in the data. The data is cut into
+    blocks of _FIT_CRC_BLOCK bytes whose CRCs are computed side by side, one byte column per
+    step; neighbouring CRCs are then combined pairwise, carrying the left one over the bytes of
+    the right one, until one is left. Zero bytes in front leave a zero CRC unchanged, which pads
+    the data to a power-of-two number of blocks.
+    """
+    count = 1 << max(0, int(np.ceil(np.log2(max(len(data), 1) / _FIT_CRC_BLOCK))))
+    padded = np.zeros(count * _FIT_CRC_BLOCK, dtype=np.uint8)
+    padded[len(padded) - len(data):] = data
+    blocks = padded.reshape(count, _FIT_CRC_BLOCK)
+    crcs = np.zeros(count, dtype=np.uint16)
+    # The carry over n zero bytes is linear too: `carry` tabulates it for a CRC's low byte, then its high byte
+    carry = np.concatenate((np.arange(256, dtype=np.uint16), np.arange(256, dtype=np.uint16) << 8))
+    for column in range(_FIT_CRC_BLOCK):
+        crcs = (crcs >> 8) ^ _FIT_CRC_TABLE[(crcs ^ blocks[:, column]) & 0xFF]
+        carry = (carry >> 8) ^ _FIT_CRC_TABLE[carry & 0xFF]
+    while len(crcs) > 1:
+        left, right = crcs[0::2], crcs[1::2]
+        crcs = carry[left & 0xFF] ^ carry[256 + (left >> 8)] ^ right
+        carry = carry[carry & 0xFF] ^ carry[256 + (carry >> 8)]  # Now over twice as many bytes
+    return int(crcs[0])
+
+class FitParseError(ValueError):
+    """The file is not a well-formed FIT file."""
+
+class _FitDefinition:
+    """Layout of one local message type: a NumPy structured dtype covering the whole message."""
+
+    __slots__ = ('global_number', 'byte_order', 'size', 'dtype', 'fields', 'developer_fields',
+                 'timestamp_offset', 'timestamp_format')
+
+    def __init__(self, global_number, big_endian, fields, developer_fields):
+        self.global_number = global_number
+        self.byte_order = byte_order = '>' if big_endian else '<'
+        self.fields = {}            # field number -> base type
+        self.developer_fields = []  # (developer data index, field number)
+        self.timestamp_offset = None  # Byte offset of a uint32 timestamp field in the message
+        self.timestamp_format = struct.Struct(byte_order + "I")
+        names, formats, offsets = ['header'], ['u1'], [0]
+        offset = 1
+        for number, size, base_type in fields:
+            code, _ = FIT_BASE_TYPES.get(base_type & 0x9F, (None, None))
+            name = f"f{number}"
+            if name not in names:
+                if base_type == FIT_STRING or code is None or np.dtype(code).itemsize > size:
+                    code = f"V{size}"  # Strings, unknown types and malformed sizes are kept as raw bytes
+                else:
+                    self.fields[number] = base_type & 0x9F
+                    if number == FIT_TIMESTAMP_FIELD and code == 'u4':
+                        self.timestamp_offset = offset
+                names.append(name)
+                formats.append(byte_order + code if code[0] != 'V' else code)
+                offsets.append(offset)
+            offset += size
+        for number, size, developer_index in developer_fields:
+            name = f"d{developer_index}_{number}"
+            if name not in names:
+                names.append(name)
+                formats.append(f"V{size}")
+                offsets.append(offset)
+                self.developer_fields.append((developer_index, number))
+            offset += size
+        self.size = offset
+        self.dtype = np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': offset})
+
+def _fit_values(messages, definition, number):
+    """Returns field `number` of every message as float64 with NaN for invalid values, or None."""
+    base_type = definition.fields.get(number)
+    if base_type is None:
+        return None
+    raw = messages[f"f{number}"]
+    values = raw.astype(np.float64)
+    invalid = FIT_BASE_TYPES[base_type][1]
+    if invalid is not None:
+        values[raw == invalid] = np.nan
+    return values
+
+def _fit_developer_values(messages, name, description, byte_order):
+    """Decodes one developer field of every message using its field description."""
+    code, invalid = FIT_BASE_TYPES.get(description['base_type'] & 0x9F, (None, None))
+    field = messages[name]
+    if code is None or np.dtype(code).itemsize > field.dtype.itemsize:
+        return None
+    raw = np.frombuffer(field.tobytes(), dtype=np.uint8).reshape(len(field), -1)[:, :np.dtype(code).itemsize]
+    raw = np.ascontiguousarray(raw).view(byte_order + code).ravel()
+    values = raw.astype(np.float64)
+    if invalid is not None:
+        values[raw == invalid] = np.nan
+    return values / description['scale'] - description['offset']
+
+def _register_fit_description(message, definition, descriptions):
+    """Stores a field_description message, mapping the developer field to a metric by name or native field."""
+    def field(number, default=None):
+        if number not in definition.fields:
+            return default
+        value = message[f"f{number}"].item()
+        invalid = FIT_BASE_TYPES[definition.fields[number]][1]
+        return default if value == invalid else value
+
+    def text(number):
+        name = f"f{number}"
+        if name not in message.dtype.names:
+            return ""
+        return bytes(message[name]).split(b"\0", 1)[0].decode("utf-8", errors="replace")
+
+    native_field = field(15)
+    metric = None
+    if field(14) in (None, FIT_RECORD_MESSAGE) and native_field in FIT_RECORD_FIELDS:
+        metric, _ = FIT_RECORD_FIELDS[native_field]
+    else:
+        metric = FIT_DEVELOPER_NAMES.get(text(3).strip().lower())
+    descriptions[(field(0, 0), field(1, 0))] = {
+        'metric': metric,
+        'base_type': field(2, 0x02),
+        'scale': field(6, 1) or 1,
+        'offset': field(7, 0),
+    }
+
+def _read_fit_definition(buffer, position, end):
+    """Reads the definition message at `position`. Returns (local type, _FitDefinition, next position)."""
+    header = buffer[position]
+    if position + 6 > end:
+        raise FitParseError("Truncated definition message")
+    big_endian = buffer[position + 2] == 1
+    global_number, = struct.unpack_from(">H" if big_endian else "<H", buffer, position + 3)
+    fields_end = position + 6 + 3 * buffer[position + 5]
+    fields = [tuple(buffer[i:i + 3]) for i in range(position + 6, fields_end, 3)]
+    developer_fields = []
+    if header & 0x20 and fields_end < end:
+        developer_end = fields_end + 1 + 3 * buffer[fields_end]
+        developer_fields = [tuple(buffer[i:i + 3]) for i in range(fields_end + 1, developer_end, 3)]
+        fields_end = developer_end
+    if fields_end > end:
+        raise FitParseError("Truncated definition message")
+    return header & 0x0F, _FitDefinition(global_number, big_endian, fields, developer_fields), fields_end
+
+def _scan_fit(buffer, start, end, definitions, found, timestamp):
+    """
+    Walks the messages between `start` and `end`, one header at a time.
+
+    Definition messages update `definitions` (local type -> _FitDefinition). For every data
+    message, its position and timestamp are appended to found[definition]: the timestamp field,
+    or for a compressed-timestamp header the previous timestamp advanced to the header's 5-bit
+    offset (NaN while no full timestamp has been seen).
+
+    Returns:
+        int or None: The last timestamp, which carries over into a chained file.
+    """
+    position = start
+    while position < end:
+        header = buffer[position]
+        if header & 0x80:  # Compressed timestamp header: local type in bits 5-6, time offset in bits 0-4
+            local_type = (header >> 5) & 0x03
+        elif header & 0x40:
+            local_type, definition, position = _read_fit_definition(buffer, position, end)
+            definitions[local_type] = definition
+            continue
+        else:
+            local_type = header & 0x0F
+
+        definition = definitions.get(local_type)
+        if definition is None:
+            raise FitParseError(f"Data message for undefined local type {local_type}")
+        if position + definition.size > end:
+            raise FitParseError("Truncated data message")
+        message_timestamp = np.nan
+        if header & 0x80:
+            if timestamp is not None:
+                timestamp += ((header & 0x1F) - timestamp) & 0x1F
+                message_timestamp = timestamp
+        elif definition.timestamp_offset is not None:
+            value, = definition.timestamp_format.unpack_from(buffer, position + definition.timestamp_offset)
+            if value != 0xFFFFFFFF:
+                timestamp = message_timestamp = value
+        positions, timestamps = found.setdefault(definition, ([], []))
+        positions.append(position)
+        timestamps.append(message_timestamp)
+        position += definition.size
+    return timestamp
+
+def _decode_fit(buffer):
+    """Decodes the record messages of a FIT file held in `buffer` (bytes or mmap)."""
+    view = np.frombuffer(buffer, dtype=np.uint8)
+    found = {}  # _FitDefinition -> (positions, timestamps) of its messages
+    timestamp = None
+    position = 0
+    while position + 12 <= len(buffer):  # Chained FIT files follow each other
+        header_size, _, _, data_size, signature = _FIT_HEADER.unpack_from(buffer, position)
+        if signature != b".FIT" or header_size < 12:
+            if found:
+                break  # Trailing padding after a complete file
+            raise FitParseError("Missing .FIT signature")
+        start = position + header_size
+        end = start + data_size
+        if end > len(buffer):
+            raise FitParseError("Data size exceeds the file")
+        if end + 2 > len(buffer):
+            raise FitParseError("Missing file CRC")
+        if header_size >= 14:
+            header_crc = int(view[position + 12]) | int(view[position + 13]) << 8
+            if header_crc and _fit_crc(view[position:position + 12]) != header_crc:
+                raise FitParseError("Header CRC mismatch")
+        if _fit_crc(view[position:end + 2]):  # The CRC of data followed by its own CRC is 0
+            raise FitParseError("File CRC mismatch")
+        timestamp = _scan_fit(buffer, start, end, {}, found, timestamp)
+        position = end + 2
+
+    # Field descriptions first: record messages need them for their developer fields
+    descriptions = {}  # (developer data index, field number) -> field description
+    decoded = []
+    for definition, (positions, timestamps) in sorted(found.items(), key=lambda item: item[0].global_number != FIT_FIELD_DESCRIPTION_MESSAGE):
+        if definition.global_number not in (FIT_FIELD_DESCRIPTION_MESSAGE, FIT_RECORD_MESSAGE):
+            continue
+        positions = np.array(positions)
+        messages = view[positions[:, None] + np.arange(definition.size)].view(definition.dtype).ravel()
+        if definition.global_number == FIT_FIELD_DESCRIPTION_MESSAGE:
+            for message in messages:
+                _register_fit_description(message, definition, descriptions)
+        else:
+            decoded.append((definition, positions, np.array(timestamps, dtype=np.float64), messages))
+    if not decoded:
+        return None
+
+    columns = {metric: [] for metric in ('position', 'timestamp') + METRICS}
+    for definition, positions, timestamps, messages in decoded:
+        count = len(messages)
+        columns['position'].append(positions)
+        columns['timestamp'].append(timestamps)
+        values = {}
+        for number, (metric, scale) in FIT_RECORD_FIELDS.items():
+            field_values = _fit_values(messages, definition, number)
+            if field_values is not None and (metric not in values or number == 73):
+                values[metric] = field_values / scale
+        for developer_index, number in definition.developer_fields:
+            description = descriptions.get((developer_index, number))
+            if description is None or description['metric'] is None or description['metric'] in values:
+                continue  # Standard fields take precedence
+            field_values = _fit_developer_values(messages, f"d{developer_index}_{number}", description, definition.byte_order)
+            if field_values is not None:
+                values[description['metric']] = field_values
+        for metric in METRICS:
+            columns[metric].append(values.get(metric, np.full(count, np.nan)))
+
+    arrays = {metric: np.concatenate(parts) for metric, parts in columns.items()}
+    order = np.argsort(arrays.pop('position'), kind='stable')
+    timed = ~np.isnan(arrays['timestamp'][order])
+    order = order[timed]
+    dropped = int(len(timed) - timed.sum())
+    if dropped:
+        instrumentation.count('points_dropped', dropped)
+    timestamps = arrays.pop('timestamp')[order] + FIT_EPOCH
+    return WorkoutStream(timestamps, **{metric: values[order] for metric, values in arrays.items()})
+
+def parse_fit_stream(file_path):
+    """
+    Decodes a FIT file's record messages straight into a WorkoutStream.
+
+    The file is memory-mapped and walked once, message by message, noting where each data message
+    starts and its timestamp (compressed timestamp headers are expanded as they come). The record
+    messages of each definition are then read in one go as a structured array, so the field
+    values are extracted in NumPy. Developer fields described as power, heart rate, cadence,
+    speed or distance fill metrics the standard fields lack. The header and file CRCs are
+    checked (with a vectorized CRC) before anything is decoded.
+
+    Args:
+        file_path (str): Path to the FIT file.
+
+    Returns:
+        WorkoutStream or None: The stream (distance in m, speed in m/s), or None if the file has no records.
+
+    Raises:
+        FileNotFoundError: If the file does not exist.
+        FitParseError: If the file is malformed, truncated or fails its CRC check.
+    """
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise FitParseError("Empty file")
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return _decode_fit(mapped)
+    except (IndexError, struct.error) as e:
+        raise FitParseError(f"Truncated FIT file: {e}") from e
+    finally:
+        try:
+            mapped.close()
+        except BufferError:
+            pass  # Still referenced from a traceback; closed when collected
+
+def parse_fit_file(file_path):
+    """Parses a FIT file and returns its records as data point dicts (like `parse_tcx_file`)."""
+    try:
+        stream = parse_fit_stream(file_path)
+    except FileNotFoundError:
+        logger.error(f"FIT file not found at {file_path}")
+        return []
+    except FitParseError as e:
+        logger.error(f"Could not parse FIT file at {file_path}: {e}")
+        return []
+    if stream is None:
+        return []
+    data = []
+    for i, timestamp in enumerate(stream.timestamps):
+        point = {'timestamp': format_timestamp(timestamp)}
+        for metric, values in stream.metrics.items():
+            point[metric] = None if np.isnan(values[i]) else float(values[i])
+        data.append(point)
+    return data
+
+def parse_workout_file(file_path):
+    """Parses a workout file and returns a list of data points."""
+    if file_path.lower().endswith('.tcx'):
+        return parse_tcx_file(file_path)
+    elif file_path.lower().endswith('.gpx'):
+        return parse_gpx_file(file_path)
+    elif file_path.lower().endswith('.fit'):
+        return parse_fit_file(file_path)
+    else:
+        logger.warning(f"Unsupported file format for {file_path}. Skipping.")
+        return []
+
+def iter_workout_chunks(file_path, chunk_size=3600):
+    """
+    Parses a workout file into consecutive WorkoutStream chunks, for the online analysis.
+
+    TCX and GPX files are read incrementally, so memory stays bounded by `chunk_size` however
+    long the activity is; a missing or malformed file raises FileNotFoundError or ET.ParseError
+    at the first chunk that hits it. Other files (FIT) are parsed whole with
+    `parse_workout_stream` and then cut up, yielding nothing if they cannot be parsed.
+
+    Args:
+        file_path (str): Path to a .tcx, .gpx or .fit file.
+        chunk_size (int): Samples per chunk.
+
+    Yields:
+        WorkoutStream: The next `chunk_size` samples (fewer in the last chunk).
+    """
+    if file_path.lower().endswith(('.tcx', '.gpx')):
+        points = iter_tcx_trackpoints(file_path) if file_path.lower().endswith('.tcx') else iter_gpx_trackpoints(file_path)
+        while True:
+            chunk = WorkoutStream.from_points(itertools.islice(points, chunk_size))
+            if not len(chunk):
+                return
+            yield chunk
+    stream = parse_workout_stream(file_path)
+    if stream is None:
+        return
+    for start in range(0, len(stream), chunk_size):
+        yield WorkoutStream(stream.timestamps[start:start + chunk_size],
+                            **{metric: stream.metrics[metric][start:start + chunk_size] for metric in METRICS})
+
+def parse_workout_stream(file_path):
+    """
+    Parses a workout file into a columnar WorkoutStream.
+
+    Timestamps are converted to epoch seconds once here, so downstream stages
+    never parse them again.
+
+    Returns:
+        WorkoutStream or None: The parsed stream, or None if nothing could be parsed.
+    """
+    if file_path.lower().endswith(('.tcx', '.gpx')):
+        kind = file_path[-3:].upper()
+        trackpoints = iter_tcx_trackpoints if kind == 'TCX' else iter_gpx_trackpoints
+        try:
+            stream = WorkoutStream.from_points(trackpoints(file_path))
+        except FileNotFoundError:
+            logger.error(f"{kind} file not found at {file_path}")
+            return None
+        except ET.ParseError:
+            logger.error(f"Could not parse {kind} file at {file_path}")
+            return None
+    elif file_path.lower().endswith('.fit'):
+        try:
+            stream = parse_fit_stream(file_path)
+        except FileNotFoundError:
+            logger.error(f"FIT file not found at {file_path}")
+            return None
+        except FitParseError as e:
+            logger.error(f"Could not parse FIT file at {file_path}: {e}")
+            return None
+        if stream is None:
+            return None
+    else:
+        stream = WorkoutStream.from_points(parse_workout_file(file_path))
+    return stream if len(stream) else None
+
+if __name__ == "__main__":
+    # Example usage (assuming you have sample TCX and GPX files in the data/raw directory)
+    tcx_file = '../data/raw/activity_18223135043.tcx'  # Use your actual file name
+    gpx_file = '../data/raw/workout2.gpx'
+
+    tcx_data = parse_tcx_file(tcx_file)
+    if tcx_data:
+        print(f"Parsed {len(tcx_data)} data points from {tcx_file}. First 10:")
+        for item in tcx_data[:10]:
+            print(item)
+
+    gpx_data = parse_gpx_file(gpx_file)
+    if gpx_data:
+        print(f"\nParsed {len(gpx_data)} data points from {gpx_file}. First 5:")
+        for item in gpx_data[:5]:
             print(item)
\ No newline at end of file
@@ -1,25 +1,414 @@
-from garminconnect import Garmin, GarminConnectAuthenticationError
-import json
-
-try:
-    # Attempt to load a previous session
-    with open("session.json") as f:
-        saved_session = json.load(f)
-        client = Garmin(session_data=saved_session)
-        client.login()
-except (FileNotFoundError, GarminConnectAuthenticationError):
-    # Login with credentials if session is invalid or not present
-    client = Garmin()
-    client.login("runar.kroyer@gmail.com", "Oakley95")
-    # Save session for future use
-    with open("session.json", "w") as f:
-        json.dump(client.session_data, f)
-
-
-# Fetch activities
-activities = client.get_activities(0, 10)  # Fetch last 10 activities
-
-# Edit the title of a specific workout
-activity_id = activities[0]['activityId']  # Example: first activity ID
-new_title = "Updated Workout Title"
-client.update_activity(activity_id, {"title": new_title})
\ No newline at end of file
+import abc
+import argparse
+import io
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import instrumentation
+import main as analysis
+
+logger = instrumentation.get_logger("garmin_connect")
+
+RAW_DATA_DIR = analysis.RAW_DATA_DIR
+PROCESSED_DATA_DIR = analysis.PROCESSED_DATA_DIR
+CHECKPOINT_FILE = os.path.join(os.path.dirname(__file__), '..', 'data', 'garmin_sync.json')
+TOKEN_STORE = os.environ.get("GARMINTOKENS", os.path.join(os.path.expanduser("~"), ".garminconnect"))
+KEYRING_SERVICE = "auto_diary.garmin"
+
+FORMATS = ("tcx", "fit")
+
+DEFAULT_SYNC_CONFIG = {
+    'format': "tcx",
+    'page_size': 100,
+    'download_workers': 4,
+    'requests_per_second': 2.0,
+    'burst': 4,
+    'max_retries': 5,
+    'backoff_seconds': 1.0,
+}
+
+class SyncError(Exception):
+    """A request to the activity service failed for good."""
+
+class RetryableError(SyncError):
+    """A request failed in a way worth retrying (rate limited, timeout, server error)."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+# --- Clients ---
+
+class ActivityClient(abc.ABC):
+    """
+    The calls the sync needs from an activity service. Activities are dicts with 'id', 'start'
+    (epoch seconds) and 'name'. Implementations raise RetryableError for transient failures.
+    """
+
+    @abc.abstractmethod
+    def list_activities(self, start, limit):
+        """Returns up to `limit` activities, newest first, skipping the `start` newest."""
+
+    @abc.abstractmethod
+    def download(self, activity_id, file_format):
+        """Returns the activity file contents in `file_format` ("tcx" or "fit")."""
+
+    @abc.abstractmethod
+    def set_title(self, activity_id, title):
+        """Renames an activity."""
+
+def get_credentials():
+    """
+    Returns (email, password) from GARMIN_EMAIL / GARMIN_PASSWORD, falling back to the system
+    keyring (if the optional `keyring` package is installed) for the password.
+    """
+    email = os.environ.get("GARMIN_EMAIL")
+    password = os.environ.get("GARMIN_PASSWORD")
+    if email and not password:
+        try:
+            import keyring
+            password = keyring.get_password(KEYRING_SERVICE, email)
+        except ImportError:
+            pass
+    if not email or not password:
+        raise SyncError("Set GARMIN_EMAIL and either GARMIN_PASSWORD or a keyring entry "
+                        f"(python garmin_connect.py store-password) for service '{KEYRING_SERVICE}'.")
+    return email, password
+
+class GarminClient(ActivityClient):
+    """Garmin Connect through the `garminconnect` package, reusing saved tokens when they are valid."""
+
+    def __init__(self, token_store=TOKEN_STORE):
+        from garminconnect import Garmin
+        self._garmin = Garmin
+        try:
+            self.client = Garmin()
+            self.client.login(token_store)
+        except Exception:  # Missing, expired or unreadable tokens: log in with credentials
+            email, password = get_credentials()
+            self.client = Garmin(email, password)
+            self.client.login()
+            self.client.garth.dump(token_store)
+
+    def _call(self, function, *args, **kwargs):
+        from garminconnect import GarminConnectConnectionError, GarminConnectTooManyRequestsError
+        try:
+            return function(*args, **kwargs)
+        except GarminConnectTooManyRequestsError as e:
+            raise RetryableError(str(e)) from e
+        except GarminConnectConnectionError as e:
+            raise RetryableError(str(e)) from e
+
+    def list_activities(self, start, limit):
+        activities = self._call(self.client.get_activities, start, limit)
+        return [{
+            'id': activity['activityId'],
+            'start': datetime.strptime(activity['startTimeGMT'], "%Y-%m-%d %H:%M:%S")
+                             .replace(tzinfo=timezone.utc).timestamp(),
+            'name': activity.get('activityName'),
+        } for activity in activities]
+
+    def download(self, activity_id, file_format):
+        formats = self._garmin.ActivityDownloadFormat
+        if file_format == "tcx":
+            return self._call(self.client.download_activity, activity_id, dl_fmt=formats.TCX)
+        # FIT files only come as the zipped original upload
+        archive = self._call(self.client.download_activity, activity_id, dl_fmt=formats.ORIGINAL)
+        with zipfile.ZipFile(io.BytesIO(archive)) as zipped:
+            fit_names = [name for name in zipped.namelist() if name.lower().endswith(".fit")]
+            if not fit_names:
+                raise SyncError(f"Activity {activity_id} has no FIT file in its original upload.")
+            return zipped.read(fit_names[0])
+
+    def set_title(self, activity_id, title):
+        self._call(self.client.set_activity_name, activity_id, title)
+
+class HttpClient(ActivityClient):
+    """
+    Client for the plain JSON protocol served by `garmin_fake.py`:
+    GET /activities?start=&limit=, GET /activities/<id>/download?format=, PUT /activities/<id>.
+    """
+
+    def __init__(self, base_url, timeout=10.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _request(self, method, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                         headers={'Content-Type': "application/json"} if data else {})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            if e.code == 429 or e.code >= 500:
+                retry_after = e.headers.get("Retry-After")
+                raise RetryableError(f"HTTP {e.code} for {path}", float(retry_after) if retry_after else None) from e
+            raise SyncError(f"HTTP {e.code} for {path}") from e
+        except (urllib.error.URLError, TimeoutError, ConnectionError) as e:
+            raise RetryableError(f"{type(e).__name__} for {path}: {e}") from e
+
+    def list_activities(self, start, limit):
+        return json.loads(self._request("GET", f"/activities?start={start}&limit={limit}"))
+
+    def download(self, activity_id, file_format):
+        return self._request("GET", f"/activities/{urllib.parse.quote(str(activity_id))}/download?format={file_format}")
+
+    def set_title(self, activity_id, title):
+        self._request("PUT", f"/activities/{urllib.parse.quote(str(activity_id))}", {'title': title})
+
+# --- Rate limiting and retries ---
+
+class RateLimiter:
+    """Thread-safe token bucket: `rate` requests per second on average, bursts of up to `burst`."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a request may be sent."""
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1.0
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+
+    def penalize(self, seconds):
+        """Holds back every thread for `seconds`, e.g. after the server answered 429."""
+        with self.lock:
+            self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+def call_with_retry(function, *args, limiter=None, max_retries=5, backoff_seconds=1.0):
+    """
+    Calls `function(*args)` through the rate limiter, retrying RetryableError with exponential
+    backoff and jitter (honouring the server's Retry-After when it sends one).
+    """
+    for attempt in range(max_retries + 1):
+        if limiter:
+            limiter.acquire()
+        try:
+            return function(*args)
+        except RetryableError as e:
+            if attempt == max_retries:
+                raise
+            delay = e.retry_after if e.retry_after is not None else backoff_seconds * 2 ** attempt
+            delay *= random.uniform(1.0, 1.5)
+            if limiter and e.retry_after is not None:
+                limiter.penalize(delay)
+            logger.warning(f"{e}; retrying in {delay:.1f} s ({attempt + 1}/{max_retries}).")
+            time.sleep(delay)
+
+# --- Checkpoint ---
+
+def load_checkpoint(path=CHECKPOINT_FILE):
+    """
+    Loads the sync checkpoint, or returns an empty one.
+
+    'complete_through' is the start of the newest activity of the last sync that reached the end
+    of the history (or an older checkpoint), so the next sync can stop paging there.
+    'downloaded' maps activity id -> raw file name and 'titles' maps activity id -> pushed title.
+    """
+    try:
+        with open(path, 'r') as f:
+            checkpoint = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        checkpoint = {}
+    checkpoint.setdefault('complete_through', None)
+    checkpoint.setdefault('downloaded', {})
+    checkpoint.setdefault('titles', {})
+    return checkpoint
+
+def save_checkpoint(checkpoint, path=CHECKPOINT_FILE):
+    """Writes the checkpoint atomically."""
+    with open(path + ".tmp", 'w') as f:
+        json.dump(checkpoint, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+def raw_filename(activity_id, file_format):
+    """Returns the raw file name for an activity, e.g. activity_17738425132.tcx."""
+    return f"activity_{activity_id}.{file_format}"
+
+# --- Sync ---
+
+def _download_one(client, activity, file_format, raw_dir, limiter, sync_config):
+    contents = call_with_retry(client.download, activity['id'], file_format, limiter=limiter,
+                               max_retries=sync_config['max_retries'], backoff_seconds=sync_config['backoff_seconds'])
+    name = raw_filename(activity['id'], file_format)
+    path = os.path.join(raw_dir, name)
+    # Written under a temporary name (ignored by the watcher) and renamed into place when complete
+    with open(path + ".part", 'wb') as f:
+        f.write(contents)
+    os.replace(path + ".part", path)
+    return name
+
+def sync_activities(client, sync_config=None, raw_dir=RAW_DATA_DIR, checkpoint_path=CHECKPOINT_FILE):
+    """
+    Downloads every activity not downloaded before into `raw_dir`.
+
+    Pages through the history newest first and stops at the first page that reaches the
+    checkpoint's 'complete_through', so a routine sync costs one listing request. Each page is
+    downloaded concurrently, and the checkpoint is saved after every page, so an interrupted
+    sync resumes where it stopped.
+
+    Args:
+        client (ActivityClient): The activity service.
+        sync_config (dict): The `garmin` config section (see DEFAULT_SYNC_CONFIG).
+        raw_dir (str): Where raw files are written.
+        checkpoint_path (str): Checkpoint file.
+
+    Returns:
+        list of str: Names of the files downloaded.
+    """
+    sync_config = dict(DEFAULT_SYNC_CONFIG, **(sync_config or {}))
+    file_format = sync_config['format']
+    if file_format not in FORMATS:
+        raise SyncError(f"Unsupported download format '{file_format}'.")
+    checkpoint = load_checkpoint(checkpoint_path)
+    downloaded = checkpoint['downloaded']
+    complete_through = checkpoint['complete_through']
+    limiter = RateLimiter(sync_config['requests_per_second'], sync_config['burst'])
+    retry = dict(limiter=limiter, max_retries=sync_config['max_retries'], backoff_seconds=sync_config['backoff_seconds'])
+    os.makedirs(raw_dir, exist_ok=True)
+
+    newest_seen = None
+    fetched = []
+    failures = 0
+    start = 0
+    with ThreadPoolExecutor(max_workers=sync_config['download_workers']) as executor:
+        while True:
+            page = call_with_retry(client.list_activities, start, sync_config['page_size'], **retry)
+            if not page:
+                break
+            start += len(page)
+            if newest_seen is None:
+                newest_seen = page[0]['start']
+            todo = [activity for activity in page if str(activity['id']) not in downloaded]
+            futures = {executor.submit(_download_one, client, activity, file_format, raw_dir, limiter, sync_config):
+                       activity for activity in todo}
+            for future, activity in futures.items():
+                try:
+                    downloaded[str(activity['id'])] = future.result()
+                    fetched.append(downloaded[str(activity['id'])])
+                except SyncError as e:
+                    failures += 1
+                    logger.error(f"Could not download activity {activity['id']}: {e}")
+            save_checkpoint(checkpoint, checkpoint_path)
+            logger.info(f"Listed {start} activities, downloaded {len(fetched)}.")
+            if complete_through is not None and page[-1]['start'] <= complete_through:
+                break  # Everything older was synced before
+            if len(page) < sync_config['page_size']:
+                break
+
+    if failures == 0 and newest_seen is not None:
+        checkpoint['complete_through'] = max(newest_seen, complete_through or newest_seen)
+    save_checkpoint(checkpoint, checkpoint_path)
+    return fetched
+
+def push_titles(client, sync_config=None, processed_dir=PROCESSED_DATA_DIR, checkpoint_path=CHECKPOINT_FILE):
+    """
+    Pushes the title of every analyzed activity back to the service, unless that title was
+    already pushed. Requests are sent concurrently through the rate limiter.
+
+    Returns:
+        int: Number of titles pushed.
+    """
+    sync_config = dict(DEFAULT_SYNC_CONFIG, **(sync_config or {}))
+    checkpoint = load_checkpoint(checkpoint_path)
+    titles = checkpoint['titles']
+    updates = {}
+    for activity_id, name in checkpoint['downloaded'].items():
+        try:
+            with open(os.path.join(processed_dir, analysis.summary_filename(name)), 'r') as f:
+                title = json.load(f).get('title')
+        except (FileNotFoundError, json.JSONDecodeError):
+            continue
+        if title and titles.get(activity_id) != title:
+            updates[activity_id] = title
+    if not updates:
+        return 0
+
+    limiter = RateLimiter(sync_config['requests_per_second'], sync_config['burst'])
+
+    def push(item):
+        activity_id, title = item
+        call_with_retry(client.set_title, activity_id, title, limiter=limiter,
+                        max_retries=sync_config['max_retries'], backoff_seconds=sync_config['backoff_seconds'])
+        return activity_id
+
+    pushed = 0
+    with ThreadPoolExecutor(max_workers=sync_config['download_workers']) as executor:
+        futures = {executor.submit(push, item): item for item in sorted(updates.items())}
+        for future, (activity_id, title) in futures.items():
+            try:
+                future.result()
+            except SyncError as e:
+                logger.error(f"Could not set the title of activity {activity_id}: {e}")
+                continue
+            titles[activity_id] = title
+            pushed += 1
+    save_checkpoint(checkpoint, checkpoint_path)
+    return pushed
+
+def make_client(server=None):
+    """Returns an HttpClient for `server` if given, else a logged-in GarminClient."""
+    return HttpClient(server) if server else GarminClient()
+
+def main(argv=None):
+    """Command line entry point: sync, push titles, or store the password in the keyring."""
+    parser = argparse.ArgumentParser(description="Sync activities with Garmin Connect.")
+    parser.add_argument('--server', help="Base URL of a server speaking the garmin_fake.py protocol, instead of Garmin Connect.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    sync_parser = subparsers.add_parser('sync', help="Download new activities, analyze them and push their titles.")
+    sync_parser.add_argument('--format', choices=FORMATS, help="Download format (default: garmin.format from config).")
+    sync_parser.add_argument('--no-analyze', action='store_true', help="Only download.")
+    sync_parser.add_argument('--no-titles', action='store_true', help="Do not push titles back.")
+    subparsers.add_parser('push-titles', help="Push titles of analyzed activities.")
+    subparsers.add_parser('store-password', help="Save the password for GARMIN_EMAIL in the system keyring.")
+    instrumentation.add_logging_arguments(parser)
+    args = parser.parse_args(argv)
+
+    # Only the analysis after a sync needs the compiled settings (zone tables and all)
+    config = analysis.configure_logging_from_args(args)
+    sync_config = config.get('garmin', {}) or {}
+
+    if args.command == 'store-password':
+        import getpass
+        import keyring
+        email = os.environ.get("GARMIN_EMAIL") or input("Garmin email: ")
+        keyring.set_password(KEYRING_SERVICE, email, getpass.getpass(f"Password for {email}: "))
+        logger.info(f"Password stored in the keyring for {email}.")
+        return
+
+    client = make_client(args.server)
+    if args.command == 'sync':
+        if args.format:
+            sync_config = dict(sync_config, format=args.format)
+        fetched = sync_activities(client, sync_config)
+        logger.info(f"Downloaded {len(fetched)} new activities.")
+        if args.no_analyze:
+            return
+        analysis.run_batch(config, analysis.compile_settings(config))
+        if args.no_titles:
+            return
+    logger.info(f"Pushed {push_titles(client, sync_config)} titles.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+import http_service
+import workout_generator
+
+class FakeActivityService:
+    """
+    In-memory activity history with synthetic TCX/FIT files, for exercising the sync end to end.
+
+    Optionally rate limited (429 with Retry-After beyond `rate_limit` requests per second) and
+    flaky (503 for a fraction `failure_rate` of requests).
+    """
+
+    def __init__(self, count=20, duration=1800, rate_limit=None, failure_rate=0.0, seed=0):
+        newest = workout_generator.DEFAULT_START
+        self.activities = [{'id': 1000 + i, 'start': newest - (count - 1 - i) * 86400, 'name': f"Ride {i + 1}"}
+                           for i in range(count)][::-1]  # Newest first
+        self.duration = duration
+        self.rate_limit = rate_limit
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.files = {}
+        self.titles = {}
+        self.requests = 0
+        self.rejected = 0
+        self.window_start = time.monotonic()
+        self.window_requests = 0
+        self.lock = threading.Lock()
+
+    def admit(self):
+        """Returns None to serve a request, or (status, retry_after) to reject it."""
+        with self.lock:
+            self.requests += 1
+            now = time.monotonic()
+            if now - self.window_start >= 1.0:
+                self.window_start, self.window_requests = now, 0
+            self.window_requests += 1
+            if self.rate_limit and self.window_requests > self.rate_limit:
+                self.rejected += 1
+                return 429, max(0.1, 1.0 - (now - self.window_start))
+            if self.failure_rate and self.random.random() < self.failure_rate:
+                self.rejected += 1
+                return 503, None
+        return None
+
+    def activity_file(self, activity_id, file_format="tcx"):
+        """Returns the TCX or FIT contents of an activity, generating it on first use."""
+        with self.lock:
+            key = (activity_id, file_format)
+            if key not in self.files:
+                activity = next(a for a in self.activities if a['id'] == activity_id)
+                workout = workout_generator.generate_workout(self.duration, seed=activity_id, start=activity['start'])
+                writer = workout_generator.write_fit if file_format == "fit" else workout_generator.write_tcx
+                with tempfile.TemporaryDirectory() as directory:
+                    path = os.path.join(directory, f"activity.{file_format}")
+                    writer(workout, path)
+                    with open(path, 'rb') as f:
+                        self.files[key] = f.read()
+            return self.files[key]
+
+def _handler(service):
+    class Handler(http_service.JsonHandler):
+        def _admitted(self):
+            rejection = service.admit()
+            if rejection is None:
+                return True
+            status, retry_after = rejection
+            self.reply(status, headers={'Retry-After': f"{retry_after:.2f}"} if retry_after else None)
+            return False
+
+        def do_GET(self):
+            if not self._admitted():
+                return
+            parts, query = self.path_parts()
+            if parts == ["activities"]:
+                start = int(query.get('start', ["0"])[0])
+                limit = int(query.get('limit', ["20"])[0])
+                self.reply(200, service.activities[start:start + limit])
+            elif len(parts) == 3 and parts[0] == "activities" and parts[2] == "download":
+                file_format = query.get('format', ["tcx"])[0]
+                if file_format not in ("tcx", "fit"):
+                    self.reply(404)
+                    return
+                try:
+                    self.reply(200, service.activity_file(int(parts[1]), file_format),
+                               content_type="application/octet-stream" if file_format == "fit" else "application/xml")
+                except (ValueError, StopIteration):
+                    self.reply(404)
+            else:
+                self.reply(404)
+
+        def do_PUT(self):
+            if not self._admitted():
+                return
+            parts, _ = self.path_parts()
+            if len(parts) != 2 or parts[0] != "activities":
+                self.reply(404)
+                return
+            body = self.read_json()
+            with service.lock:
+                service.titles[int(parts[1])] = body.get('title')
+            self.reply(204)
+
+    return Handler
+
+def start_server(service, host="127.0.0.1", port=0):
+    """Serves `service` on a background thread. Returns the server; its URL is server.url."""
+    return http_service.start_server(_handler(service), host, port)
+
+def main(argv=None):
+    """Runs a fake activity service until interrupted."""
+    parser = argparse.ArgumentParser(description="Serve a fake activity history for testing the Garmin sync.")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--activities', type=int, default=20)
+    parser.add_argument('--rate-limit', type=float, help="Requests per second before answering 429.")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="Fraction of requests answered with 503.")
+    args = parser.parse_args(argv)
+
+    service = FakeActivityService(args.activities, rate_limit=args.rate_limit, failure_rate=args.failure_rate)
+    server = start_server(service, port=args.port)
+    print(f"Serving {args.activities} activities at {server.url} (sync with: garmin_connect.py --server {server.url} sync)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,89 @@
-from datetime import datetime, timedelta
-
-def group_intervals(intervals, min_break_duration=300, duration_tolerance=5):
-    """
-    Groups intervals based on proximity and similarity.
-    Args:
-        intervals (list of dicts): A list of intervals.
-        min_break_duration (int): Minimum rest duration to start a new group.
-        duration_tolerance (int): Tolerance for effort duration similarity.
-
-    Returns:
-        list of dicts: A list of grouped intervals.
-    """
-    if not intervals:
-        return []
-
-    grouped_intervals = []
-    current_group = [intervals[0]]
-
-    for i in range(1, len(intervals)):
-        prev_end_time = datetime.fromisoformat(intervals[i - 1]["end_time"])
-        curr_start_time = datetime.fromisoformat(intervals[i]["start_time"])
-        time_difference = (curr_start_time - prev_end_time).total_seconds()
-        duration_difference = abs(intervals[i]["duration"] - intervals[i - 1]["duration"])
-
-        if time_difference >= min_break_duration or duration_difference > duration_tolerance:
-            grouped_intervals.append({
-                "intervals": current_group,
-                "number_of_intervals": len(current_group),
-                "average_duration": sum(interval["duration"] for interval in current_group) / len(current_group)
-            })
-            current_group = [intervals[i]]  # Start new group
-        else:
-            current_group.append(intervals[i])
-
-    grouped_intervals.append({
-        "intervals": current_group,
-        "number_of_intervals": len(current_group),
-        "average_duration": sum(interval["duration"] for interval in current_group) / len(current_group)
-    })
-
-    return grouped_intervals
-
-
-
-
+import workout_stream
+
+def _interval_seconds(interval, key):
+    """Returns an interval edge as epoch seconds, parsing the ISO string only if needed."""
+    seconds = interval.get(key.replace('_time', '_seconds'))
+    if seconds is None:
+        seconds = workout_stream.parse_timestamp(interval[key])
+    return seconds
+
+def _starts_new_group(previous, interval, min_break_duration, duration_tolerance):
+    """Returns True if `interval` is too far from, or too unlike, the `previous` one to share its group."""
+    time_difference = _interval_seconds(interval, "start_time") - _interval_seconds(previous, "end_time")
+    duration_difference = abs(interval["duration"] - previous["duration"])
+    return time_difference >= min_break_duration or duration_difference > duration_tolerance
+
+def _group(intervals):
+    return {
+        "intervals": intervals,
+        "number_of_intervals": len(intervals),
+        "average_duration": sum(interval["duration"] for interval in intervals) / len(intervals)
+    }
+
+def group_intervals(intervals, min_break_duration=300, duration_tolerance=5):
+    """
+    Groups intervals based on proximity and similarity.
+    Args:
+        intervals (list of dicts): A list of intervals.
+        min_break_duration (int): Minimum rest duration to start a new group.
+        duration_tolerance (int): Tolerance for effort duration similarity.
+
+    Returns:
+        list of dicts: A list of grouped intervals.
+    """
+    if not intervals:
+        return []
+
+    grouped_intervals = []
+    current_group = [intervals[0]]
+
+    for i in range(1, len(intervals)):
+        if _starts_new_group(intervals[i - 1], intervals[i], min_break_duration, duration_tolerance):
+            grouped_intervals.append(_group(current_group))
+            current_group = [intervals[i]]  # Start new group
+        else:
+            current_group.append(intervals[i])
+
+    grouped_intervals.append(_group(current_group))
+
+    return grouped_intervals
+
+class OnlineGrouper:
+    """
+    Chunked counterpart of `group_intervals`: takes intervals as they are detected.
+
+    Only the current group is held; a group is returned once the next interval starts a new one.
+    Every decision depends on two consecutive intervals only, so the groups are exactly those of
+    `group_intervals` over all the intervals.
+    """
+
+    def __init__(self, min_break_duration=300, duration_tolerance=5):
+        self.min_break_duration = min_break_duration
+        self.duration_tolerance = duration_tolerance
+        self.current_group = []
+
+    def update(self, intervals):
+        """
+        Adds the next intervals, in time order.
+
+        Returns:
+            list of dicts: The groups completed by them.
+        """
+        completed = []
+        for interval in intervals:
+            if self.current_group and _starts_new_group(self.current_group[-1], interval, self.min_break_duration,
+                                                        self.duration_tolerance):
+                completed.append(_group(self.current_group))
+                self.current_group = []
+            self.current_group.append(interval)
+        return completed
+
+    def pending_groups(self, intervals=()):
+        """Returns the groups of the current group plus `intervals` (e.g. still open ones), without keeping them."""
+        return group_intervals(self.current_group + list(intervals), self.min_break_duration, self.duration_tolerance)
+
+    def finish(self):
+        """Returns the last group, if any."""
+        completed = [_group(self.current_group)] if self.current_group else []
+        self.current_group = []
+        return completed
@@ -0,0 +1,66 @@
+import json
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import instrumentation
+
+logger = instrumentation.get_logger("http")
+
+class JsonHandler(BaseHTTPRequestHandler):
+    """
+    Request handler base for the small local HTTP services (ingest server, fake Garmin service).
+
+    Subclasses implement the do_* methods with `path_parts`, `read_json` and `reply`; requests are
+    logged at debug level instead of to stderr.
+    """
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def path_parts(self):
+        """Returns the request path as a list of unquoted segments, and its parsed query string."""
+        url = urllib.parse.urlparse(self.path)
+        parts = [urllib.parse.unquote(part) for part in url.path.strip("/").split("/") if part]
+        return parts, urllib.parse.parse_qs(url.query)
+
+    def read_json(self):
+        """Reads a JSON request body of Content-Length bytes; an empty body reads as {}."""
+        return json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+
+    def reply(self, status, payload=None, headers=None, content_type="application/json"):
+        """
+        Sends a complete response.
+
+        Args:
+            status (int): HTTP status.
+            payload: Sent as JSON, or as is when bytes; None sends an empty body.
+            headers (dict): Extra response headers.
+            content_type (str): Content-Type of a bytes payload.
+        """
+        if payload is None:
+            body = b""
+        elif isinstance(payload, bytes):
+            body = payload
+        else:
+            body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+def make_server(handler_class, host="127.0.0.1", port=0):
+    """Returns a threading server for `handler_class`, not yet serving; its URL is server.url."""
+    server = ThreadingHTTPServer((host, port), handler_class)
+    server.daemon_threads = True
+    server.url = f"http://{host}:{server.server_address[1]}"
+    return server
+
+def start_server(handler_class, host="127.0.0.1", port=0):
+    """Serves `handler_class` on a background thread. Returns the server; its URL is server.url."""
+    server = make_server(handler_class, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,459 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import http_service
+import instrumentation
+import main
+import manifest
+
+logger = instrumentation.get_logger("ingest")
+
+SUPPORTED_EXTENSIONS = (".tcx", ".gpx", ".fit")
+CONTENT_TYPES = {
+    "application/vnd.garmin.tcx+xml": ".tcx",
+    "application/gpx+xml": ".gpx",
+    "application/vnd.ant.fit": ".fit",
+}
+UNSUPPORTED_MESSAGE = f"Upload a {', '.join(SUPPORTED_EXTENSIONS)} file (name it with ?name=...)."
+CHUNK_SIZE = 1 << 16
+_UNSAFE_NAME = re.compile(r"[^A-Za-z0-9._-]")
+
+class RequestError(Exception):
+    """A request that cannot be served, with the HTTP status to answer."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def safe_filename(name, extension=None):
+    """Reduces a client-supplied file name to a plain base name, or None if nothing usable is left."""
+    name = _UNSAFE_NAME.sub("_", os.path.basename(name or "")).lstrip(".")
+    if extension and not name.lower().endswith(SUPPORTED_EXTENSIONS):
+        name = f"{name}{extension}" if name else None
+    return name or None
+
+def _body_chunks(rfile, headers):
+    """Yields the request body in chunks, from a Content-Length or a chunked transfer encoding."""
+    if "chunked" in headers.get("Transfer-Encoding", "").lower():
+        while True:
+            size = int(rfile.readline().split(b";")[0].strip() or b"0", 16)
+            if not size:
+                while rfile.readline() not in (b"\r\n", b"\n", b""):
+                    pass  # Trailers
+                return
+            remaining = size
+            while remaining:
+                chunk = rfile.read(min(remaining, CHUNK_SIZE))
+                if not chunk:
+                    raise RequestError(400, "Truncated chunked body.")
+                remaining -= len(chunk)
+                yield chunk
+            rfile.readline()
+    else:
+        remaining = int(headers.get("Content-Length") or 0)
+        while remaining:
+            chunk = rfile.read(min(remaining, CHUNK_SIZE))
+            if not chunk:
+                raise RequestError(400, "Truncated body.")
+            remaining -= len(chunk)
+            yield chunk
+
+def _multipart_file(chunks, boundary):
+    """
+    Streams the first file part out of a multipart/form-data body.
+
+    Returns:
+        tuple: (file name from the part headers or None, generator of the part's content chunks).
+    """
+    delimiter = b"\r\n--" + boundary
+    buffer = b"\r\n"  # The first delimiter has no preceding CRLF
+    chunks = iter(chunks)
+
+    def fill(needle):
+        nonlocal buffer
+        while needle not in buffer:
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise RequestError(400, "Malformed multipart body.")
+            buffer += chunk
+
+    while True:
+        fill(delimiter)
+        buffer = buffer[buffer.index(delimiter) + len(delimiter):]
+        fill(b"\r\n\r\n")
+        head, buffer = buffer.split(b"\r\n\r\n", 1)
+        if head.startswith(b"--"):
+            raise RequestError(400, "No file in the multipart body.")
+        disposition = next((line for line in head.decode("latin-1").split("\r\n")
+                            if line.lower().startswith("content-disposition:")), "")
+        match = re.search(r'filename="([^"]*)"', disposition)
+        if match:
+            break
+
+    def content():
+        nonlocal buffer
+        keep = len(delimiter)
+        while True:
+            position = buffer.find(delimiter)
+            if position >= 0:
+                yield buffer[:position]
+                for _ in chunks:
+                    pass  # Later parts and the closing delimiter are not needed
+                return
+            if len(buffer) > keep:
+                yield buffer[:-keep]
+                buffer = buffer[-keep:]
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise RequestError(400, "Malformed multipart body.")
+            buffer += chunk
+
+    return match.group(1), content()
+
+class IngestService:
+    """
+    Accepts workout uploads and analyzes them in a warm, bounded process pool.
+
+    Every worker receives the compiled settings (zone tables included) once, when the pool starts.
+    At most `workers + queue_size` uploads are admitted at a time; further ones are answered 429
+    straight away, without being stored or parsed. A request waits at most `timeout` seconds for its
+    analysis and then gets a 504, but the analysis keeps its slot until it really finishes, so a
+    slow file cannot let more work in than the pool can hold. A slot is freed as soon as its
+    analysis finishes; the result is then recorded in the manifest, the activity store and the
+    best-curve history as in a batch run, outside the slot. Uploads whose content was already
+    analyzed with the current config are answered from the stored summary.
+    """
+
+    def __init__(self, config=None, settings=None, workers=None, queue_size=None, timeout=None, max_upload_mb=None):
+        self.config = config if config is not None else main.load_config()
+        self.settings = settings or main.compile_settings(self.config)
+        server_config = self.config.get('server', {}) or {}
+        self.workers = max(1, int(workers or server_config.get('workers') or os.cpu_count() or 1))
+        self.queue_size = int(queue_size if queue_size is not None else server_config.get('queue_size') or self.workers)
+        self.timeout = float(timeout or server_config.get('timeout_seconds') or 30)
+        self.max_upload_bytes = int((max_upload_mb or server_config.get('max_upload_mb') or 64) * 1024 * 1024)
+        self.slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        self.in_flight = 0
+        self.slot_lock = threading.Lock()
+        self.lock = threading.Lock()  # Guards the manifest and the recording of results
+        os.makedirs(main.RAW_DATA_DIR, exist_ok=True)
+        os.makedirs(main.PROCESSED_DATA_DIR, exist_ok=True)
+        self.manifest = manifest.load_manifest(main.PROCESSED_DATA_DIR)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=main._init_worker,
+                                            initargs=(self.settings,))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def status(self):
+        return {'workers': self.workers, 'capacity': self.workers + self.queue_size, 'in_flight': self.in_flight}
+
+    def admit(self):
+        """Takes a slot for one upload, or returns False when the service is saturated."""
+        if not self.slots.acquire(blocking=False):
+            return False
+        with self.slot_lock:
+            self.in_flight += 1
+        return True
+
+    def release(self, *args):
+        with self.slot_lock:
+            self.in_flight -= 1
+        self.slots.release()
+
+    def _release_once(self):
+        """Returns a function that releases one slot on its first call only, from whichever thread gets there first."""
+        once = threading.Lock()
+
+        def release(*args):
+            if once.acquire(blocking=False):
+                self.release()
+        return release
+
+    def store_upload(self, chunks, name, extension):
+        """
+        Writes an upload into the raw data directory, hashing it on the way.
+
+        The file is written under a hidden temporary name and renamed into place once complete,
+        so the directory watcher never sees a partial file. Without a name, the file is named
+        after its content.
+
+        Returns:
+            tuple: (path, SHA-256 hex digest).
+        """
+        digest = hashlib.sha256()
+        size = 0
+        temp_path = os.path.join(main.RAW_DATA_DIR, f".upload-{threading.get_ident()}-{time.monotonic_ns()}.part")
+        try:
+            with open(temp_path, 'wb') as f:
+                for chunk in chunks:
+                    size += len(chunk)
+                    if size > self.max_upload_bytes:
+                        raise RequestError(413, f"Upload larger than {self.max_upload_bytes // (1024 * 1024)} MB.")
+                    digest.update(chunk)
+                    f.write(chunk)
+            if not size:
+                raise RequestError(400, "Empty upload.")
+            name = name or f"upload_{digest.hexdigest()[:12]}{extension}"
+            path = os.path.join(main.RAW_DATA_DIR, name)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return path, digest.hexdigest()
+
+    def stored_summary(self, name):
+        """Returns the stored summary for a raw file name or activity name, or None."""
+        for filename in (main.summary_filename(name), f"{name}_summary.json"):
+            path = os.path.join(main.PROCESSED_DATA_DIR, safe_filename(filename) or "")
+            if os.path.isfile(path):
+                with open(path, 'r') as f:
+                    return json.load(f)
+        return None
+
+    def list_summaries(self):
+        names = sorted(entry.name[:-len("_summary.json")] for entry in os.scandir(main.PROCESSED_DATA_DIR)
+                       if entry.name.endswith("_summary.json"))
+        return {'activities': names}
+
+    @staticmethod
+    def _report(path, future):
+        """Returns the report of a finished analysis future; a crashed worker only loses its own upload."""
+        try:
+            return future.result()
+        except Exception as e:
+            return {'file': os.path.basename(path), 'status': "failed", 'error': f"{type(e).__name__}: {e}",
+                    'analysis_type': "none", 'summary': None, 'seconds': 0.0, 'metrics': None}
+
+    def _record(self, report, fingerprint):
+        """Records the report of a finished analysis in the manifest, the activity store and the curve history."""
+        try:
+            with self.lock:
+                main.record_reports([report], self.config, self.manifest, {report['file']: fingerprint})
+                manifest.save_manifest(self.manifest, main.PROCESSED_DATA_DIR)
+        except Exception:
+            logger.exception(f"Could not record the analysis of {report['file']}")
+
+    def analyze(self, path, sha256):
+        """
+        Analyzes one stored upload (in a worker) and waits up to `timeout` seconds for it.
+
+        Takes over the upload's slot: it is released as soon as the analysis finishes, even after
+        a timeout, and before the result is recorded. A request that gets its result records it
+        before answering; after a timeout the result is recorded from the future's done callback.
+
+        Returns:
+            dict: A report as from `main.analyze_batch`, with 'status' "cached" when the stored
+                  summary was still current.
+        """
+        name = os.path.basename(path)
+        try:
+            with self.lock:
+                stale, fingerprints = manifest.find_stale([path], self.manifest, self.config, main.PROCESSED_DATA_DIR,
+                                                          prune=False)
+            summary = None if stale else self.stored_summary(name)
+            if summary is None:
+                future = self.executor.submit(main._analyze_file_timed, (path, sha256))
+        except BaseException:
+            self.release()
+            raise
+        if summary is not None:
+            self.release()
+            return {'file': name, 'status': "cached", 'error': None, 'summary': summary, 'seconds': 0.0}
+
+        release = self._release_once()
+        future.add_done_callback(release)
+        try:
+            future.exception(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.add_done_callback(lambda done: self._record(self._report(path, done), fingerprints[name]))
+            raise RequestError(504, f"Analysis of {name} did not finish within {self.timeout:g} s.")
+        release()  # The callback may not have run yet when the waiting request wakes up
+        report = self._report(path, future)
+        self._record(report, fingerprints[name])
+        return report
+
+def _handler(service):
+    class Handler(http_service.JsonHandler):
+        timeout = 60  # Socket timeout, so stalled clients cannot hold a connection forever
+
+        def do_GET(self):
+            parts, _ = self.path_parts()
+            if parts == ["health"]:
+                self.reply(200, service.status())
+            elif parts == ["activities"]:
+                self.reply(200, service.list_summaries())
+            elif len(parts) == 2 and parts[0] == "activities":
+                summary = service.stored_summary(parts[1])
+                if summary is None:
+                    self.reply(404, {'error': f"No summary for {parts[1]}."})
+                else:
+                    self.reply(200, summary)
+            else:
+                self.reply(404, {'error': "Not found."})
+
+        def do_POST(self):
+            parts, query = self.path_parts()
+            if parts != ["activities"]:
+                self.reply(404, {'error': "Not found."})
+                return
+            if not self._multipart() and self._extension(query.get('name', [None])[0]) not in SUPPORTED_EXTENSIONS:
+                self._discard_body()
+                self.reply(415, {'error': UNSUPPORTED_MESSAGE})
+                return
+            if not service.admit():
+                self._discard_body()
+                self.reply(429, {'error': "Analysis queue is full."}, {'Retry-After': "1"})
+                return
+            admitted = True
+            try:
+                path, sha256 = self._receive(query)
+                admitted = False  # The slot now belongs to the analysis
+                report = service.analyze(path, sha256)
+            except Exception as e:
+                if admitted:
+                    service.release()
+                self.close_connection = True
+                if isinstance(e, RequestError):
+                    self.reply(e.status, {'error': str(e)})
+                else:
+                    logger.exception("Upload failed")
+                    self.reply(500, {'error': f"{type(e).__name__}: {e}"})
+                return
+
+            summary = report['summary']
+            if report['status'] == "failed" or summary is None:
+                self.reply(422, {'file': report['file'], 'status': report['status'],
+                                  'error': report['error'] or "Unreadable file, or no power or heart rate data."})
+                return
+            self.reply(200, {'file': report['file'], 'status': report['status'], 'title': summary.get('title'),
+                              'seconds': round(report['seconds'], 4), 'summary': summary})
+
+        def _discard_body(self):
+            """Reads and drops a rejected upload, so the client sees the answer instead of a reset connection."""
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > service.max_upload_bytes or "chunked" in self.headers.get("Transfer-Encoding", "").lower():
+                self.close_connection = True
+                return
+            for _ in _body_chunks(self.rfile, self.headers):
+                pass
+
+        def _multipart(self):
+            return self.headers.get("Content-Type", "").lower().startswith("multipart/form-data")
+
+        def _extension(self, name):
+            """The upload's file extension, from its name or else from the Content-Type."""
+            content_type = self.headers.get("Content-Type", "").split(";")[0].strip()
+            return os.path.splitext(name or "")[1].lower() or CONTENT_TYPES.get(content_type)
+
+        def _receive(self, query):
+            """Stores the uploaded file (raw body or multipart/form-data). Returns (path, SHA-256)."""
+            content_type = self.headers.get("Content-Type", "")
+            chunks = _body_chunks(self.rfile, self.headers)
+            name = query.get('name', [None])[0]
+            if self._multipart():
+                match = re.search(r'boundary="?([^";]+)"?', content_type)
+                if not match:
+                    raise RequestError(400, "Multipart upload without a boundary.")
+                part_name, chunks = _multipart_file(chunks, match.group(1).encode("latin-1"))
+                name = name or part_name
+            extension = self._extension(name)
+            if extension not in SUPPORTED_EXTENSIONS:
+                raise RequestError(415, UNSUPPORTED_MESSAGE)
+            return service.store_upload(chunks, safe_filename(name, extension) if name else None, extension)
+
+    return Handler
+
+def start_server(service, host="127.0.0.1", port=0):
+    """Serves `service` on a background thread. Returns the server; its URL is server.url."""
+    return http_service.start_server(_handler(service), host, port)
+
+def _post_file(url, file_path, timeout):
+    with open(file_path, 'rb') as f:
+        body = f.read()
+    request = urllib.request.Request(f"{url}/activities?name={urllib.parse.quote(os.path.basename(file_path))}",
+                                     data=body, method="POST",
+                                     headers={'Content-Type': "application/octet-stream"})
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError:
+        status = "error"
+    return status, time.perf_counter() - started
+
+def load_test(url, file_paths, requests=100, concurrency=8, timeout=60):
+    """
+    Uploads `requests` files (cycling through `file_paths`) with `concurrency` parallel clients.
+
+    Returns:
+        dict: Count per HTTP status, requests per second and latency percentiles in milliseconds.
+    """
+    jobs = [file_paths[i % len(file_paths)] for i in range(requests)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as clients:
+        results = list(clients.map(lambda path: _post_file(url, path, timeout), jobs))
+    elapsed = time.perf_counter() - started
+    statuses = {}
+    for status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    latencies = sorted(seconds * 1000 for _, seconds in results)
+    return {
+        'statuses': statuses,
+        'requests_per_second': round(len(results) / elapsed, 1),
+        'p50_ms': round(latencies[len(latencies) // 2], 1),
+        'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 1),
+        'max_ms': round(latencies[-1], 1),
+    }
+
+def main_server(argv=None):
+    """Runs the ingest server, or a load test against one."""
+    parser = argparse.ArgumentParser(description="Analyze workout uploads over HTTP.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    serve_parser = subparsers.add_parser('serve', help="Run the server.")
+    serve_parser.add_argument('--host')
+    serve_parser.add_argument('--port', type=int)
+    serve_parser.add_argument('--workers', type=int)
+    serve_parser.add_argument('--queue-size', type=int, help="Uploads waiting beyond the busy workers before 429.")
+    serve_parser.add_argument('--timeout', type=float, help="Seconds a request waits for its analysis before 504.")
+    instrumentation.add_logging_arguments(serve_parser)
+    test_parser = subparsers.add_parser('load-test', help="Upload files concurrently and report latencies.")
+    test_parser.add_argument('url')
+    test_parser.add_argument('files', nargs='+')
+    test_parser.add_argument('--requests', type=int, default=100)
+    test_parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args(argv)
+
+    if args.command == 'load-test':
+        print(json.dumps(load_test(args.url.rstrip("/"), args.files, args.requests, args.concurrency), indent=1))
+        return
+    config, settings = main.configure_from_args(args)
+    server_config = config.get('server', {}) or {}
+    service = IngestService(config, settings, workers=args.workers, queue_size=args.queue_size, timeout=args.timeout)
+    server = http_service.make_server(_handler(service), args.host or server_config.get('host') or "127.0.0.1",
+                                      args.port if args.port is not None else server_config.get('port', 8080))
+    logger.info(f"Ingest server on {server.url} with {service.workers} workers "
+                f"({service.status()['capacity']} uploads at most in progress).")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Stopping.")
+    finally:
+        server.server_close()
+        service.close()
+
+if __name__ == "__main__":
+    main_server()
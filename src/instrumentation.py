@@ -0,0 +1,170 @@
+import contextvars
+import json
+import logging
+import sys
+import time
+from contextlib import contextmanager
+
+ROOT_LOGGER = "auto_diary"
+
+def get_logger(name):
+    """Returns the logger for one module, below the package's root logger."""
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+logger = get_logger("instrumentation")
+
+class TextFormatter(logging.Formatter):
+    """Plain messages for INFO and below, prefixed with the level for warnings and errors."""
+
+    def format(self, record):
+        message = record.getMessage()
+        fields = getattr(record, 'fields', None)
+        if fields:
+            message = f"{message} {json.dumps(fields, sort_keys=True)}"
+        if record.levelno >= logging.WARNING:
+            message = f"{record.levelname}: {message}"
+        return message
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with any structured fields merged in."""
+
+    def format(self, record):
+        entry = {
+            'time': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+def configure_logging(level="INFO", json_format=False):
+    """
+    Sets up the package logger. Safe to call more than once (e.g. in every worker process).
+
+    Args:
+        level (str): Logging level name.
+        json_format (bool): Emit JSON lines instead of plain text.
+    """
+    root = logging.getLogger(ROOT_LOGGER)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if json_format else TextFormatter())
+    root.addHandler(handler)
+    root.setLevel(str(level).upper())
+    root.propagate = False
+
+def add_logging_arguments(parser):
+    """Adds the --log-level, --log-json and --instrument flags shared by the command line tools."""
+    parser.add_argument('--log-level', help="Logging level (default: logging.level from config, else INFO).")
+    parser.add_argument('--log-json', action='store_true', help="Log JSON lines instead of plain text.")
+    parser.add_argument('--instrument', action='store_true',
+                        help="Record per-stage timings and counters and emit them as structured reports.")
+
+class _StageTimer:
+    __slots__ = ('recorder', 'name', 'started')
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        stages = self.recorder.stages
+        stages[self.name] = stages.get(self.name, 0.0) + time.perf_counter() - self.started
+        return False
+
+class Recorder:
+    """Collects per-stage wall times and counters for one unit of work (usually one file)."""
+
+    enabled = True
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+
+    def stage(self, name):
+        """Context manager timing one pipeline stage; repeated stages accumulate."""
+        return _StageTimer(self, name)
+
+    def count(self, name, value=1):
+        """Adds `value` to a counter."""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self):
+        """Returns the collected timings and counters as a plain dict."""
+        return {'stages': dict(self.stages), 'counters': dict(self.counters)}
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+class NullRecorder:
+    """Recorder used when instrumentation is off: every hook is a constant-time no-op."""
+
+    enabled = False
+
+    def stage(self, name):
+        return _NULL_STAGE
+
+    def count(self, name, value=1):
+        pass
+
+    def report(self):
+        return None
+
+NULL_RECORDER = NullRecorder()
+
+_current = contextvars.ContextVar('recorder', default=NULL_RECORDER)
+
+def current():
+    """Returns the recorder active in this context (a NullRecorder unless one was installed)."""
+    return _current.get()
+
+def count(name, value=1):
+    """Adds to a counter on the active recorder."""
+    _current.get().count(name, value)
+
+@contextmanager
+def recording(recorder):
+    """Installs `recorder` as the active recorder for the duration of the block."""
+    token = _current.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _current.reset(token)
+
+def merge_reports(reports):
+    """Sums the stage times and counters of several per-file reports into a batch report."""
+    merged = {'files': 0, 'stages': {}, 'counters': {}}
+    for report in reports:
+        if not report:
+            continue
+        merged['files'] += 1
+        for section in ('stages', 'counters'):
+            for name, value in report[section].items():
+                merged[section][name] = merged[section].get(name, 0) + value
+    return merged
+
+def emit(kind, payload, report_file=None):
+    """
+    Emits a machine-readable report as a structured log record, and appends it as a JSON line to
+    `report_file` when one is configured.
+    """
+    logger.info(kind, extra={'fields': payload})
+    if report_file:
+        with open(report_file, 'a') as f:
+            f.write(json.dumps(dict(payload, kind=kind, time=round(time.time(), 3))) + "\n")
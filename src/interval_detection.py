@@ -1,63 +1,273 @@
-from datetime import datetime, timedelta
-
-def detect_intervals(data, config, zones=None):
-    """
-    Detects intervals based on power/heart rate crossing thresholds and collects all zones spanned.
-    Args:
-        data (list of tuples): A list of (timestamp, value) pairs.
-        config (dict): Interval detection configuration.
-        zones (dict): Power/heart rate zones.
-
-    Returns:
-        list of dicts: A list of detected intervals.
-    """
-    if not data or not config or not zones:
-        return []
-
-    intervals = []
-    interval_start = None
-    interval_values = []
-    interval_zones = set()  # Use a set to collect unique zones
-
-    def determine_zone(value):
-        """Determine zone for a given value."""
-        for zone_name, (lower_bound, upper_bound) in zones.items():
-            if lower_bound <= value < upper_bound:
-                return zone_name
-        return None
-
-    for timestamp, value in data:
-        current_zone = determine_zone(value)  # Assign zone for the current value
-        if value >= config.get("sustain_above", 0):  # Start interval
-            if interval_start is None:
-                interval_start = timestamp
-                interval_values = [value]
-                interval_zones = {current_zone} if current_zone else set()
-            else:
-                interval_values.append(value)
-                if current_zone:  # Add zone to the set
-                    interval_zones.add(current_zone)
-        elif interval_start and value < config.get("sustain_above", 0):  # End interval
-            interval_end = timestamp
-            duration = (datetime.fromisoformat(interval_end) - datetime.fromisoformat(interval_start)).total_seconds()
-            if duration >= config.get("sustain_duration", 15):  # Ensure minimum interval duration
-                intervals.append({
-                    "start_time": interval_start,
-                    "end_time": interval_end,
-                    "duration": duration,
-                    "average_value": sum(interval_values) / len(interval_values),
-                    "max_value": max(interval_values),
-                    "zones": sorted(interval_zones)  # Include all unique zones spanned
-                })
-            interval_start = None
-            interval_values = []
-            interval_zones = set()
-
-    return intervals
-
-
-
-
-
-
-
+import numpy as np
+import workout_stream
+import zones as zone_tables
+
+def hysteresis_mask(values, enter_level, exit_level):
+    """
+    Returns a boolean mask that is True while inside an effort.
+
+    The mask switches on when a value reaches `enter_level` and only switches off again once a
+    value falls below `exit_level`. Values in between keep the previous state, which is
+    forward-filled with a running maximum instead of a Python loop.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    events = np.where(values >= enter_level, 1, np.where(values < exit_level, 0, -1))
+    positions = np.where(events >= 0, np.arange(len(values)), 0)
+    last_event = np.maximum.accumulate(positions) if len(values) else positions
+    return events[last_event] == 1
+
+def find_runs(mask):
+    """Returns (starts, ends) index arrays of the True runs in `mask`; ends are exclusive."""
+    edges = np.diff(np.concatenate(([0], np.asarray(mask, dtype=np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+def detect_intervals(data, config, zones=None):
+    """
+    Detects intervals based on power/heart rate crossing thresholds and collects all zones spanned.
+
+    The threshold mask is run-length encoded: run edges come from `np.diff`, and duration,
+    average, max and zones of every run come from `reduceat`, so no Python work is done per sample.
+
+    An interval opens when the value reaches `enter_above` and closes when it falls below
+    `exit_below`; both default to `sustain_above`, which gives the original single-threshold
+    boundaries, and setting `exit_below` lower (or `enter_above` higher) adds hysteresis. Dips
+    shorter than `max_dip_duration` seconds are merged into the surrounding interval, a recording
+    gap longer than `max_gap` seconds splits it, and an interval still open when the file ends is
+    closed at the last sample.
+
+    Args:
+        data (MetricSeries or list of tuples): A MetricSeries, or a list of (timestamp, value) pairs.
+        config (dict): Interval detection configuration.
+        zones (dict or ZoneTable): Power/heart rate zones, ideally precompiled with `zones.compile_zones`.
+
+    Returns:
+        list of dicts: A list of detected intervals. Besides the ISO `start_time`/`end_time`,
+                       each interval carries `start_seconds`/`end_seconds` as epoch seconds.
+    """
+    if not len(data) or not config or not zones:
+        return []
+
+    timestamps, values = workout_stream.as_arrays(data)
+    sample_count = len(values)
+    enter_level, exit_level, sustain_duration, max_dip_duration, max_gap = _thresholds(config)
+
+    starts, ends = find_runs(hysteresis_mask(values, enter_level, exit_level))
+    if not len(starts):
+        return []
+
+    # Merge runs separated by short dips
+    if len(starts) > 1:
+        dip_durations = timestamps[starts[1:]] - timestamps[ends[:-1]]
+        keep = dip_durations > max_dip_duration
+        starts = starts[np.concatenate(([True], keep))]
+        ends = ends[np.concatenate((keep, [True]))]
+
+    # Split runs at recording gaps
+    gap_positions = np.flatnonzero(np.diff(timestamps) > max_gap) + 1
+    run_index = np.searchsorted(ends, gap_positions, side="right")
+    in_run = (run_index < len(starts)) & (starts[np.minimum(run_index, len(starts) - 1)] < gap_positions)
+    split_positions = gap_positions[in_run]
+    if len(split_positions):
+        starts = np.sort(np.concatenate((starts, split_positions)))
+        ends = np.sort(np.concatenate((ends, split_positions)))
+
+    # An interval ends at the first sample after it, unless the file ends or a gap follows
+    gap_before = np.zeros(sample_count + 1, dtype=bool)
+    gap_before[gap_positions] = True
+    gap_before[sample_count] = True
+    end_times = np.where(gap_before[ends], timestamps[ends - 1], timestamps[np.minimum(ends, sample_count - 1)])
+    durations = end_times - timestamps[starts]
+
+    long_enough = durations >= sustain_duration  # Ensure minimum interval duration
+    starts, ends = starts[long_enough], ends[long_enough]
+    end_times, durations = end_times[long_enough], durations[long_enough]
+    if not len(starts):
+        return []
+
+    # Per-run statistics with reduceat over interleaved [start, end) boundaries
+    boundaries = np.column_stack((starts, ends)).ravel()
+    padded_values = np.append(values, 0.0)
+    averages = np.add.reduceat(padded_values, boundaries)[::2] / (ends - starts)
+    maxima = np.maximum.reduceat(padded_values, boundaries)[::2]
+
+    zone_table = zone_tables.compile_zones(zones, analysis_type=None)
+    zone_indices = zone_table.classify(values)
+    zone_hits = np.zeros((sample_count + 1, max(len(zone_table), 1)), dtype=np.int8)
+    matched = np.flatnonzero(zone_indices >= 0)
+    zone_hits[matched, zone_indices[matched]] = 1
+    run_zones = np.maximum.reduceat(zone_hits, boundaries, axis=0)[::2]
+
+    return [_interval(timestamps[starts[k]], end_times[k], durations[k], averages[k], maxima[k], run_zones[k], zone_table)
+            for k in range(len(starts))]
+
+def _level(config, key, default):
+    value = config.get(key)
+    return default if value is None else value
+
+def _thresholds(config):
+    """Returns (enter level, exit level, sustain duration, max dip duration, max gap) from the config."""
+    sustain_above = config.get("sustain_above", 0)
+    exit_level = _level(config, "exit_below", sustain_above)
+    enter_level = max(_level(config, "enter_above", sustain_above), exit_level)
+    return (enter_level, exit_level, config.get("sustain_duration", 15), config.get("max_dip_duration", 0),
+            config.get("max_gap", float("inf")))
+
+def _interval(start_seconds, end_seconds, duration, average, maximum, zone_hits, zone_table):
+    """Builds the interval dict returned by the detectors."""
+    start_seconds, end_seconds = float(start_seconds), float(end_seconds)
+    return {
+        "start_time": workout_stream.format_timestamp(start_seconds),
+        "end_time": workout_stream.format_timestamp(end_seconds),
+        "start_seconds": start_seconds,
+        "end_seconds": end_seconds,
+        "duration": float(duration),
+        "average_value": float(average),
+        "max_value": float(maximum),
+        "zones": sorted(zone_table.names[z] for z in np.flatnonzero(zone_hits))  # Include all unique zones spanned
+    }
+
+class _Run:
+    """Running statistics of the samples of one interval (or part of one)."""
+
+    __slots__ = ("start_seconds", "total", "count", "maximum", "zone_hits")
+
+    def __init__(self, start_seconds, zone_count):
+        self.start_seconds = start_seconds
+        self.total = 0.0
+        self.count = 0
+        self.maximum = -np.inf
+        self.zone_hits = np.zeros(max(zone_count, 1), dtype=bool)
+
+    def add(self, values, zone_indices):
+        self.total += float(np.add.reduce(values))
+        self.count += len(values)
+        self.maximum = max(self.maximum, float(values.max()))
+        self.zone_hits[zone_indices[zone_indices >= 0]] = True
+
+    def merge(self, other):
+        self.total += other.total
+        self.count += other.count
+        self.maximum = max(self.maximum, other.maximum)
+        self.zone_hits |= other.zone_hits
+
+class OnlineIntervalDetector:
+    """
+    Chunked counterpart of `detect_intervals`, for recordings too long to hold or still in progress.
+
+    Samples are fed in time order, in chunks of any size, and every interval is returned by the
+    `update` (or `finish`) that settles it, with the same boundaries, durations, maxima and zones
+    as `detect_intervals`; averages agree to floating-point rounding, as the sums are added up
+    chunk by chunk. Only constant state is carried between chunks: the hysteresis state, the
+    running statistics of the open interval and, after it drops below the exit level, those of
+    the dip until it is either merged (the level is reached again within `max_dip_duration`)
+    or the interval is closed. A dip is split at every recording gap in it, so a merged dip
+    splits the interval there as `detect_intervals` does.
+    """
+
+    def __init__(self, config, zones=None):
+        self.enabled = bool(config) and bool(zones)
+        if self.enabled:
+            (self.enter_level, self.exit_level, self.sustain_duration, self.max_dip_duration,
+             self.max_gap) = _thresholds(config)
+            self.zone_table = zone_tables.compile_zones(zones, analysis_type=None)
+        self.inside = False         # Hysteresis state after the last sample
+        self.previous_time = None
+        self.run = None             # The open interval, or the one waiting out a dip
+        self.dip = None             # After the run fell below the exit level: its would-be end and the dip's parts
+
+    def update(self, timestamps, values):
+        """
+        Feeds the next chunk of (smoothed) samples.
+
+        Args:
+            timestamps (np.ndarray): Sample times in seconds, ascending and after the previous chunk.
+            values (np.ndarray): Sample values.
+
+        Returns:
+            list of dicts: The intervals settled by this chunk, as returned by `detect_intervals`.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        if not self.enabled or not len(values):
+            return []
+        sample_count = len(values)
+        previous_time = timestamps[0] if self.previous_time is None else self.previous_time
+        gaps = np.diff(timestamps, prepend=previous_time) > self.max_gap
+
+        events = np.where(values >= self.enter_level, 1, np.where(values < self.exit_level, 0, -1))
+        last_event = np.maximum.accumulate(np.where(events >= 0, np.arange(sample_count), -1))
+        mask = np.where(last_event >= 0, events[np.maximum(last_event, 0)] == 1, self.inside)
+        changes = mask != np.concatenate(([self.inside], mask[:-1]))
+        self.inside = bool(mask[-1])
+        zone_indices = self.zone_table.classify(values)
+
+        settled = []
+        position = 0
+        for index in np.flatnonzero(changes | gaps).tolist():
+            self._accumulate(values, zone_indices, position, index)
+            before = timestamps[index - 1] if index else previous_time
+            self._step(float(timestamps[index]), float(before), bool(mask[index]), bool(gaps[index]), settled)
+            position = index
+        self._accumulate(values, zone_indices, position, sample_count)
+        self.previous_time = float(timestamps[-1])
+        # Every sample of a dip is below the entry level, so once it lasts too long it cannot merge
+        if self.dip and self.previous_time - self.dip['start_seconds'] > self.max_dip_duration:
+            self._close_dip(settled)
+        return settled
+
+    def pending_intervals(self):
+        """Returns the interval still open (or waiting out a dip) as `finish` would close it now."""
+        if self.run is None:
+            return []
+        end_seconds = self.dip['end_seconds'] if self.dip else self.previous_time
+        return self._interval(self.run, end_seconds)
+
+    def finish(self):
+        """Closes the recording and returns the intervals it settles."""
+        settled = self.pending_intervals()
+        self.run = self.dip = None
+        return settled
+
+    def _interval(self, run, end_seconds):
+        duration = end_seconds - run.start_seconds
+        if duration < self.sustain_duration:
+            return []
+        return [_interval(run.start_seconds, end_seconds, duration, run.total / run.count, run.maximum,
+                          run.zone_hits, self.zone_table)]
+
+    def _accumulate(self, values, zone_indices, start, end):
+        target = self.dip['parts'][-1][0] if self.dip else self.run
+        if target is not None and end > start:
+            target.add(values[start:end], zone_indices[start:end])
+
+    def _close_dip(self, settled):
+        settled.extend(self._interval(self.run, self.dip['end_seconds']))
+        self.run = self.dip = None
+
+    def _step(self, time, before, inside, gap, settled):
+        """Handles a sample where the hysteresis state changes or a recording gap ends."""
+        zone_count = len(self.zone_table)
+        if self.run is not None and self.dip is None and not inside:
+            # Below the exit level: the run ends here unless it is reached again within the dip limit
+            self.dip = {'start_seconds': time, 'end_seconds': before if gap else time,
+                        'parts': [(_Run(time, zone_count), None)]}
+        if gap:
+            if self.dip and time - self.dip['start_seconds'] > self.max_dip_duration:
+                self._close_dip(settled)
+            elif self.dip:
+                self.dip['parts'].append((_Run(time, zone_count), before))
+            elif self.run is not None:
+                settled.extend(self._interval(self.run, before))
+                self.run = _Run(time, zone_count)
+        if inside and (self.run is None or self.dip):
+            if self.dip and time - self.dip['start_seconds'] <= self.max_dip_duration:
+                parts = self.dip['parts']
+                self.run.merge(parts[0][0])
+                for part, previous_end in parts[1:]:
+                    settled.extend(self._interval(self.run, previous_end))
+                    self.run = part
+                self.dip = None
+            else:
+                if self.dip:
+                    self._close_dip(settled)
+                self.run = _Run(time, zone_count)
@@ -1,95 +1,344 @@
-# main.py
-import os
-import json
-import data_parser
-import interval_detection
-import grouping
-import summary_generation
-import zones
-import utils
-import yaml
-from datetime import datetime
-
-# --- Configuration ---
-CONFIG_FILE = os.path.join(os.path.dirname(__file__), '..', 'config', 'config.yaml')
-try:
-    with open(CONFIG_FILE, 'r') as f:
-        config = yaml.safe_load(f)
-        power_interval_config = config.get('power_interval_thresholds', {})
-        heart_rate_interval_config = config.get('heart_rate_interval_thresholds', {})
-        power_zone_definitions = config.get('power_zones', {})
-        heart_rate_zone_definitions = config.get('heart_rate_zones', {})
-except FileNotFoundError:
-    print(f"Warning: Configuration file '{CONFIG_FILE}' not found. Using default settings.")
-    power_interval_config = {}
-    heart_rate_interval_config = {}
-    power_zone_definitions = {}
-    heart_rate_zone_definitions = {}
-
-RAW_DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw')
-PROCESSED_DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'processed')
-
-# Ensure processed data directory exists
-os.makedirs(PROCESSED_DATA_DIR, exist_ok=True)
-
-def analyze_workout(file_path):
-    """Analyzes a single workout file."""
-    filename = os.path.basename(file_path)
-    print(f"Analyzing: {filename}")
-
-    data = data_parser.parse_workout_file(file_path)
-
-    if not data:
-        print(f"Error: Could not parse data from {filename}.")
-        return
-
-    power_data = [(item['timestamp'], item['power']) for item in data if 'power' in item and item['power'] is not None]
-    heart_rate_data = [(item['timestamp'], item['heart_rate']) for item in data if 'heart_rate' in item and item['heart_rate'] is not None]
-
-    intervals = []
-    analysis_type = "none"
-    raw_values = []
-
-    if power_data:
-        analysis_type = "power"
-        raw_values = power_data
-        smoothed_power = utils.smooth_data(power_data, window_size=5)
-        intervals = interval_detection.detect_intervals(smoothed_power, power_interval_config, zones=power_zone_definitions)
-        zone_analysis = zones.analyze_zones(power_data, power_zone_definitions, analysis_type)
-    elif heart_rate_data:
-        analysis_type = "heart_rate"
-        raw_values = heart_rate_data
-        smoothed_hr = utils.smooth_data(heart_rate_data, window_size=10)
-        intervals = interval_detection.detect_intervals(smoothed_hr, heart_rate_interval_config, zones=heart_rate_zone_definitions)
-        zone_analysis = zones.analyze_zones(heart_rate_data, heart_rate_zone_definitions, analysis_type)
-    else:
-        print("No power or heart rate data found in the file.")
-        return
-
-    grouped_intervals = grouping.group_intervals(intervals)
-    workout_summary = summary_generation.generate_summary(raw_values, intervals, grouped_intervals, analysis_type, zone_analysis=zone_analysis)
-    # Generate the title and add it to the summary
-    title = summary_generation.generate_workout_title(workout_summary)
-    workout_summary['title'] = title
-    output_filename = os.path.splitext(filename)[0] + "_summary.json"
-    output_path = os.path.join(PROCESSED_DATA_DIR, output_filename)
-
-    with open(output_path, 'w') as f:
-        json.dump(workout_summary, f, indent=4)
-
-    print(f"Analysis saved to: {output_path}\n")
-
-
-def main():
-    """Main function to process all workout files in the raw data directory."""
-    if not os.path.exists(RAW_DATA_DIR):
-        print(f"Error: Raw data directory '{RAW_DATA_DIR}' not found.")
-        return
-
-    for filename in os.listdir(RAW_DATA_DIR):
-        file_path = os.path.join(RAW_DATA_DIR, filename)
-        if os.path.isfile(file_path):
-            analyze_workout(file_path)
-
-if __name__ == "__main__":
-    main()
+# main.py
+import os
+import json
+import sys
+import time
+import config_cache
+import instrumentation
+import manifest
+
+# The analysis modules (numpy, the parsers) are imported by the functions that use them, so
+# the command line starts quickly on paths that only read config, manifest and summaries.
+
+# --- Configuration ---
+CONFIG_FILE = config_cache.CONFIG_FILE
+RAW_DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw')
+PROCESSED_DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'processed')
+
+_settings = None
+
+logger = instrumentation.get_logger("main")
+
+def load_config(config_file=CONFIG_FILE):
+    """Loads and validates config.yaml (see `config_cache.load_config`), or an empty config if it is missing."""
+    return config_cache.load_config(config_file)
+
+def compile_settings(config):
+    """
+    Extracts the analysis settings from a loaded config and precompiles the zone tables.
+
+    The result is a plain, picklable dict, so it can be built once and shipped to worker processes.
+    """
+    import training_load
+    import zones
+    return {
+        'power_interval_config': config.get('power_interval_thresholds', {}) or {},
+        'heart_rate_interval_config': config.get('heart_rate_interval_thresholds', {}) or {},
+        'power_zone_table': zones.compile_zones(config.get('power_zones', {}), "power"),
+        'heart_rate_zone_table': zones.compile_zones(config.get('heart_rate_zones', {}), "heart_rate"),
+        'smoothing_config': config.get('smoothing', {}) or {},
+        'resampling_config': config.get('resampling', {}) or {},
+        'training_load_thresholds': training_load.thresholds(config),
+        'batch_config': config.get('batch', {}) or {},
+        'cache_config': config.get('cache', {}) or {},
+        'logging_config': config.get('logging', {}) or {},
+    }
+
+def get_settings():
+    """Returns the compiled settings, loading config.yaml on first use."""
+    global _settings
+    if _settings is None:
+        _settings = compile_settings(load_config())
+    return _settings
+
+def set_settings(settings):
+    """Makes `settings` (from `compile_settings`) the ones analyses in this process use by default."""
+    global _settings
+    _settings = settings
+
+def summary_filename(filename):
+    """Returns the summary file name for a raw workout file name."""
+    return os.path.splitext(filename)[0] + "_summary.json"
+
+def analyze_workout(file_path, settings=None, source_hash=None):
+    """
+    Analyzes a single workout file and writes its summary to PROCESSED_DATA_DIR.
+
+    Args:
+        file_path (str): Path to a .tcx, .gpx or .fit file.
+        settings (dict): Compiled settings from `compile_settings`. Defaults to config.yaml.
+        source_hash (str): SHA-256 of the file if already known, used as the stream cache key.
+
+    Returns:
+        dict or None: The workout summary, or None if the file could not be analyzed.
+    """
+    import data_parser
+    import metric_analysis
+    import mean_max
+    import resampling
+    import stream_cache
+    import summary_generation
+    import training_load
+
+    settings = settings or get_settings()
+    recorder = instrumentation.current()
+    filename = os.path.basename(file_path)
+    logger.info(f"Analyzing: {filename}")
+
+    with recorder.stage('parse'):
+        cache_config = settings['cache_config']
+        if cache_config.get('enabled', True):
+            max_bytes = int(cache_config.get('max_mb', 512) * 1024 * 1024)
+            stream = stream_cache.get_stream(file_path, source_hash=source_hash, max_bytes=max_bytes)
+        else:
+            stream = data_parser.parse_workout_stream(file_path)
+
+    if stream is None:
+        logger.error(f"Could not parse data from {filename}.")
+        return None
+    recorder.count('points_parsed', len(stream))
+
+    resampling_config = settings['resampling_config']
+    if resampling_config.get('enabled', False):  # Opt-in: the 1 s grid can shift titles by a second
+        with recorder.stage('resample'):
+            stream = resampling.resample(stream, interval=resampling_config.get('interval', 1.0),
+                                         max_gap=resampling_config.get('max_gap', 10.0), fill=resampling_config.get('fill'))
+        recorder.count('points_resampled', len(stream))
+
+    results = metric_analysis.analyze_stream(stream, settings)
+    if results is None:
+        logger.warning(f"No power or heart rate data found in {filename}.")
+        return None
+
+    analysis_type = results['analysis_type']
+    primary = results['metrics'][analysis_type]
+    intervals = primary['intervals']
+    recorder.count('points_dropped', len(stream) - len(primary['series']))
+    with recorder.stage('summarize'):
+        curves = mean_max.workout_curves(stream)
+        workout_summary = summary_generation.generate_summary(primary['series'], intervals, primary['grouped_intervals'],
+                                                              analysis_type, zone_analysis=primary['zone_analysis'],
+                                                              mean_max_curves=curves, metrics=results['metrics'],
+                                                              cross_metric=results['cross_metric'])
+        load = training_load.workout_load(stream, settings['training_load_thresholds'])
+        if load:
+            workout_summary['training_load'] = load
+        if resampling_config.get('enabled', False):
+            workout_summary['recording'] = resampling.recording_stats(stream)
+            if resampling_config.get('preview_points', 300):
+                workout_summary['preview'] = resampling.preview(stream, points=resampling_config.get('preview_points', 300))
+        # Generate the title and add it to the summary
+        title = summary_generation.generate_workout_title(workout_summary)
+        workout_summary['title'] = title
+    recorder.count('intervals_detected', len(intervals))
+
+    output_path = os.path.join(PROCESSED_DATA_DIR, summary_filename(filename))
+    with recorder.stage('write'):
+        with open(output_path, 'w') as f:
+            json.dump(workout_summary, f, indent=4)
+
+    logger.info(f"Analysis saved to: {output_path}")
+    return workout_summary
+
+def _init_worker(settings):
+    """Process pool initializer: receives the compiled settings once per worker."""
+    set_settings(settings)
+    os.makedirs(PROCESSED_DATA_DIR, exist_ok=True)
+    logging_config = settings.get('logging_config', {})
+    instrumentation.configure_logging(logging_config.get('level') or "INFO", logging_config.get('format') == "json")
+
+def _analyze_file_timed(job):
+    """Runs analyze_workout on one (file_path, source_hash) job, isolating failures and timing it."""
+    file_path, source_hash = job
+    enabled = _settings.get('logging_config', {}).get('instrumentation', False)
+    recorder = instrumentation.Recorder() if enabled else instrumentation.NULL_RECORDER
+    started = time.perf_counter()
+    summary = None
+    try:
+        with instrumentation.recording(recorder):
+            summary = analyze_workout(file_path, source_hash=source_hash)
+        status, error = ("ok" if summary is not None else "skipped"), None
+    except Exception as e:  # One corrupt file must not abort the batch
+        status, error = "failed", f"{type(e).__name__}: {e}"
+        logger.exception(f"Failed to analyze {os.path.basename(file_path)}")
+    return {
+        'file': os.path.basename(file_path),
+        'status': status,
+        'error': error,
+        'analysis_type': summary['analysis_type'] if summary else "none",
+        'summary': summary,
+        'seconds': time.perf_counter() - started,
+        'metrics': recorder.report(),
+    }
+
+def analyze_batch(file_paths, settings=None, workers=None, source_hashes=None):
+    """
+    Analyzes many workout files across a process pool.
+
+    Args:
+        file_paths (list of str): Files to analyze. They are processed and reported in sorted order.
+        settings (dict): Compiled settings, shipped to every worker once. Defaults to config.yaml.
+        workers (int): Number of worker processes. Defaults to `batch.workers` in config.yaml,
+                       then to the CPU count. With 1 worker everything runs in this process.
+        source_hashes (dict): Optional file name -> SHA-256, so workers need not hash the files.
+
+    Returns:
+        list of dicts: One report per file with 'file', 'status' ("ok", "skipped" or "failed"),
+                       'error', 'analysis_type', 'summary', 'seconds' and 'metrics' (stage timings and
+                       counters, or None unless `logging.instrumentation` is on).
+    """
+    settings = settings or get_settings()
+    source_hashes = source_hashes or {}
+    jobs = [(file_path, source_hashes.get(os.path.basename(file_path))) for file_path in sorted(file_paths)]
+    if workers is None:
+        workers = settings['batch_config'].get('workers') or os.cpu_count() or 1
+    workers = max(1, min(int(workers), len(jobs) or 1))
+
+    if workers == 1:
+        _init_worker(settings)
+        return [_analyze_file_timed(job) for job in jobs]
+
+    from concurrent.futures import ProcessPoolExecutor
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(settings,)) as executor:
+        return list(executor.map(_analyze_file_timed, jobs, chunksize=chunksize))
+
+def print_batch_report(reports, elapsed):
+    """Logs per-file timing and a one-line total for a batch run."""
+    logger.info("Batch report:")
+    for report in reports:
+        line = f"  {report['file']}: {report['status']} in {report['seconds'] * 1000:.1f} ms"
+        if report['error']:
+            line += f" ({report['error']})"
+        logger.info(line)
+    failed = sum(1 for report in reports if report['status'] == "failed")
+    logger.info(f"Processed {len(reports)} files in {elapsed:.2f} s ({failed} failed).")
+
+def emit_instrumentation(reports, elapsed, report_file=None):
+    """Emits one machine-readable record per file and a batch total, as logs and optionally JSON lines."""
+    for report in reports:
+        if report['metrics'] is not None:
+            instrumentation.emit('file_report', {'file': report['file'], 'status': report['status'],
+                                                 'seconds': round(report['seconds'], 6), **report['metrics']},
+                                 report_file)
+    batch = instrumentation.merge_reports(report['metrics'] for report in reports)
+    batch.update(seconds=round(elapsed, 6), failed=sum(1 for report in reports if report['status'] == "failed"))
+    instrumentation.emit('batch_report', batch, report_file)
+
+def record_reports(reports, config, processed_manifest, fingerprints):
+    """
+    Records finished analyses: manifest entries, the activity store and the best-curve history.
+
+    Failed files are left out of the manifest so they are retried on the next run. The manifest
+    itself is updated in memory only; the caller saves it.
+
+    Args:
+        reports (list of dicts): Reports from `analyze_batch`.
+        config (dict): The loaded config.yaml.
+        processed_manifest (dict): Manifest from `manifest.load_manifest`.
+        fingerprints (dict): File name -> fingerprint, as returned by `manifest.find_stale`.
+    """
+    if not reports:
+        return
+    import activity_store
+    import mean_max
+    import workout_stream
+    history = mean_max.load_history(PROCESSED_DATA_DIR)
+    store = activity_store.connect()
+    # Oldest workouts first, so the daily training load series is appended to rather than recomputed
+    reports = sorted(reports, key=lambda report: (report['summary'] or {}).get('start_time') or "")
+    added, replaced = [], False
+    for report in reports:
+        if report['status'] == "failed":
+            continue  # Retried on the next run
+        summary_name = summary_filename(report['file']) if report['status'] == "ok" else None
+        manifest.record(processed_manifest, config, report['file'], fingerprints[report['file']],
+                        report['analysis_type'], summary_name)
+        summary = report['summary']
+        if summary:
+            activity_store.store_summary(store, os.path.splitext(report['file'])[0], summary)
+        if summary and summary.get('mean_max_curves') and summary.get('start_time'):
+            start_seconds = workout_stream.parse_timestamp(summary['start_time'])
+            replaced |= mean_max.update_history(history, report['file'], start_seconds, summary['mean_max_curves'])
+            added.append(report['file'])
+    if added:
+        mean_max.refresh_bests(history, added, replaced)  # Once per batch, not per file
+        mean_max.save_history(history, PROCESSED_DATA_DIR)
+    store.close()
+
+def configure_logging_from_args(args, default_level=None):
+    """
+    Loads config.yaml and applies the logging flags, without compiling the analysis settings.
+
+    Args:
+        args (argparse.Namespace): Parsed flags from `instrumentation.add_logging_arguments`.
+        default_level (str): Level used when --log-level is not given, instead of logging.level.
+
+    Returns:
+        dict: The config, with the flags applied to its logging section.
+    """
+    config = load_config()
+    logging_config = dict(config.get('logging', {}) or {})
+    if args.log_level or default_level:
+        logging_config['level'] = args.log_level or default_level
+    if args.log_json:
+        logging_config['format'] = "json"
+    if args.instrument:
+        logging_config['instrumentation'] = True
+    config['logging'] = logging_config
+    instrumentation.configure_logging(logging_config.get('level') or "INFO", logging_config.get('format') == "json")
+    return config
+
+def configure_from_args(args):
+    """Loads config.yaml, applies the logging flags and compiles the settings. Returns (config, settings)."""
+    config = configure_logging_from_args(args)
+    return config, compile_settings(config)
+
+def main(argv=None):
+    """Analyzes new or changed workout files in the raw data directory (`cli.py batch`)."""
+    import cli
+    return cli.main_cli(["batch"] + list(sys.argv[1:] if argv is None else argv))
+
+def run_batch(config, settings, workers=None, force=False, file_paths=None):
+    """
+    Analyzes every new or changed file in RAW_DATA_DIR, or of `file_paths`, and records the results.
+
+    Args:
+        config (dict): The loaded config.yaml.
+        settings (dict): Compiled settings from `compile_settings`.
+        workers (int): Number of worker processes (see `analyze_batch`).
+        force (bool): Reanalyze every file, ignoring the manifest.
+        file_paths (list of str): Only these files. Manifest entries of other files are kept;
+                                  by default the whole raw data directory is scanned and entries
+                                  of deleted files are dropped.
+
+    Returns:
+        list of dicts: Reports from `analyze_batch` for the files that were analyzed.
+    """
+    prune = file_paths is None
+    if file_paths is None:
+        with os.scandir(RAW_DATA_DIR) as entries:
+            file_paths = sorted(entry.path for entry in entries if entry.is_file())
+    os.makedirs(PROCESSED_DATA_DIR, exist_ok=True)
+
+    processed_manifest = manifest.load_manifest(PROCESSED_DATA_DIR)
+    stale, fingerprints = manifest.find_stale(file_paths, processed_manifest, config, PROCESSED_DATA_DIR,
+                                              force=force, prune=prune)
+
+    started = time.perf_counter()
+    source_hashes = {name: fingerprint['sha256'] for name, fingerprint in fingerprints.items()}
+    reports = analyze_batch(stale, settings=settings, workers=workers, source_hashes=source_hashes) if stale else []
+    record_reports(reports, config, processed_manifest, fingerprints)
+    manifest.save_manifest(processed_manifest, PROCESSED_DATA_DIR)
+
+    elapsed = time.perf_counter() - started
+    logger.info(f"{len(file_paths) - len(stale)} of {len(file_paths)} files up to date.")
+    if reports:
+        print_batch_report(reports, elapsed)
+        logging_config = settings.get('logging_config', {})
+        if logging_config.get('instrumentation'):
+            emit_instrumentation(reports, elapsed, logging_config.get('report_file'))
+    return reports
+
+if __name__ == "__main__":
+    raise SystemExit(main())
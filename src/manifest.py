@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+
+# Bump whenever a change to the analysis code should invalidate existing summaries.
+# Since version 8, start_time and end_time are always UTC with milliseconds (see
+# workout_stream.format_timestamp) rather than the timestamp strings of the source file.
+CODE_VERSION = 8
+
+MANIFEST_FILENAME = "manifest.json"
+
+# Config sections each analysis type depends on. Heart rate is analyzed alongside power, and
+# the training load takes its thresholds from the zones.
+CONFIG_SECTIONS = {
+    "power": ("power_interval_thresholds", "power_zones", "heart_rate_interval_thresholds", "heart_rate_zones",
+              "resampling", "smoothing", "training_load"),
+    "heart_rate": ("heart_rate_interval_thresholds", "heart_rate_zones", "resampling", "smoothing", "training_load"),
+    "none": (),
+}
+
+def hash_file(file_path, chunk_size=1 << 20):
+    """Returns the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def config_hashes(config):
+    """
+    Hashes the config sections that affect each analysis type.
+
+    Returns:
+        dict: Analysis type ("power", "heart_rate", "none") -> hex digest.
+    """
+    hashes = {}
+    for analysis_type, sections in CONFIG_SECTIONS.items():
+        relevant = {section: config.get(section) for section in sections}
+        encoded = json.dumps(relevant, sort_keys=True, default=str).encode()
+        hashes[analysis_type] = hashlib.sha256(encoded).hexdigest()
+    return hashes
+
+def load_manifest(processed_dir):
+    """Loads the manifest from `processed_dir`, or returns an empty one."""
+    manifest_path = os.path.join(processed_dir, MANIFEST_FILENAME)
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {'code_version': CODE_VERSION, 'files': {}}
+    if manifest.get('code_version') != CODE_VERSION:
+        return {'code_version': CODE_VERSION, 'files': {}}  # Different analysis code: everything is stale
+    manifest.setdefault('files', {})
+    return manifest
+
+def save_manifest(manifest, processed_dir):
+    """Writes the manifest atomically to `processed_dir`."""
+    manifest_path = os.path.join(processed_dir, MANIFEST_FILENAME)
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(temp_path, manifest_path)
+
+def find_stale(file_paths, manifest, config, processed_dir, force=False, prune=True):
+    """
+    Works out which raw files need (re)analysis.
+
+    A file is unchanged when its size and mtime match the manifest; only then is hashing skipped.
+    If the mtime moved but the content hash is the same, the entry is refreshed without
+    reanalysis. A file is stale when it is new, its content changed, the config sections its
+    analysis type depends on changed, or its summary is missing.
+
+    Args:
+        file_paths (list of str): Raw workout files.
+        manifest (dict): Manifest from `load_manifest`.
+        config (dict): The loaded config.yaml.
+        processed_dir (str): Directory holding the summaries.
+        force (bool): Treat every file as stale (full rebuild).
+        prune (bool): Drop manifest entries of files not in `file_paths` (i.e. deleted files). Pass
+                      False when checking only some of the files.
+
+    Returns:
+        tuple: (list of stale file paths, dict of file name -> fingerprint for every file).
+    """
+    entries = manifest['files']
+    current_hashes = config_hashes(config)
+    if prune:
+        names = {os.path.basename(file_path) for file_path in file_paths}
+        for name in list(entries):
+            if name not in names:
+                del entries[name]
+
+    stale = []
+    fingerprints = {}
+    for file_path in file_paths:
+        name = os.path.basename(file_path)
+        stat = os.stat(file_path)
+        entry = entries.get(name)
+        fingerprint = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            fingerprint['sha256'] = entry['sha256']
+        else:
+            fingerprint['sha256'] = hash_file(file_path)
+            if entry and entry['sha256'] == fingerprint['sha256']:
+                entry.update(fingerprint)  # Touched but not changed
+        fingerprints[name] = fingerprint
+
+        if (force or entry is None
+                or entry['sha256'] != fingerprint['sha256']
+                or entry['config_hash'] != current_hashes.get(entry['analysis_type'])
+                or (entry.get('summary') and not os.path.exists(os.path.join(processed_dir, entry['summary'])))):
+            stale.append(file_path)
+
+    return stale, fingerprints
+
+def record(manifest, config, file_name, fingerprint, analysis_type, summary_name=None):
+    """Records a successfully processed file in the manifest."""
+    manifest['files'][file_name] = dict(
+        fingerprint,
+        analysis_type=analysis_type,
+        config_hash=config_hashes(config)[analysis_type],
+        summary=summary_name,
+    )
@@ -0,0 +1,214 @@
+import json
+import os
+
+import numpy as np
+import workout_stream
+
+HISTORY_FILENAME = "best_curves.json"
+ROLLING_DAYS = 90
+CURVE_METRICS = ("power", "heart_rate")
+# Beyond this many gap-free runs, mean_max_curve masks windows instead of looping over runs
+MAX_RUNS = 32
+
+def curve_durations(max_duration=86400, dense_until=60, growth=1.05):
+    """
+    Returns the durations (in seconds) a mean-maximal curve is evaluated at.
+
+    Every second up to `dense_until`, then steps growing by `growth` (about 5%) up to
+    `max_duration`. The grid is the same for every workout, so curves can be combined
+    element-wise.
+    """
+    durations = list(range(1, min(dense_until, max_duration) + 1))
+    while durations[-1] < max_duration:
+        durations.append(min(max_duration, max(durations[-1] + 1, int(round(durations[-1] * growth)))))
+    return np.array(durations, dtype=np.int64)
+
+DURATIONS = curve_durations()
+
+def to_one_second_grid(timestamps, values, max_gap=10):
+    """
+    Puts samples onto a 1 s grid by holding each value until the next sample.
+
+    Seconds more than `max_gap` seconds after the last sample are NaN, so efforts are never
+    stitched across dropouts or pauses.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    if not len(timestamps):
+        return values.copy()
+    grid = np.arange(timestamps[0], timestamps[-1] + 1.0, 1.0)
+    positions = np.searchsorted(timestamps, grid, side="right") - 1
+    held = values[positions]
+    held[grid - timestamps[positions] > max_gap] = np.nan
+    return held
+
+def _valid_runs(valid):
+    """Returns the (start, stop) bounds of the True runs in `valid`, longest first."""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], valid.view(np.int8), [0]))))
+    runs = list(zip(edges[0::2].tolist(), edges[1::2].tolist()))
+    runs.sort(key=lambda run: run[0] - run[1])
+    return runs
+
+def mean_max_curve(data, metric=None, durations=DURATIONS, max_gap=10):
+    """
+    Computes the best average value for every duration in `durations`.
+
+    Each duration is one vectorized pass over prefix sums (max of c[i + d] - c[i]), so the
+    whole curve costs O(n * len(durations)) instead of the O(n^2) scan over every window.
+    Windows are taken inside each gap-free run of samples, longest run first, so no
+    per-window validity mask is needed and durations longer than the longest run are skipped.
+    Recordings broken into more than MAX_RUNS runs fall back to masking incomplete windows.
+
+    Args:
+        data (WorkoutStream, MetricSeries or list of tuples): The samples.
+        metric (str): Metric to take from a WorkoutStream.
+        durations (np.ndarray): Durations in seconds.
+        max_gap (float): Longest gap in seconds bridged by holding the last value.
+
+    Returns:
+        np.ndarray: Best average per duration, NaN where the workout has no window that long.
+    """
+    timestamps, values = workout_stream.as_arrays(data, metric)
+    held = to_one_second_grid(timestamps, values, max_gap)
+    valid = ~np.isnan(held)
+    sums = np.concatenate(([0.0], np.cumsum(np.where(valid, held, 0.0))))
+    runs = _valid_runs(valid)
+
+    curve = np.full(len(durations), np.nan)
+    if len(runs) > MAX_RUNS:
+        counts = np.concatenate(([0], np.cumsum(valid)))
+        for i, duration in enumerate(durations):
+            if duration > len(held):
+                break
+            window_sums = sums[duration:] - sums[:-duration]
+            complete = (counts[duration:] - counts[:-duration]) == duration
+            if complete.any():
+                curve[i] = window_sums[complete].max() / duration
+        return curve
+
+    run_sums = [sums[start:stop + 1] for start, stop in runs]
+    for i, duration in enumerate(durations):
+        best = None
+        for run in run_sums:
+            if duration >= len(run):
+                break  # Runs are sorted longest first
+            run_best = (run[duration:] - run[:-duration]).max()
+            if best is None or run_best > best:
+                best = run_best
+        if best is None:
+            break
+        curve[i] = best / duration
+    return curve
+
+def curve_to_json(curve):
+    """Returns a curve as a list trimmed after its last value, with None for gaps."""
+    present = np.flatnonzero(~np.isnan(curve))
+    if not len(present):
+        return []
+    return [None if np.isnan(value) else round(float(value), 1) for value in curve[:present[-1] + 1]]
+
+def curve_from_json(values, length=len(DURATIONS)):
+    """Inverse of `curve_to_json`, padded with NaN to `length`."""
+    curve = np.full(length, np.nan)
+    curve[:len(values)] = [np.nan if value is None else value for value in values]
+    return curve
+
+def workout_curves(stream, max_gap=10):
+    """
+    Returns the mean-maximal curves of every metric present in a WorkoutStream, in summary form.
+
+    Returns:
+        dict: {'durations': [...], 'power': [...], 'heart_rate': [...]} (metrics only if present).
+    """
+    curves = {}
+    for metric in CURVE_METRICS:
+        if stream.has(metric):
+            curves[metric] = curve_to_json(mean_max_curve(stream, metric, max_gap=max_gap))
+    longest = max((len(values) for values in curves.values()), default=0)
+    curves['durations'] = DURATIONS[:longest].tolist()
+    return curves
+
+def load_history(processed_dir):
+    """Loads the history of best curves from `processed_dir`, or returns an empty one."""
+    try:
+        with open(os.path.join(processed_dir, HISTORY_FILENAME), 'r') as f:
+            history = json.load(f)
+        if history.get('durations') == DURATIONS.tolist():
+            return history
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    return {'durations': DURATIONS.tolist(), 'activities': {}, 'all_time': {}, 'rolling': {}}
+
+def save_history(history, processed_dir):
+    """Writes the history atomically to `processed_dir`."""
+    path = os.path.join(processed_dir, HISTORY_FILENAME)
+    with open(path + ".tmp", 'w') as f:
+        json.dump(history, f)
+    os.replace(path + ".tmp", path)
+
+def _best_of(curves):
+    """Element-wise maximum of a list of curves, ignoring NaN."""
+    if not curves:
+        return np.full(len(DURATIONS), np.nan)
+    stacked = np.vstack(curves)
+    best = np.full(len(DURATIONS), np.nan)
+    has_value = ~np.isnan(stacked).all(axis=0)
+    best[has_value] = np.nanmax(stacked[:, has_value], axis=0)
+    return best
+
+def update_history(history, activity, start_seconds, curves):
+    """
+    Stores one workout's curves in the history, leaving the all-time and rolling bests alone.
+
+    A batch adds all its workouts first and then calls `refresh_bests` once, so reprocessing
+    every file costs one pass over the history rather than one per file.
+
+    Args:
+        history (dict): History from `load_history`, updated in place.
+        activity (str): Activity identifier (raw file name).
+        start_seconds (float): Workout start as epoch seconds.
+        curves (dict): Curves from `workout_curves`.
+
+    Returns:
+        bool: True if the activity was already in the history and has been replaced.
+    """
+    activities = history['activities']
+    replaced = activity in activities
+    activities[activity] = {'start': start_seconds, **{metric: curves[metric] for metric in CURVE_METRICS if metric in curves}}
+    return replaced
+
+def refresh_bests(history, added, replaced=False, rolling_days=ROLLING_DAYS):
+    """
+    Updates the all-time and rolling bests after `update_history` calls.
+
+    When only new activities were added, the all-time curve is the element-wise maximum of the
+    previous one and their curves. It is rebuilt from the stored per-activity curves only when
+    an activity was replaced, since its old values may have been the best. The rolling curve
+    covers the `rolling_days` before the most recent activity and is rebuilt from the stored
+    curves inside that window.
+
+    Args:
+        history (dict): History from `load_history`, updated in place.
+        added (list of str): Activities stored since the last refresh.
+        replaced (bool): Whether any of them replaced an earlier entry.
+        rolling_days (int): Length of the rolling window in days.
+    """
+    activities = history['activities']
+    if not activities:
+        return
+    latest = max(entry['start'] for entry in activities.values())
+    window_start = latest - rolling_days * 86400
+    for metric in CURVE_METRICS:
+        if replaced:
+            all_time = _best_of([curve_from_json(entry[metric]) for entry in activities.values() if metric in entry])
+        else:
+            previous = curve_from_json(history['all_time'].get(metric, []))
+            all_time = _best_of([previous] + [curve_from_json(activities[activity][metric]) for activity in added
+                                              if metric in activities[activity]])
+        history['all_time'][metric] = curve_to_json(all_time)
+
+        rolling = _best_of([curve_from_json(entry[metric]) for entry in activities.values()
+                            if metric in entry and entry['start'] >= window_start])
+        history['rolling'][metric] = curve_to_json(rolling)
+    history['rolling']['days'] = rolling_days
+    history['rolling']['as_of'] = workout_stream.format_timestamp(latest)
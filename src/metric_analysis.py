@@ -0,0 +1,290 @@
+import numpy as np
+
+import grouping
+import instrumentation
+import interval_detection
+import utils
+import zones
+
+# Metrics analyzed, in order of precedence for the primary analysis
+ANALYZED_METRICS = ("power", "heart_rate")
+DEFAULT_WINDOWS = {'power': 5, 'heart_rate': 10}
+RECOVERY_SECONDS = 60
+
+def analyze_metric(series, metric, settings):
+    """
+    Smooths one metric, detects its intervals and adds up its time in zones.
+
+    Args:
+        series (MetricSeries): The metric's present samples.
+        metric (str): "power" or "heart_rate".
+        settings (dict): Compiled settings from `main.compile_settings`.
+
+    Returns:
+        dict: 'series', 'intervals', 'grouped_intervals', 'zone_analysis', 'average_value' and 'max_value'.
+    """
+    recorder = instrumentation.current()
+    smoothing_config = settings['smoothing_config']
+    zone_table = settings[f'{metric}_zone_table']
+
+    with recorder.stage('smooth'):
+        smoothed = utils.smooth_data(series, window_size=smoothing_config.get(f'{metric}_window', DEFAULT_WINDOWS[metric]),
+                                     method=smoothing_config.get('method', 'sample'))
+    with recorder.stage('detect'):
+        intervals = interval_detection.detect_intervals(smoothed, settings[f'{metric}_interval_config'], zones=zone_table)
+    with recorder.stage('zones'):
+        zone_analysis = zones.analyze_zones(series, zone_table, metric)
+    with recorder.stage('group'):
+        grouped_intervals = grouping.group_intervals(intervals)
+
+    return {
+        'series': series,
+        'intervals': intervals,
+        'grouped_intervals': grouped_intervals,
+        'zone_analysis': zone_analysis,
+        'average_value': float(series.values.mean()),
+        'max_value': float(series.values.max()),
+    }
+
+def _value_at(timestamps, values, times):
+    """Returns the last sample at or before each of `times` (the first sample for earlier times)."""
+    return values[np.maximum(np.searchsorted(timestamps, times, side="right") - 1, 0)]
+
+def heart_rate_response(heart_rate, intervals, recovery_seconds=RECOVERY_SECONDS):
+    """
+    Describes how heart rate followed each interval of another metric (usually power).
+
+    All intervals are handled at once: sample ranges come from `searchsorted` on the heart rate
+    timeline, averages from its prefix sums and maxima from `reduceat`.
+
+    Args:
+        heart_rate (MetricSeries): Heart rate samples.
+        intervals (list of dicts): Intervals with `start_seconds`/`end_seconds`.
+        recovery_seconds (float): How long after each interval the recovery is measured.
+
+    Returns:
+        list of dicts or None: Per interval, heart rate at the start and end, its average, maximum
+                               and rise over the interval, and the drop in the `recovery_seconds`
+                               after it (None when the recording stops earlier). None for an
+                               interval without heart rate samples.
+    """
+    if not intervals:
+        return []
+    timestamps, values = heart_rate.timestamps, heart_rate.values
+    starts = np.array([interval['start_seconds'] for interval in intervals])
+    ends = np.array([interval['end_seconds'] for interval in intervals])
+
+    first = np.searchsorted(timestamps, starts, side="left")
+    last = np.searchsorted(timestamps, ends, side="right")
+    covered = last > first
+    sums = np.concatenate(([0.0], np.cumsum(values)))
+    counts = np.maximum(last - first, 1)
+    averages = (sums[last] - sums[first]) / counts
+    boundaries = np.column_stack((np.minimum(first, len(values)), np.minimum(last, len(values)))).ravel()
+    maxima = np.maximum.reduceat(np.append(values, 0.0), boundaries)[::2]
+
+    at_start = _value_at(timestamps, values, starts)
+    at_end = _value_at(timestamps, values, ends)
+    recovered = _value_at(timestamps, values, ends + recovery_seconds)
+    has_recovery = ends + recovery_seconds <= timestamps[-1]
+
+    responses = []
+    for k in range(len(intervals)):
+        if not covered[k]:
+            responses.append(None)
+            continue
+        responses.append({
+            'start': float(at_start[k]),
+            'end': float(at_end[k]),
+            'average': round(float(averages[k]), 1),
+            'max': float(maxima[k]),
+            'rise': float(at_end[k] - at_start[k]),
+            'recovery': float(at_end[k] - recovered[k]) if has_recovery[k] else None,
+        })
+    return responses
+
+def aerobic_decoupling(stream, output_metric=None):
+    """
+    Compares the efficiency factor (output per heartbeat) of the two halves of a workout.
+
+    Uses only the samples where both the output metric and heart rate are present, split at the
+    midpoint of the elapsed time. A positive decoupling means heart rate drifted up relative to
+    the output in the second half.
+
+    Args:
+        stream (WorkoutStream): The workout.
+        output_metric (str): "power" or "speed". Defaults to power, else speed.
+
+    Returns:
+        dict or None: 'basis', 'first_half_ef', 'second_half_ef' and 'decoupling_percent', or
+                      None without heart rate or output, or when either half has no samples.
+    """
+    if output_metric is None:
+        output_metric = next((metric for metric in ("power", "speed") if stream.has(metric)), None)
+    if output_metric is None or not stream.has('heart_rate'):
+        return None
+
+    both = stream.masks[output_metric] & stream.masks['heart_rate'] & (stream.metrics['heart_rate'] > 0)
+    timestamps = stream.timestamps[both]
+    if len(timestamps) < 2:
+        return None
+    output = stream.metrics[output_metric][both]
+    heart_rate = stream.metrics['heart_rate'][both]
+    split = np.searchsorted(timestamps, (timestamps[0] + timestamps[-1]) / 2.0)
+    if split == 0 or split == len(timestamps):
+        return None
+
+    first_half_ef = output[:split].mean() / heart_rate[:split].mean()
+    second_half_ef = output[split:].mean() / heart_rate[split:].mean()
+    if first_half_ef <= 0:
+        return None
+    return {
+        'basis': output_metric,
+        'first_half_ef': round(float(first_half_ef), 3 if output_metric == "power" else 5),
+        'second_half_ef': round(float(second_half_ef), 3 if output_metric == "power" else 5),
+        'decoupling_percent': round(float((first_half_ef - second_half_ef) / first_half_ef * 100.0), 2),
+    }
+
+def analyze_stream(stream, settings):
+    """
+    Analyzes every metric of a workout, plus how they relate.
+
+    The stream is parsed (and resampled) once for all metrics, but each present metric (power,
+    heart rate) is then analyzed on its own by `analyze_metric`: separate smoothing, interval
+    detection, zone and grouping passes, the treatment the primary metric always had, so the
+    primary results are unchanged. Cross-metric results are the heart rate response to every
+    interval of the primary metric (when that is power) and the aerobic decoupling of the
+    workout; they are computed from the per-metric results, which are left as they are.
+
+    Args:
+        stream (WorkoutStream): The parsed workout.
+        settings (dict): Compiled settings from `main.compile_settings`.
+
+    Returns:
+        dict or None: 'analysis_type' (the primary metric), 'metrics' (metric -> result of
+                      `analyze_metric`) and 'cross_metric', or None without power or heart rate.
+                      'cross_metric' may hold 'heart_rate_response' (the `heart_rate_response`
+                      list, aligned with the primary metric's intervals) and 'aerobic_decoupling'.
+    """
+    analysis_type = stream.primary_metric()
+    if analysis_type is None:
+        return None
+
+    metrics = {}
+    for metric in ANALYZED_METRICS:
+        if stream.has(metric):
+            metrics[metric] = analyze_metric(stream.series(metric), metric, settings)
+
+    cross_metric = {}
+    if analysis_type != "heart_rate" and 'heart_rate' in metrics:
+        responses = heart_rate_response(metrics['heart_rate']['series'], metrics[analysis_type]['intervals'])
+        if any(response is not None for response in responses):
+            cross_metric['heart_rate_response'] = responses
+    decoupling = aerobic_decoupling(stream)
+    if decoupling:
+        cross_metric['aerobic_decoupling'] = decoupling
+
+    return {'analysis_type': analysis_type, 'metrics': metrics, 'cross_metric': cross_metric}
+
+class OnlineMetricAnalysis:
+    """
+    Chunked counterpart of `analyze_metric`, for ultra-long recordings and rides still in progress.
+
+    Each chunk goes through the online stages (`utils.OnlineSmoother`,
+    `interval_detection.OnlineIntervalDetector`, `zones.OnlineZones`, `grouping.OnlineGrouper`),
+    so memory depends on the chunk size and smoothing window rather than on the duration, and
+    the final results are those of `analyze_metric` over the whole series (averages to
+    floating-point rounding). `summary` can be called between chunks.
+    """
+
+    def __init__(self, metric, settings):
+        smoothing_config = settings['smoothing_config']
+        zone_table = settings[f'{metric}_zone_table']
+        self.metric = metric
+        self.smoother = utils.OnlineSmoother(smoothing_config.get(f'{metric}_window', DEFAULT_WINDOWS[metric]),
+                                             method=smoothing_config.get('method', 'sample'))
+        self.detector = interval_detection.OnlineIntervalDetector(settings[f'{metric}_interval_config'], zones=zone_table)
+        self.zones = zones.OnlineZones(zone_table, metric)
+        self.grouper = grouping.OnlineGrouper()
+        self.intervals = []
+        self.grouped_intervals = []
+        self.samples = 0
+        self.total = 0.0
+        self.max_value = -np.inf
+        self.complete = False
+
+    def update(self, timestamps, values):
+        """Feeds the next chunk of the metric's present samples, in time order."""
+        recorder = instrumentation.current()
+        values = np.asarray(values, dtype=np.float64)
+        with recorder.stage('smooth'):
+            smoothed = self.smoother.update(timestamps, values)
+        self._detect(*smoothed)
+        with recorder.stage('zones'):
+            self.zones.update(timestamps, values)
+        if len(values):
+            self.samples += len(values)
+            self.total += float(np.add.reduce(values))
+            self.max_value = max(self.max_value, float(values.max()))
+
+    def _detect(self, timestamps, smoothed):
+        recorder = instrumentation.current()
+        with recorder.stage('detect'):
+            intervals = self.detector.update(timestamps, smoothed)
+        with recorder.stage('group'):
+            self.grouped_intervals += self.grouper.update(intervals)
+        self.intervals += intervals
+
+    def finish(self):
+        """Ends the recording: settles the held-back samples and the open interval and group."""
+        self._detect(*self.smoother.finish())
+        intervals = self.detector.finish()
+        self.intervals += intervals
+        self.grouped_intervals += self.grouper.update(intervals) + self.grouper.finish()
+        self.complete = True
+        return self.summary()
+
+    def summary(self):
+        """
+        Returns the results so far.
+
+        Returns:
+            dict: 'intervals', 'grouped_intervals', 'zone_analysis', 'average_value' and
+                  'max_value' as from `analyze_metric` (without the series), 'samples' and
+                  'complete'. Until `finish`, the interval in progress is included as if the
+                  recording ended at the last sample smoothed so far.
+        """
+        pending = [] if self.complete else self.detector.pending_intervals()
+        return {
+            'intervals': self.intervals + pending,
+            'grouped_intervals': self.grouped_intervals + self.grouper.pending_groups(pending),
+            'zone_analysis': self.zones.result(),
+            'average_value': self.total / self.samples if self.samples else None,
+            'max_value': self.max_value if self.samples else None,
+            'samples': self.samples,
+            'complete': self.complete,
+        }
+
+def analyze_chunks(chunks, settings):
+    """
+    Analyzes a workout chunk by chunk, with partial results after every chunk.
+
+    Args:
+        chunks (iterable of WorkoutStream): Consecutive pieces of one workout, e.g. from
+                                            `data_parser.iter_workout_chunks` or a live recording.
+        settings (dict): Compiled settings from `main.compile_settings`.
+
+    Yields:
+        dict: Metric -> `OnlineMetricAnalysis.summary()` for every metric seen so far, after each
+              chunk. The last one, yielded once the chunks run out, is complete.
+    """
+    analyses = {}
+    for chunk in chunks:
+        for metric in ANALYZED_METRICS:
+            if chunk.has(metric):
+                if metric not in analyses:
+                    analyses[metric] = OnlineMetricAnalysis(metric, settings)
+                series = chunk.series(metric)
+                analyses[metric].update(series.timestamps, series.values)
+        yield {metric: analysis.summary() for metric, analysis in analyses.items()}
+    yield {metric: analysis.finish() for metric, analysis in analyses.items()}
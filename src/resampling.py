@@ -0,0 +1,224 @@
+import numpy as np
+
+import workout_stream
+
+FILL_RULES = ("hold", "linear", "zero", "none")
+DEFAULT_FILL = {
+    'power': "hold",
+    'heart_rate': "linear",
+    'cadence': "hold",
+    'distance': "linear",
+    'speed': "linear",
+    'temperature': "hold",
+}
+
+# Grid point markers
+SAMPLE = 0  # At least one recorded sample falls in this grid step
+GAP = 1     # No sample, but the surrounding samples are at most `max_gap` apart: filled per metric
+PAUSE = 2   # No sample for longer than `max_gap` (auto-pause, stopped recording): left empty
+
+# A hole longer than this cannot be a pause within one recording: it comes from a corrupt timestamp
+MAX_PAUSE_SECONDS = 86400
+# Largest grid `resample` allocates (about 48 days at 1 s)
+MAX_GRID_POINTS = 1 << 22
+
+def _previous_true(mask):
+    """Index of the last True at or before every position, -1 before the first."""
+    return np.maximum.accumulate(np.where(mask, np.arange(len(mask)), -1))
+
+def _next_true(mask):
+    """Index of the first True at or after every position, len(mask) after the last."""
+    size = len(mask)
+    return np.minimum.accumulate(np.where(mask, np.arange(size), size)[::-1])[::-1]
+
+def _fill(values, present, rule, interval, max_gap):
+    """Fills the missing grid points of one metric whose surrounding values are at most `max_gap` apart."""
+    if rule == "none" or present.all() or not present.any():
+        return values
+    previous, following = _previous_true(present), _next_true(present)
+    missing = np.flatnonzero(~present & (previous >= 0) & (following < len(values)))
+    missing = missing[(following[missing] - previous[missing]) * interval <= max_gap]
+    if not len(missing):
+        return values
+    before, after = previous[missing], following[missing]
+    if rule == "hold":
+        values[missing] = values[before]
+    elif rule == "linear":
+        weights = (missing - before) / (after - before)
+        values[missing] = values[before] + (values[after] - values[before]) * weights
+    else:  # zero
+        values[missing] = 0.0
+    return values
+
+def _usable_samples(timestamps):
+    """
+    Returns the indices of the samples to resample, in time order.
+
+    Samples without a valid time are dropped, and the rest are sorted (stably) if the recording
+    goes back in time. A hole longer than MAX_PAUSE_SECONDS splits the samples, and only the
+    largest part is kept, so a single corrupt timestamp far from the others is dropped instead of
+    stretching the grid.
+    """
+    kept = np.flatnonzero(np.isfinite(timestamps))
+    if np.any(np.diff(timestamps[kept]) < 0):
+        kept = kept[np.argsort(timestamps[kept], kind="stable")]
+    breaks = np.flatnonzero(np.diff(timestamps[kept]) > MAX_PAUSE_SECONDS) + 1
+    if len(breaks):
+        bounds = np.concatenate(([0], breaks, [len(kept)]))
+        largest = int(np.argmax(np.diff(bounds)))
+        kept = kept[bounds[largest]:bounds[largest + 1]]
+    return kept
+
+def resample(stream, interval=1.0, max_gap=10.0, fill=None):
+    """
+    Puts a stream onto a uniform time grid.
+
+    Every sample is assigned to the grid step it falls in and each metric is averaged per step
+    with a weighted `bincount`, so high-rate recordings (4-10 Hz power meters) are decimated to
+    the grid rate in one vectorized pass and sparse ones (smart recording) get one point per
+    step. Steps without a sample are marked GAP when the samples around them are at most
+    `max_gap` seconds apart, and filled per metric according to `fill`; longer holes are marked
+    PAUSE and stay empty, as do a metric's own dropouts longer than `max_gap`.
+
+    Out-of-order samples are sorted first, and samples cut off from the rest by more than
+    MAX_PAUSE_SECONDS (a corrupt timestamp) are dropped.
+
+    Args:
+        stream (WorkoutStream): The parsed stream.
+        interval (float): Grid step in seconds.
+        max_gap (float): Longest hole in seconds that is filled rather than treated as a pause.
+        fill (dict): Metric -> one of FILL_RULES, overriding DEFAULT_FILL:
+                     "hold"   - repeat the last value before the hole;
+                     "linear" - interpolate between the values around the hole;
+                     "zero"   - fill with 0 (e.g. power while coasting);
+                     "none"   - leave the hole empty.
+
+    Returns:
+        WorkoutStream: The resampled stream. Its `markers` attribute holds SAMPLE, GAP or PAUSE
+                       for every grid point and `interval` the grid step.
+
+    Raises:
+        ValueError: If a fill rule is unknown, or the grid would exceed MAX_GRID_POINTS.
+    """
+    rules = dict(DEFAULT_FILL, **(fill or {}))
+    for metric, rule in rules.items():
+        if rule not in FILL_RULES:
+            raise ValueError(f"Unknown fill rule '{rule}' for {metric}. Expected one of {FILL_RULES}.")
+
+    kept = _usable_samples(stream.timestamps)
+    if len(kept) < len(stream) or np.any(np.diff(kept) != 1):
+        stream = workout_stream.WorkoutStream(stream.timestamps[kept],
+                                              **{metric: stream.metrics[metric][kept] for metric in workout_stream.METRICS})
+    timestamps = stream.timestamps
+    if not len(timestamps):
+        resampled = workout_stream.WorkoutStream(timestamps)
+        resampled.markers, resampled.interval = np.zeros(0, dtype=np.int8), interval
+        return resampled
+
+    size = int((timestamps[-1] - timestamps[0]) / interval) + 1
+    if size > MAX_GRID_POINTS:
+        raise ValueError(f"Recording spans {timestamps[-1] - timestamps[0]:.0f} s, more than {MAX_GRID_POINTS} "
+                         f"grid points at {interval:g} s.")
+    steps = ((timestamps - timestamps[0]) / interval).astype(np.int64)
+    grid = timestamps[0] + np.arange(size) * interval
+
+    recorded = np.bincount(steps, minlength=size) > 0
+    markers = np.where(recorded, SAMPLE, GAP).astype(np.int8)
+    if not recorded.all():
+        previous, following = _previous_true(recorded), _next_true(recorded)
+        holes = np.flatnonzero(~recorded)
+        markers[holes[(following[holes] - previous[holes]) * interval > max_gap]] = PAUSE
+
+    metrics = {}
+    for metric in workout_stream.METRICS:
+        mask = stream.masks[metric]
+        if not mask.any():
+            continue
+        counts = np.bincount(steps[mask], minlength=size)
+        sums = np.bincount(steps[mask], weights=stream.metrics[metric][mask], minlength=size)
+        present = counts > 0
+        values = np.full(size, np.nan)
+        np.divide(sums, counts, out=values, where=present)
+        metrics[metric] = _fill(values, present, rules.get(metric, "none"), interval, max_gap)
+
+    resampled = workout_stream.WorkoutStream(grid, **metrics)
+    resampled.markers, resampled.interval = markers, interval
+    return resampled
+
+def recording_stats(stream):
+    """Seconds of filled gaps and of pauses in a resampled stream, for the summary."""
+    interval = stream.interval
+    return {
+        'interval': interval,
+        'gap_seconds': round(float(np.count_nonzero(stream.markers == GAP) * interval), 1),
+        'pause_seconds': round(float(np.count_nonzero(stream.markers == PAUSE) * interval), 1),
+    }
+
+def lttb(timestamps, values, points):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+
+    Keeps the first and last sample and, from each of `points - 2` equal buckets in between,
+    the sample forming the largest triangle with the sample kept from the previous bucket and
+    the average of the next bucket, which preserves peaks and the visual shape of the series.
+
+    Args:
+        timestamps (np.ndarray): Sample times.
+        values (np.ndarray): Sample values, without NaN.
+        points (int): Number of samples to keep.
+
+    Returns:
+        np.ndarray: Indices of the kept samples, ascending.
+    """
+    size = len(values)
+    if points >= size or points < 3:
+        return np.arange(size)
+
+    edges = np.floor(np.arange(points - 1) * (size - 2) / (points - 2)).astype(np.int64) + 1
+    edges[-1] = size - 1
+    # Averages of every bucket (the last "bucket" is the final sample), from prefix sums
+    time_sums = np.concatenate(([0.0], np.cumsum(timestamps)))
+    value_sums = np.concatenate(([0.0], np.cumsum(values)))
+    bounds = np.append(edges, size)
+    lengths = bounds[1:] - bounds[:-1]
+    mean_times = ((time_sums[bounds[1:]] - time_sums[bounds[:-1]]) / lengths).tolist()
+    mean_values = ((value_sums[bounds[1:]] - value_sums[bounds[:-1]]) / lengths).tolist()
+    edges = edges.tolist()
+
+    selected = np.empty(points, dtype=np.int64)
+    selected[0], selected[-1] = 0, size - 1
+    previous_time, previous_value = float(timestamps[0]), float(values[0])
+    for bucket in range(points - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        # Twice the triangle area, expanded so the loop only does scalar-times-slice arithmetic
+        dx = previous_time - mean_times[bucket + 1]
+        dy = mean_values[bucket + 1] - previous_value
+        areas = np.abs(dx * values[start:stop] + dy * timestamps[start:stop] - (dx * previous_value + dy * previous_time))
+        chosen = start + int(areas.argmax())
+        selected[bucket + 1] = chosen
+        previous_time, previous_value = timestamps[chosen], values[chosen]
+    return selected
+
+def preview(stream, metrics=("power", "heart_rate"), points=300):
+    """
+    Builds a compact, shape-preserving preview of a workout for summaries and charts.
+
+    Args:
+        stream (WorkoutStream): The (resampled) stream.
+        metrics (tuple of str): Metrics to include when present.
+        points (int): Maximum number of points per metric.
+
+    Returns:
+        dict: Metric -> list of [seconds since the start, value] pairs picked by `lttb`.
+    """
+    result = {}
+    if not len(stream):
+        return result
+    for metric in metrics:
+        if not stream.has(metric):
+            continue
+        series = stream.series(metric)
+        offsets = series.timestamps - stream.timestamps[0]
+        kept = lttb(offsets, series.values, points)
+        result[metric] = [[round(float(offsets[i]), 1), round(float(series.values[i]), 1)] for i in kept]
+    return result
@@ -0,0 +1,133 @@
+import re
+
+import numpy as np
+
+# Interval durations (seconds) the signature is binned at, doubling from 15 s to about an hour
+DURATION_BINS = np.array([15, 30, 60, 120, 240, 480, 960, 1920, 3840], dtype=np.float64)
+# Zone slots: slot 0 for zones without a number, then zone1 .. zone7 (higher numbers share the last)
+ZONE_SLOTS = 8
+SIGNATURE_LENGTH = ZONE_SLOTS * len(DURATION_BINS)
+SIGNATURE_DTYPE = np.float32
+
+_ZONE_NUMBER = re.compile(r"(\d+)\s*$")
+_STRUCTURE_PART = re.compile(r"(\d+)\s*x\s*(?:(\d+):(\d{1,2})\s*min|(\d+(?:\.\d+)?)\s*(min|sec|s|m))\s+([\w-]+)", re.IGNORECASE)
+
+def zone_slot(zone_names):
+    """Returns the signature slot of the highest numbered zone in `zone_names` (0 if none has a number)."""
+    numbers = [int(match.group(1)) for match in map(_ZONE_NUMBER.search, zone_names) if match]
+    return min(max(numbers), ZONE_SLOTS - 1) if numbers else 0
+
+def structure_signature(parts):
+    """
+    Builds the signature of a workout structure.
+
+    Each interval counts once in its zone's row, split between the two duration bins around
+    its duration in proportion to the distance on a log scale, so 3:50 and 4:10 efforts look
+    alike while 4 min and 8 min efforts do not.
+
+    Args:
+        parts (iterable of tuples): (count, duration in seconds, zone names) per kind of interval.
+
+    Returns:
+        np.ndarray: A SIGNATURE_LENGTH vector.
+    """
+    grid = np.zeros((ZONE_SLOTS, len(DURATION_BINS)), dtype=np.float64)
+    for count, duration, zone_names in parts:
+        position = np.clip(np.log2(max(duration, 1.0) / DURATION_BINS[0]), 0, len(DURATION_BINS) - 1)
+        lower = int(np.floor(position))
+        upper = min(lower + 1, len(DURATION_BINS) - 1)
+        fraction = position - lower
+        slot = zone_slot(zone_names)
+        grid[slot, lower] += count * (1.0 - fraction)
+        grid[slot, upper] += count * fraction
+    return grid.ravel().astype(SIGNATURE_DTYPE)
+
+def summary_signature(summary):
+    """Returns the signature of a summary's grouped intervals, or None if it has none."""
+    parts = [(1, interval['duration'], interval['zones'])
+             for group in summary.get('grouped_intervals') or [] for interval in group['intervals']]
+    return structure_signature(parts) if parts else None
+
+def parse_structure(text):
+    """
+    Parses a structure description into signature parts.
+
+    Accepts the notation of workout titles, e.g. "5x 4:00min zone4, 8x 30sec zone5", as well as
+    shorthand such as "5x4min zone4".
+
+    Returns:
+        list of tuples: (count, duration in seconds, [zone]) per part.
+
+    Raises:
+        ValueError: If no part can be parsed.
+    """
+    parts = []
+    for match in _STRUCTURE_PART.finditer(text):
+        count, minutes, seconds, amount, unit, zone = match.groups()
+        if minutes is not None:
+            duration = int(minutes) * 60 + int(seconds)
+        else:
+            duration = float(amount) * (60 if unit.lower() in ("min", "m") else 1)
+        parts.append((int(count), duration, zone.split("-")))
+    if not parts:
+        raise ValueError(f"Cannot parse workout structure '{text}'. Expected e.g. '5x4min zone4'.")
+    return parts
+
+class SignatureIndex:
+    """
+    In-memory nearest-neighbour index over the signatures stored in the activity store.
+
+    The signatures are read once, as a single matrix with precomputed squared norms; every query
+    is then one matrix-vector product (squared Euclidean distance) and a partial sort, a few
+    milliseconds for tens of thousands of activities.
+    """
+
+    def __init__(self, names, analysis_types, vectors):
+        self.names = list(names)
+        self.analysis_types = np.asarray(analysis_types, dtype=str)
+        self.vectors = np.asarray(vectors, dtype=SIGNATURE_DTYPE).reshape(-1, SIGNATURE_LENGTH)
+        self.norms = np.einsum('ij,ij->i', self.vectors, self.vectors)
+        self.positions = {name: position for position, name in enumerate(self.names)}
+
+    @classmethod
+    def load(cls, conn):
+        """Reads every stored signature from an activity store connection."""
+        rows = conn.execute(
+            "SELECT a.name, a.analysis_type, s.vector FROM signatures s JOIN activities a ON a.id = s.activity_id "
+            "ORDER BY a.id").fetchall()
+        vectors = np.frombuffer(b"".join([row[2] for row in rows]), dtype=SIGNATURE_DTYPE)
+        return cls([row[0] for row in rows], [row[1] for row in rows], vectors)
+
+    def __len__(self):
+        return len(self.names)
+
+    def signature_of(self, name):
+        """Returns the stored signature of activity `name`. Raises KeyError if it has none."""
+        return self.vectors[self.positions[name]]
+
+    def query(self, signature, limit=10, analysis_type=None, exclude=()):
+        """
+        Finds the activities whose interval structure is closest to `signature`.
+
+        Args:
+            signature (np.ndarray): Query signature, e.g. from `structure_signature`.
+            limit (int): Number of results.
+            analysis_type (str): Only activities analyzed with this metric, if given.
+            exclude (iterable of str): Activity names to leave out (e.g. the query activity).
+
+        Returns:
+            list of tuples: (activity name, distance), closest first.
+        """
+        if not len(self.names):
+            return []
+        signature = np.asarray(signature, dtype=SIGNATURE_DTYPE)
+        distances = self.norms - 2.0 * (self.vectors @ signature) + float(signature @ signature)
+        if analysis_type:
+            distances = np.where(self.analysis_types == analysis_type, distances, np.inf)
+        for name in exclude:
+            if name in self.positions:
+                distances[self.positions[name]] = np.inf
+        limit = min(limit, len(distances))
+        nearest = np.argpartition(distances, limit - 1)[:limit]
+        nearest = nearest[np.argsort(distances[nearest], kind="stable")]
+        return [(self.names[i], float(np.sqrt(max(distances[i], 0.0)))) for i in nearest if np.isfinite(distances[i])]
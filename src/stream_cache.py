@@ -0,0 +1,117 @@
+import glob
+import os
+import tempfile
+
+import numpy as np
+
+import data_parser
+import instrumentation
+import manifest
+from workout_stream import METRICS, WorkoutStream
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'cache')
+
+# Bump when the parsers or the on-disk layout change.
+CACHE_VERSION = 4
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+logger = instrumentation.get_logger("stream_cache")
+
+def _cache_name(file_path):
+    # The full file name, so ride.tcx and ride.fit get separate entries
+    return os.path.basename(file_path)
+
+def cache_path(file_path, source_hash, cache_dir=CACHE_DIR):
+    """Returns the cache file for a source file with the given content hash."""
+    return os.path.join(cache_dir, f"{_cache_name(file_path)}-{source_hash[:16]}.v{CACHE_VERSION}.npy")
+
+def save_stream(stream, path):
+    """
+    Saves a WorkoutStream as one (1 + len(METRICS), n) float64 .npy array.
+
+    Row 0 holds the epoch seconds, the other rows the metrics in METRICS order with NaN for
+    missing samples. The file is written atomically.
+    """
+    columns = np.vstack([stream.timestamps] + [stream.metrics[metric] for metric in METRICS])
+    # A unique temporary file, so processes storing entries at the same time never share one
+    descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, 'wb') as f:
+            np.save(f, columns, allow_pickle=False)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+def load_stream(path):
+    """Loads a WorkoutStream saved with `save_stream`."""
+    columns = np.load(path, allow_pickle=False)
+    return WorkoutStream(columns[0], **{metric: columns[i + 1] for i, metric in enumerate(METRICS)})
+
+def evict(cache_dir=CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+    """Deletes least recently used cache files until the cache fits in `max_bytes`."""
+    entries = []
+    with os.scandir(cache_dir) as scanned:
+        for entry in scanned:
+            if entry.is_file() and entry.name.endswith(".npy"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+def get_stream(file_path, source_hash=None, cache_dir=CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Returns the parsed WorkoutStream for a workout file, from the cache when possible.
+
+    The cache is keyed by the source file's content hash, so an edited source never returns stale
+    data; older entries for the same file are removed when the new one is stored. A hit costs a
+    hash of the source plus a single array load, and refreshes the entry for LRU eviction.
+
+    Args:
+        file_path (str): Path to a workout file.
+        source_hash (str): SHA-256 of the file, if already known (e.g. from the manifest).
+        cache_dir (str): Cache directory.
+        max_bytes (int): Size bound enforced after each new entry.
+
+    Returns:
+        WorkoutStream or None: The stream, or None if the file could not be parsed.
+    """
+    try:
+        source_hash = source_hash or manifest.hash_file(file_path)
+    except FileNotFoundError:
+        logger.error(f"Workout file not found at {file_path}")
+        return None
+    path = cache_path(file_path, source_hash, cache_dir)
+
+    try:
+        stream = load_stream(path)
+        os.utime(path)
+        instrumentation.count('cache_hits')
+        return stream
+    except (FileNotFoundError, ValueError, OSError):
+        pass
+
+    instrumentation.count('cache_misses')
+    stream = data_parser.parse_workout_stream(file_path)
+    if stream is None:
+        return None
+
+    os.makedirs(cache_dir, exist_ok=True)
+    pattern = f"{glob.escape(_cache_name(file_path))}-{'[0-9a-f]' * 16}.v*.npy"
+    for old_path in glob.glob(os.path.join(glob.escape(cache_dir), pattern)):
+        if old_path != path:
+            try:
+                os.remove(old_path)  # The source changed: drop its previous entry
+            except FileNotFoundError:
+                pass  # Already removed by another process
+    save_stream(stream, path)
+    evict(cache_dir, max_bytes)
+    return stream
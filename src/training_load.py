@@ -0,0 +1,191 @@
+from datetime import date, timedelta
+
+import numpy as np
+
+import mean_max
+import workout_stream
+
+# Time constants (days) of the fitness (CTL) and fatigue (ATL) exponentially weighted averages
+CTL_DAYS = 42
+ATL_DAYS = 7
+NP_WINDOW_SECONDS = 30
+# Lactate threshold heart rate assumed when only a maximum heart rate is configured
+LTHR_FRACTION_OF_MAX_HR = 0.9
+
+def thresholds(config):
+    """
+    Resolves the FTP and lactate threshold heart rate used for training load.
+
+    Values in the `training_load` section win; otherwise the `ftp` of `power_zones` and the
+    `lthr` (or a fraction of `max_hr`) of `heart_rate_zones` are used, as for zone analysis.
+
+    Returns:
+        dict: 'ftp' and 'lthr', each None when not configured.
+    """
+    load_config = config.get('training_load', {}) or {}
+    power_zones = config.get('power_zones', {}) or {}
+    heart_rate_zones = config.get('heart_rate_zones', {}) or {}
+    lthr = load_config.get('lthr') or heart_rate_zones.get('lthr')
+    if not lthr and heart_rate_zones.get('max_hr'):
+        lthr = heart_rate_zones['max_hr'] * LTHR_FRACTION_OF_MAX_HR
+    return {'ftp': load_config.get('ftp') or power_zones.get('ftp'), 'lthr': lthr}
+
+def normalized_power(data, max_gap=10):
+    """
+    Computes normalized power: the fourth-power mean of the 30 s rolling average power.
+
+    Power is put on a 1 s grid first (see `mean_max.to_one_second_grid`); seconds inside
+    recording gaps are left out of both the rolling averages and the mean. As in the usual
+    definition, the rolling average only starts once its window is full, at 30 s into the
+    ride; a ride shorter than that has its average power as NP.
+
+    Args:
+        data (WorkoutStream, MetricSeries or list of tuples): Power samples.
+        max_gap (float): Longest gap in seconds bridged by holding the last value.
+
+    Returns:
+        tuple: (normalized power, seconds with data), or (None, 0) without samples.
+    """
+    timestamps, values = workout_stream.as_arrays(data, "power")
+    held = mean_max.to_one_second_grid(timestamps, values, max_gap)
+    valid = ~np.isnan(held)
+    seconds = int(np.count_nonzero(valid))
+    if not seconds:
+        return None, 0
+    if len(held) < NP_WINDOW_SECONDS:
+        return float(np.mean(held[valid])), seconds
+    sums = np.concatenate(([0.0], np.cumsum(np.where(valid, held, 0.0))))
+    counts = np.concatenate(([0], np.cumsum(valid)))
+    ends = np.arange(NP_WINDOW_SECONDS, len(held) + 1)  # Exclusive ends of the full windows
+    ends = ends[valid[ends - 1]]  # Windows ending inside a gap are left out
+    starts = ends - NP_WINDOW_SECONDS
+    rolling = (sums[ends] - sums[starts]) / (counts[ends] - counts[starts])
+    return float(np.mean(rolling ** 4) ** 0.25), seconds
+
+def workout_load(stream, load_thresholds, max_gap=10):
+    """
+    Computes the training stress of one workout.
+
+    With power and an FTP: normalized power (NP), intensity factor IF = NP / FTP and
+    TSS = hours * IF^2 * 100. Otherwise, with heart rate and a threshold heart rate, hrTSS
+    uses the same formula with IF the root mean square of heart rate / LTHR, so an hour at
+    threshold scores 100 either way.
+
+    Args:
+        stream (WorkoutStream): The workout.
+        load_thresholds (dict): 'ftp' and 'lthr' from `thresholds`.
+        max_gap (float): Longest gap in seconds counted as riding time.
+
+    Returns:
+        dict or None: 'basis' ("power" or "heart_rate"), 'threshold', 'seconds',
+                      'intensity_factor', 'tss' and, for power, 'normalized_power'. None
+                      when neither metric has a configured threshold.
+    """
+    ftp, lthr = load_thresholds.get('ftp'), load_thresholds.get('lthr')
+    if ftp and stream.has('power'):
+        np_value, seconds = normalized_power(stream, max_gap)
+        intensity_factor = np_value / ftp
+        return {
+            'basis': "power",
+            'threshold': ftp,
+            'seconds': seconds,
+            'normalized_power': round(np_value, 1),
+            'intensity_factor': round(intensity_factor, 3),
+            'tss': round(seconds / 3600.0 * intensity_factor ** 2 * 100.0, 1),
+        }
+    if lthr and stream.has('heart_rate'):
+        timestamps, values = workout_stream.as_arrays(stream, "heart_rate")
+        held = mean_max.to_one_second_grid(timestamps, values, max_gap)
+        held = held[~np.isnan(held)]
+        intensity_factor = float(np.sqrt(np.mean((held / lthr) ** 2)))
+        return {
+            'basis': "heart_rate",
+            'threshold': lthr,
+            'seconds': len(held),
+            'intensity_factor': round(intensity_factor, 3),
+            'tss': round(len(held) / 3600.0 * intensity_factor ** 2 * 100.0, 1),
+        }
+    return None
+
+def _decay(days, time_constant):
+    """Factor an exponentially weighted average keeps after `days` days without load."""
+    return (1.0 - 1.0 / time_constant) ** days
+
+def _advance(ctl, atl, days, tss):
+    """CTL and ATL `days` days later, with `tss` on the last of those days."""
+    ctl = ctl * _decay(days, CTL_DAYS) + tss / CTL_DAYS
+    atl = atl * _decay(days, ATL_DAYS) + tss / ATL_DAYS
+    return ctl, atl
+
+def _days_between(first, second):
+    return (date.fromisoformat(second) - date.fromisoformat(first)).days
+
+def apply_daily_tss(conn, changes):
+    """
+    Adds TSS to days of the persistent daily load series and brings CTL/ATL up to date.
+
+    Only days with load are stored (in `daily_load`); rest days in between are covered by
+    decaying the previous row, so appending a workout on or after the last stored day touches
+    one row. A change to an earlier day recomputes the rows from that day forward only.
+
+    Args:
+        conn (sqlite3.Connection): Activity store connection, inside a transaction.
+        changes (dict): Day ('YYYY-MM-DD') -> TSS to add (negative to take a workout out).
+
+    Returns:
+        int: Number of stored days recomputed.
+    """
+    changes = {day: delta for day, delta in changes.items() if delta}
+    if not changes:
+        return 0
+    conn.executemany(
+        "INSERT INTO daily_load (day, tss, ctl, atl) VALUES (?, ?, 0, 0) "
+        "ON CONFLICT (day) DO UPDATE SET tss = tss + excluded.tss", list(changes.items()))
+    conn.execute("DELETE FROM daily_load WHERE ABS(tss) < 1e-6")
+
+    first = min(changes)
+    previous = conn.execute("SELECT day, ctl, atl FROM daily_load WHERE day < ? ORDER BY day DESC LIMIT 1",
+                            (first,)).fetchone()
+    previous_day, ctl, atl = previous if previous else (None, 0.0, 0.0)
+    updates = []
+    for day, tss in conn.execute("SELECT day, tss FROM daily_load WHERE day >= ? ORDER BY day", (first,)).fetchall():
+        ctl, atl = _advance(ctl, atl, _days_between(previous_day, day) if previous_day else 1, tss)
+        updates.append((ctl, atl, day))
+        previous_day = day
+    conn.executemany("UPDATE daily_load SET ctl = ?, atl = ? WHERE day = ?", updates)
+    return len(updates)
+
+def load_series(conn, start=None, end=None):
+    """
+    Returns the daily CTL, ATL and TSB from `start` to `end` (inclusive), rest days included.
+
+    TSB (form) for a day is the previous day's CTL minus its ATL.
+
+    Args:
+        conn (sqlite3.Connection): Activity store connection.
+        start, end (str): Days as 'YYYY-MM-DD'. Default to the first and last stored day.
+
+    Returns:
+        list of tuples: (day, tss, ctl, atl, tsb), rounded to one decimal.
+    """
+    bounds = conn.execute("SELECT MIN(day), MAX(day) FROM daily_load").fetchone()
+    if bounds[0] is None:
+        return []
+    start, end = start or bounds[0], end or bounds[1]
+    day = date.fromisoformat(start) - timedelta(days=1)
+    previous = conn.execute("SELECT day, ctl, atl FROM daily_load WHERE day <= ? ORDER BY day DESC LIMIT 1",
+                            (day.isoformat(),)).fetchone()
+    if previous:
+        ctl, atl = _advance(previous[1], previous[2], _days_between(previous[0], day.isoformat()), 0.0)
+    else:
+        ctl, atl = 0.0, 0.0
+    loads = dict(conn.execute("SELECT day, tss FROM daily_load WHERE day >= ? AND day <= ?", (start, end)).fetchall())
+
+    series = []
+    for offset in range(_days_between(start, end) + 1):
+        day = (date.fromisoformat(start) + timedelta(days=offset)).isoformat()
+        tsb = ctl - atl
+        tss = loads.get(day, 0.0)
+        ctl, atl = _advance(ctl, atl, 1, tss)
+        series.append((day, round(tss, 1), round(ctl, 1), round(atl, 1), round(tsb, 1)))
+    return series
@@ -1,31 +1,288 @@
-import numpy as np
-
-def smooth_data(data, window_size):
-    """
-    Applies a simple moving average smoothing to a time series.
-
-    Args:
-        data (list of tuples): A list of (timestamp, value) pairs.
-        window_size (int): The size of the moving average window.
-
-    Returns:
-        list of tuples: A new list with smoothed values. The first
-                       `window_size - 1` values will be the same as the
-                       original data.
-    """
-    if len(data) < window_size:
-        return data  # Cannot smooth if data is shorter than the window
-
-    smoothed_data = []
-    values = np.array([item[1] for item in data])
-    timestamps = [item[0] for item in data]
-
-    for i in range(len(values)):
-        if i < window_size - 1:
-            smoothed_data.append((timestamps[i], values[i]))
-        else:
-            window = values[i - window_size + 1 : i + 1]
-            average = np.mean(window)
-            smoothed_data.append((timestamps[i], average))
-
-    return smoothed_data
+import numpy as np
+import workout_stream
+
+SMOOTHING_METHODS = ("sample", "time", "centered", "exponential")
+
+# Largest exponent allowed inside one exponential-smoothing block (exp(50) ~ 5e21).
+_EMA_BLOCK_EXPONENT = 50.0
+
+def moving_average(values, window_size):
+    """
+    Trailing moving average over a fixed number of samples, in O(n).
+
+    Args:
+        values (np.ndarray): Sample values.
+        window_size (int): Number of samples in the window.
+
+    Returns:
+        np.ndarray: Smoothed values. The first `window_size - 1` values are
+                    left unchanged.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    smoothed = values.copy()
+    if window_size <= 1 or len(values) < window_size:
+        return smoothed
+    cumulative = np.concatenate(([0.0], np.cumsum(values)))
+    smoothed[window_size - 1:] = (cumulative[window_size:] - cumulative[:-window_size]) / window_size
+    return smoothed
+
+def time_moving_average(timestamps, values, window_seconds, centered=False):
+    """
+    Moving average over a window measured in seconds rather than samples.
+
+    Only samples whose timestamps actually fall inside the window are averaged,
+    so irregular (smart-recording) sampling and dropouts are handled correctly:
+    after a gap the window simply holds fewer samples.
+
+    Args:
+        timestamps (np.ndarray): Sample times in seconds, ascending.
+        values (np.ndarray): Sample values.
+        window_seconds (float): Window length in seconds.
+        centered (bool): If True the window is [t - w/2, t + w/2), otherwise
+                         the trailing window (t - w, t].
+
+    Returns:
+        np.ndarray: Smoothed values.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return values.copy()
+    cumulative = np.concatenate(([0.0], np.cumsum(values)))
+    if centered:
+        half_window = window_seconds / 2.0
+        starts = np.searchsorted(timestamps, timestamps - half_window, side='left')
+        ends = np.searchsorted(timestamps, timestamps + half_window, side='left')
+        ends = np.maximum(ends, np.arange(1, len(values) + 1))  # Always include the sample itself
+    else:
+        starts = np.searchsorted(timestamps, timestamps - window_seconds, side='right')
+        ends = np.arange(1, len(values) + 1)
+    return (cumulative[ends] - cumulative[starts]) / (ends - starts)
+
+def exponential_moving_average(timestamps, values, time_constant):
+    """
+    Time-aware exponential moving average.
+
+    Each sample decays the previous average by exp(-dt / time_constant), so a
+    gap in the recording lets the average relax instead of being counted as
+    a single step. The recurrence is solved in closed form with cumulative
+    sums, restarted in blocks to keep the exponentials finite.
+
+    Args:
+        timestamps (np.ndarray): Sample times in seconds, ascending.
+        values (np.ndarray): Sample values.
+        time_constant (float): Decay time constant in seconds.
+
+    Returns:
+        np.ndarray: Smoothed values.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    smoothed = np.empty_like(values)
+    if not len(values):
+        return smoothed
+
+    scaled_time = (timestamps - timestamps[0]) / float(time_constant)
+    gains = -np.expm1(-np.diff(scaled_time, prepend=scaled_time[0]))  # 1 - exp(-dt / tau)
+    gains[0] = 1.0  # The first sample starts the average
+
+    block_edges = np.searchsorted(scaled_time, np.arange(0.0, scaled_time[-1] + _EMA_BLOCK_EXPONENT, _EMA_BLOCK_EXPONENT), side='left')
+    block_edges = np.unique(np.append(block_edges, len(values)))
+
+    carry = 0.0
+    for start, end in zip(block_edges[:-1], block_edges[1:]):
+        exponent = scaled_time[start:end] - scaled_time[start]
+        growth = np.exp(exponent)
+        weighted = gains[start:end] * values[start:end] * growth
+        weighted[0] += (1.0 - gains[start]) * carry
+        smoothed[start:end] = np.cumsum(weighted) / growth
+        carry = smoothed[end - 1]
+    return smoothed
+
+def smooth_data(data, window_size, method="sample"):
+    """
+    Smooths a time series.
+
+    Args:
+        data (MetricSeries or list of tuples): A MetricSeries, or a list of
+                                               (timestamp, value) pairs.
+        window_size (float): The window size. A number of samples for the
+                             "sample" method, seconds for the others.
+        method (str): One of:
+                      "sample"      - trailing average over `window_size` samples;
+                                      the first `window_size - 1` values are kept as is.
+                      "time"        - trailing average over `window_size` seconds.
+                      "centered"    - centred average over `window_size` seconds.
+                      "exponential" - exponential average with a `window_size`
+                                      second time constant.
+
+    Returns:
+        MetricSeries or list of tuples: Smoothed values in the same form as the input.
+    """
+    if method not in SMOOTHING_METHODS:
+        raise ValueError(f"Unknown smoothing method '{method}'. Expected one of {SMOOTHING_METHODS}.")
+
+    if method == "sample" and len(data) < window_size:
+        return data  # Cannot smooth if data is shorter than the window
+
+    series = workout_stream.as_series(data)
+    if method == "sample":
+        smoothed_values = moving_average(series.values, int(window_size))
+    elif method == "exponential":
+        smoothed_values = exponential_moving_average(series.timestamps, series.values, window_size)
+    else:
+        smoothed_values = time_moving_average(series.timestamps, series.values, window_size,
+                                              centered=(method == "centered"))
+
+    if isinstance(data, list):
+        return [(item[0], value) for item, value in zip(data, smoothed_values)]
+    return series.with_values(smoothed_values)
+
+class OnlineSmoother:
+    """
+    Chunked counterpart of `smooth_data`, for recordings too long to hold or still in progress.
+
+    Samples are fed in time order, in chunks of any size, and the smoothed values are the ones
+    `smooth_data` computes over the whole series: running sums continue across chunks exactly
+    as `np.cumsum` would, and the exponential average keeps the same blocks. Between chunks
+    only what a window still needs is kept: the last `window_size` running sums ("sample"), the
+    samples of the last `window_size` seconds ("time", "centered"), or the current average and
+    block sum ("exponential"). A "centered" value also needs the following half window, so
+    those samples are returned by a later `update` or by `finish`.
+    """
+
+    def __init__(self, window_size, method="sample"):
+        if method not in SMOOTHING_METHODS:
+            raise ValueError(f"Unknown smoothing method '{method}'. Expected one of {SMOOTHING_METHODS}.")
+        self.window_size = window_size
+        self.method = method
+        self.total = 0.0                              # Sum of every value so far
+        self.sums = np.zeros(1)                       # "sample": the last running sums, ending with `total`
+        self.tail_timestamps = np.zeros(0)            # "time"/"centered": samples still inside a window
+        self.tail_sums = np.zeros(0)                  # Running sum before each of those samples
+        self.pending = 0                              # "centered": trailing tail samples not returned yet
+        self.origin = None                            # "exponential": first timestamp
+        self.previous_scaled = None
+        self.block_origin = 0.0
+        self.block_sum = 0.0
+        self.value = 0.0
+
+    def update(self, timestamps, values):
+        """
+        Smooths the next chunk of samples.
+
+        Args:
+            timestamps (np.ndarray): Sample times in seconds, ascending and after the previous chunk.
+            values (np.ndarray): Sample values.
+
+        Returns:
+            tuple: (timestamps, smoothed values) of the samples whose smoothed value is now final.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return timestamps, values.copy()
+        if self.method == "sample":
+            return timestamps, self._update_sample(values)
+        if self.method == "exponential":
+            return timestamps, self._update_exponential(timestamps, values)
+        return self._update_window(timestamps, values)
+
+    def finish(self):
+        """Returns (timestamps, smoothed values) of the samples still held back ("centered" only)."""
+        if not self.pending:
+            return np.zeros(0), np.zeros(0)
+        timestamps, smoothed = self._centered(len(self.tail_timestamps) - self.pending, len(self.tail_timestamps))
+        self.pending = 0
+        return timestamps, smoothed
+
+    def _update_sample(self, values):
+        window_size = int(self.window_size)
+        smoothed = values.copy()
+        sums = np.cumsum(np.concatenate((self.sums[-1:], values)))
+        self.total = sums[-1]
+        if window_size <= 1:
+            self.sums = sums[-1:]
+            return smoothed
+        # Running sums from `window_size` samples before the chunk on, so sample k's window
+        # starts at sums[k + offset + 1 - window_size]
+        history = np.concatenate((self.sums[:-1], sums))
+        offset = len(self.sums) - 1
+        positions = np.arange(len(values)) + offset + 1 - window_size
+        full = positions >= 0  # The first `window_size - 1` samples of the series are kept as is
+        smoothed[full] = (sums[1:][full] - history[positions[full]]) / window_size
+        self.sums = history[-window_size:]
+        return smoothed
+
+    def _update_window(self, timestamps, values):
+        sums = np.cumsum(np.concatenate(([self.total], values)))
+        self.total = sums[-1]
+        all_timestamps = np.concatenate((self.tail_timestamps, timestamps))
+        all_sums = np.concatenate((self.tail_sums, sums[:-1]))
+        kept = len(self.tail_timestamps)
+
+        if self.method == "time":
+            starts = np.searchsorted(all_timestamps, timestamps - self.window_size, side='right')
+            smoothed = (sums[1:] - all_sums[starts]) / (np.arange(kept + 1, kept + len(values) + 1) - starts)
+            keep_from = np.searchsorted(all_timestamps, all_timestamps[-1] - self.window_size, side='right')
+            self.tail_timestamps, self.tail_sums = all_timestamps[keep_from:], all_sums[keep_from:]
+            return timestamps, smoothed
+
+        self.tail_timestamps, self.tail_sums = all_timestamps, all_sums
+        self.pending += len(values)
+        first = len(all_timestamps) - self.pending
+        # A centred value is final once a sample at or past the end of its window has arrived
+        ready = int(np.count_nonzero(all_timestamps[first:] + self.window_size / 2.0 <= all_timestamps[-1]))
+        result = self._centered(first, first + ready)
+        self.pending -= ready
+        # Later windows start at or after the earliest one still to come
+        earliest = all_timestamps[first + ready] if self.pending else all_timestamps[-1]
+        keep_from = np.searchsorted(all_timestamps, earliest - self.window_size / 2.0, side='left')
+        self.tail_timestamps, self.tail_sums = all_timestamps[keep_from:], all_sums[keep_from:]
+        return result
+
+    def _centered(self, first, last):
+        """Centred averages of tail samples first..last-1, whose windows lie inside the tail."""
+        timestamps = self.tail_timestamps
+        sums = np.append(self.tail_sums, self.total)
+        half_window = self.window_size / 2.0
+        selected = timestamps[first:last]
+        starts = np.searchsorted(timestamps, selected - half_window, side='left')
+        ends = np.searchsorted(timestamps, selected + half_window, side='left')
+        ends = np.maximum(ends, np.arange(first + 1, last + 1))  # Always include the sample itself
+        return selected, (sums[ends] - sums[starts]) / (ends - starts)
+
+    def _update_exponential(self, timestamps, values):
+        time_constant = float(self.window_size)
+        first_chunk = self.origin is None
+        if first_chunk:
+            self.origin = timestamps[0]
+        scaled_time = (timestamps - self.origin) / time_constant
+        previous = scaled_time[0] if first_chunk else self.previous_scaled
+        gains = -np.expm1(-np.diff(scaled_time, prepend=previous))
+        # A block starts at the first sample at or past each multiple of the block exponent,
+        # as in `exponential_moving_average`
+        before = np.concatenate(([previous], scaled_time[:-1]))
+        edges = np.floor(before / _EMA_BLOCK_EXPONENT) * _EMA_BLOCK_EXPONENT
+        edges = np.where(edges > before, edges, edges + _EMA_BLOCK_EXPONENT)
+        block_starts = edges <= scaled_time
+        if first_chunk:
+            gains[0] = 1.0  # The first sample starts the average
+            block_starts[0] = True
+
+        smoothed = np.empty_like(values)
+        bounds = np.unique(np.concatenate(([0], np.flatnonzero(block_starts), [len(values)])))
+        for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            if block_starts[start]:
+                self.block_origin = scaled_time[start]
+            growth = np.exp(scaled_time[start:end] - self.block_origin)
+            weighted = gains[start:end] * values[start:end] * growth
+            if block_starts[start]:
+                weighted[0] += (1.0 - gains[start]) * self.value
+                running = np.cumsum(weighted)
+            else:
+                running = np.cumsum(np.concatenate(([self.block_sum], weighted)))[1:]
+            smoothed[start:end] = running / growth
+            self.block_sum, self.value = running[-1], smoothed[end - 1]
+        self.previous_scaled = scaled_time[-1]
+        return smoothed
@@ -0,0 +1,282 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import instrumentation
+import main
+import manifest
+
+logger = instrumentation.get_logger("watcher")
+
+# inotify event bits (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+_EVENT_HEADER = struct.Struct("iIII")
+
+# Files still being downloaded or written under a temporary name are never analyzed.
+IGNORED_SUFFIXES = (".tmp", ".part", ".partial", ".crdownload", ".swp")
+
+# Delay after a file is closed or renamed into place, so bursts of events coalesce.
+COALESCE_SECONDS = 0.05
+
+class InotifySource:
+    """Kernel change notifications for one directory. Costs nothing while the directory is idle."""
+
+    def __init__(self, directory):
+        libc_name = ctypes.util.find_library("c")
+        if not libc_name:
+            raise OSError("libc not found")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"Cannot watch {directory}")
+
+    def fileno(self):
+        return self.fd
+
+    def read(self):
+        """
+        Returns the pending events as a list of (file name, closed) pairs, where `closed` means the
+        writer is done (closed or renamed into place) and None for deletions, or None if the
+        kernel queue overflowed and the directory has to be rescanned.
+        """
+        events = []
+        while True:
+            try:
+                buffer = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(buffer):
+                _, mask, _, length = _EVENT_HEADER.unpack_from(buffer, offset)
+                offset += _EVENT_HEADER.size
+                name = buffer[offset:offset + length].rstrip(b"\0").decode(errors="surrogateescape")
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    return None
+                if not name:
+                    continue
+                if mask & (IN_DELETE | IN_MOVED_FROM):
+                    events.append((name, None))
+                else:
+                    events.append((name, bool(mask & (IN_CLOSE_WRITE | IN_MOVED_TO))))
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingSource:
+    """Fallback for platforms without inotify: compares size and mtime on every scan."""
+
+    def __init__(self, directory, interval):
+        self.directory = directory
+        self.interval = interval
+        self.signatures = _scan(directory)
+
+    def read(self):
+        """Returns the changed files as (file name, closed) pairs; a poll cannot tell if a file is closed."""
+        signatures = _scan(self.directory)
+        events = [(name, False) for name, signature in signatures.items() if self.signatures.get(name) != signature]
+        events.extend((name, None) for name in self.signatures if name not in signatures)
+        self.signatures = signatures
+        return events
+
+    def close(self):
+        pass
+
+def _scan(directory):
+    """Returns file name -> (size, mtime_ns) for every regular file in `directory`."""
+    signatures = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file():
+                stat = entry.stat()
+                signatures[entry.name] = (stat.st_size, stat.st_mtime_ns)
+    return signatures
+
+def _ignored(name):
+    return name.startswith(".") or name.lower().endswith(IGNORED_SUFFIXES)
+
+class Watcher:
+    """
+    Analyzes workout files as they appear or change in a directory.
+
+    Files are handed to a warm process pool once they have settled: straight away when the writer
+    closes them or renames them into place, otherwise after `settle_seconds` without changes.
+    At most `queue_size` files are queued or running; beyond that the watcher stops taking new
+    work until a worker finishes (events wait in the kernel queue meanwhile). Results go into
+    the manifest, the activity store and the best-curve history exactly as in a batch run.
+    """
+
+    def __init__(self, directory=main.RAW_DATA_DIR, config=None, settings=None, workers=None,
+                 settle_seconds=None, poll_interval=None, queue_size=None, use_inotify=True):
+        self.directory = directory
+        self.config = config if config is not None else main.load_config()
+        self.settings = settings or main.compile_settings(self.config)
+        watch_config = self.config.get('watch', {}) or {}
+        self.workers = max(1, int(workers or self.settings['batch_config'].get('workers') or os.cpu_count() or 1))
+        self.settle_seconds = settle_seconds if settle_seconds is not None else watch_config.get('settle_seconds', 1.0)
+        poll_interval = poll_interval if poll_interval is not None else watch_config.get('poll_interval', 1.0)
+        self.queue_size = queue_size or watch_config.get('queue_size') or 2 * self.workers
+
+        self.source = None
+        if use_inotify:
+            try:
+                self.source = InotifySource(directory)
+            except (OSError, AttributeError) as e:
+                logger.warning(f"inotify unavailable ({e}); polling every {poll_interval} s instead.")
+        if self.source is None:
+            self.source = PollingSource(directory, poll_interval)
+
+        self.manifest = manifest.load_manifest(main.PROCESSED_DATA_DIR)
+        self.pending = {}    # file name -> deadline (monotonic seconds)
+        self.in_flight = {}  # future -> (file name, fingerprint)
+        self.failed = {}     # file name -> SHA-256 of the version that failed
+        self.deferred = set()  # Files that changed again while being analyzed
+        self.reports = []
+        self.running = False
+        self._wake_read, self._wake_write = os.pipe()
+        os.set_blocking(self._wake_read, False)
+        os.set_blocking(self._wake_write, False)
+
+    def _wake(self, *args):
+        try:
+            os.write(self._wake_write, b"\0")
+        except OSError:
+            pass  # A wake-up is already pending, or the watcher has shut down
+
+    def stop(self):
+        """Asks a running watcher to finish its queued work and return. Safe to call from a signal handler."""
+        self.running = False
+        self._wake()
+
+    def _schedule(self, name, delay):
+        if not _ignored(name):
+            self.pending[name] = time.monotonic() + delay
+
+    def _handle_events(self, events):
+        if events is None:
+            logger.warning("Event queue overflowed; rescanning the directory.")
+            self.catch_up()
+            return
+        for name, closed in events:
+            if closed is None:
+                self.pending.pop(name, None)
+            else:
+                self._schedule(name, COALESCE_SECONDS if closed else self.settle_seconds)
+
+    def catch_up(self):
+        """Queues every file that is new or changed since it was last analyzed (as a batch run would)."""
+        for name in _scan(self.directory):
+            self._schedule(name, 0.0)
+
+    def _timeout(self):
+        """Seconds until the next pending file is due, or None to sleep until an event arrives."""
+        timeouts = []
+        if self.pending:
+            timeouts.append(max(0.0, min(self.pending.values()) - time.monotonic()))
+        if isinstance(self.source, PollingSource):
+            timeouts.append(self.source.interval)
+        return min(timeouts) if timeouts else None
+
+    def _submit_due(self, executor):
+        now = time.monotonic()
+        busy = {name for name, _ in self.in_flight.values()}
+        for name in sorted(name for name, deadline in self.pending.items() if deadline <= now):
+            del self.pending[name]
+            if name in busy:
+                self.deferred.add(name)  # Looked at again once the running analysis finishes
+                continue
+            file_path = os.path.join(self.directory, name)
+            try:
+                stale, fingerprints = manifest.find_stale([file_path], self.manifest, self.config,
+                                                          main.PROCESSED_DATA_DIR, prune=False)
+            except FileNotFoundError:
+                continue
+            fingerprint = fingerprints[name]
+            if not stale or self.failed.get(name) == fingerprint['sha256']:
+                continue
+
+            while len(self.in_flight) >= self.queue_size:
+                done, _ = wait(self.in_flight, return_when=FIRST_COMPLETED)
+                self._collect(done)
+            future = executor.submit(main._analyze_file_timed, (file_path, fingerprint['sha256']))
+            self.in_flight[future] = (name, fingerprint)
+            future.add_done_callback(self._wake)
+
+    def _collect(self, done):
+        reports, fingerprints = [], {}
+        for future in done:
+            name, fingerprint = self.in_flight.pop(future)
+            try:
+                report = future.result()
+            except Exception as e:  # A crashed worker only loses its own file
+                report = {'file': name, 'status': "failed", 'error': f"{type(e).__name__}: {e}",
+                          'analysis_type': "none", 'summary': None, 'seconds': 0.0, 'metrics': None}
+            if report['status'] == "failed":
+                self.failed[name] = fingerprint['sha256']
+                logger.error(f"{name}: failed ({report['error']})")
+            else:
+                self.failed.pop(name, None)
+                logger.info(f"{name}: {report['status']} in {report['seconds'] * 1000:.0f} ms")
+            reports.append(report)
+            fingerprints[name] = fingerprint
+            if name in self.deferred:
+                self.deferred.discard(name)
+                self._schedule(name, 0.0)
+        if not reports:
+            return
+        main.record_reports(reports, self.config, self.manifest, fingerprints)
+        manifest.save_manifest(self.manifest, main.PROCESSED_DATA_DIR)
+        logging_config = self.settings.get('logging_config', {})
+        if logging_config.get('instrumentation'):
+            main.emit_instrumentation(reports, sum(report['seconds'] for report in reports),
+                                      logging_config.get('report_file'))
+        self.reports.extend(reports)
+
+    def run(self):
+        """Watches until `stop` is called (or Ctrl-C), then waits for the files already queued."""
+        self.running = True
+        self.catch_up()
+        logger.info(f"Watching {os.path.abspath(self.directory)} with {self.workers} workers.")
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=main._init_worker,
+                                 initargs=(self.settings,)) as executor:
+            try:
+                while self.running:
+                    readable, _, _ = select.select([self._wake_read] + ([self.source] if hasattr(self.source, 'fileno') else []),
+                                                   [], [], self._timeout())
+                    if self._wake_read in readable:
+                        try:
+                            os.read(self._wake_read, 4096)
+                        except BlockingIOError:
+                            pass
+                    if self.source in readable or isinstance(self.source, PollingSource):
+                        self._handle_events(self.source.read())
+                    self._collect([future for future in self.in_flight if future.done()])
+                    self._submit_due(executor)
+            except KeyboardInterrupt:
+                logger.info("Stopping; waiting for queued files.")
+            finally:
+                self._collect(wait(self.in_flight).done)
+                self.source.close()
+                os.close(self._wake_read)
+                os.close(self._wake_write)
+        return self.reports
@@ -0,0 +1,258 @@
+import argparse
+import os
+import struct
+from datetime import datetime, timezone
+
+import numpy as np
+import utils
+
+DEFAULT_START = datetime(2024, 1, 1, 8, 0, tzinfo=timezone.utc).timestamp()
+
+# (repeats, work seconds, rest seconds, work watts)
+DEFAULT_INTERVALS = [(5, 240, 180, 340), (8, 30, 30, 450)]
+
+def generate_workout(duration=3600, sample_rate=1.0, intervals=DEFAULT_INTERVALS, base_power=180,
+                     dropouts=0, missing_power=0.0, missing_heart_rate=0.0, seed=0, start=DEFAULT_START):
+    """
+    Generates a deterministic synthetic workout.
+
+    Power is an endurance baseline with the given interval blocks spread evenly over the ride.
+    Heart rate follows power with a lag, and cadence and distance are derived from it.
+
+    Args:
+        duration (float): Length in seconds (e.g. 1800 to 86400).
+        sample_rate (float): Samples per second (1 for typical head units, 4-10 for power meters).
+        intervals (list of tuples): Interval blocks as (repeats, work s, rest s, work watts).
+        base_power (float): Endurance power in watts.
+        dropouts (int): Number of recording gaps (5-60 s each) to cut out.
+        missing_power (float): Fraction of samples without power; 1.0 drops the channel.
+        missing_heart_rate (float): Fraction of samples without heart rate; 1.0 drops the channel.
+        seed (int): Random seed, so the same arguments always give the same workout.
+        start (float): Start time as epoch seconds.
+
+    Returns:
+        dict: NumPy arrays 'timestamps' (epoch seconds), 'power', 'heart_rate', 'cadence' and
+              'distance', with NaN for missing values.
+    """
+    rng = np.random.default_rng(seed)
+    offsets = np.arange(0.0, duration, 1.0 / sample_rate)
+
+    target = np.full(len(offsets), float(base_power))
+    total_block = sum(repeats * (work + rest) for repeats, work, rest, _ in intervals)
+    spacing = max(0.0, (duration - total_block) / (len(intervals) + 1))
+    block_start = spacing
+    for repeats, work, rest, watts in intervals:
+        for repeat in range(repeats):
+            effort_start = block_start + repeat * (work + rest)
+            target[(offsets >= effort_start) & (offsets < effort_start + work)] = watts
+        block_start += repeats * (work + rest) + spacing
+
+    power = np.clip(target + rng.normal(0, 0.08, len(offsets)) * target, 0, None).round()
+    # Heart rate lags power: a first order response towards the steady state for the target power
+    heart_rate = utils.exponential_moving_average(offsets, 60.0 + 0.33 * target, 30.0)
+    heart_rate = (heart_rate + rng.normal(0, 1.0, len(offsets))).round()
+    cadence = np.clip(85 + rng.normal(0, 3, len(offsets)) + (target - base_power) / 20, 0, None).round()
+    speed = 4.0 + power / 60.0
+    distance = np.cumsum(speed / sample_rate)
+
+    keep = np.ones(len(offsets), dtype=bool)
+    for _ in range(dropouts):
+        gap_start = rng.uniform(0, duration)
+        keep &= ~((offsets >= gap_start) & (offsets < gap_start + rng.uniform(5, 60)))
+
+    def drop(values, fraction):
+        values = values.astype(np.float64)
+        if fraction >= 1.0:
+            values[:] = np.nan
+        elif fraction > 0:
+            values[rng.random(len(values)) < fraction] = np.nan
+        return values
+
+    return {
+        'timestamps': (start + offsets)[keep],
+        'power': drop(power, missing_power)[keep],
+        'heart_rate': drop(heart_rate, missing_heart_rate)[keep],
+        'cadence': cadence[keep],
+        'distance': distance[keep],
+    }
+
+def _iso_times(timestamps):
+    """Formats epoch seconds as ISO 8601 UTC strings with milliseconds, vectorized."""
+    milliseconds = np.round(timestamps * 1000).astype('datetime64[ms]')
+    return np.datetime_as_string(milliseconds, unit='ms')
+
+def _flush(f, lines, chunk_size=10000):
+    """Writes buffered lines once enough have accumulated (or always with chunk_size=0)."""
+    if len(lines) >= chunk_size:
+        f.write("".join(lines))
+        lines.clear()
+
+def write_tcx(workout, path):
+    """Writes a generated workout as a Garmin TCX file."""
+    times = _iso_times(workout['timestamps'])
+    with open(path, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2" '
+                'xmlns:ns3="http://www.garmin.com/xmlschemas/ActivityExtension/v2">\n'
+                f'  <Activities>\n    <Activity Sport="Biking">\n      <Id>{times[0]}Z</Id>\n'
+                f'      <Lap StartTime="{times[0]}Z">\n        <Track>\n')
+        lines = []
+        for time, power, heart_rate, cadence, distance in zip(times, workout['power'], workout['heart_rate'],
+                                                               workout['cadence'], workout['distance']):
+            point = [f"          <Trackpoint>\n            <Time>{time}Z</Time>\n",
+                     f"            <DistanceMeters>{distance:.1f}</DistanceMeters>\n"]
+            if heart_rate == heart_rate:  # Not NaN
+                point.append(f"            <HeartRateBpm>\n              <Value>{int(heart_rate)}</Value>\n            </HeartRateBpm>\n")
+            point.append(f"            <Cadence>{int(cadence)}</Cadence>\n")
+            if power == power:
+                point.append(f"            <Extensions>\n              <ns3:TPX>\n                <ns3:Watts>{int(power)}</ns3:Watts>\n"
+                             f"              </ns3:TPX>\n            </Extensions>\n")
+            point.append("          </Trackpoint>\n")
+            lines.append("".join(point))
+            _flush(f, lines)
+        _flush(f, lines, 0)
+        f.write('        </Track>\n      </Lap>\n    </Activity>\n  </Activities>\n</TrainingCenterDatabase>\n')
+
+def write_gpx(workout, path):
+    """Writes a generated workout as a GPX file with Garmin TrackPointExtension HR/cadence and power."""
+    times = _iso_times(workout['timestamps'])
+    latitudes = 59.9 + workout['distance'] / 111000.0
+    with open(path, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<gpx version="1.1" creator="workout_generator" xmlns="http://www.topografix.com/GPX/1/1" '
+                'xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v1">\n'
+                '  <trk>\n    <trkseg>\n')
+        lines = []
+        for time, latitude, power, heart_rate, cadence in zip(times, latitudes, workout['power'],
+                                                               workout['heart_rate'], workout['cadence']):
+            extension = []
+            if power == power:
+                extension.append(f"<power>{int(power)}</power>")
+            tpx = f"<gpxtpx:cad>{int(cadence)}</gpxtpx:cad>"
+            if heart_rate == heart_rate:
+                tpx = f"<gpxtpx:hr>{int(heart_rate)}</gpxtpx:hr>" + tpx
+            extension.append(f"<gpxtpx:TrackPointExtension>{tpx}</gpxtpx:TrackPointExtension>")
+            lines.append(f'      <trkpt lat="{latitude:.6f}" lon="10.750000"><time>{time}Z</time>'
+                         f'<extensions>{"".join(extension)}</extensions></trkpt>\n')
+            _flush(f, lines)
+        _flush(f, lines, 0)
+        f.write('    </trkseg>\n  </trk>\n</gpx>\n')
+
+FIT_EPOCH = 631065600
+
+def _fit_crc(data, crc=0):
+    """FIT's CRC-16 (CRC-16/ARC) of `data`."""
+    table = _FIT_CRC_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+def _crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+_FIT_CRC_TABLE = _crc_table()
+
+def _fit_definition(local_type, global_number, fields, developer_fields=()):
+    """Encodes a little-endian definition message; fields are (number, size, base type)."""
+    header = 0x40 | (0x20 if developer_fields else 0) | local_type
+    message = struct.pack("<BBBHB", header, 0, 0, global_number, len(fields))
+    message += b"".join(struct.pack("BBB", *field) for field in fields)
+    if developer_fields:
+        message += struct.pack("B", len(developer_fields)) + b"".join(struct.pack("BBB", *field) for field in developer_fields)
+    return message
+
+def write_fit(workout, path, compressed_every=4, developer_power=False):
+    """
+    Writes a generated workout as a FIT activity file.
+
+    Timestamps are whole seconds, so workouts above 1 Hz end up with repeated timestamps.
+
+    Args:
+        workout (dict): Workout from `generate_workout`.
+        path (str): Output path.
+        compressed_every (int): Write a full timestamp on every n-th record and compressed
+                                timestamp headers on the others (0 disables compression).
+        developer_power (bool): Store power in a developer field named "Power" (as running power
+                                pods do) instead of the standard record field.
+    """
+    timestamps = np.floor(workout['timestamps']).astype(np.int64) - FIT_EPOCH
+    count = len(timestamps)
+    parts = [_fit_definition(0, 0, [(0, 1, 0x00), (1, 2, 0x84), (4, 4, 0x86)]),
+             struct.pack("<BBHI", 0, 4, 255, int(timestamps[0]) if count else 0)]
+    developer_fields = ()
+    if developer_power:
+        parts.append(_fit_definition(1, 207, [(1, 16, 0x0D), (3, 1, 0x02)]))
+        parts.append(struct.pack("<B16sB", 1, b"workout_gen_0001", 0))
+        parts.append(_fit_definition(1, 206, [(0, 1, 0x02), (1, 1, 0x02), (2, 1, 0x02), (3, 16, 0x07), (8, 8, 0x07)]))
+        parts.append(struct.pack("<BBBB16s8s", 1, 0, 0, 0x84, b"Power", b"W"))
+        developer_fields = ((0, 2, 0),)
+    metric_fields = [(3, 1, 0x02), (4, 1, 0x02), (5, 4, 0x86), (73, 4, 0x86)]
+    if not developer_power:
+        metric_fields.insert(0, (7, 2, 0x84))
+    parts.append(_fit_definition(2, 20, [(253, 4, 0x86)] + metric_fields, developer_fields))
+    parts.append(_fit_definition(3, 20, metric_fields, developer_fields))
+
+    def column(values, invalid, scale=1.0):
+        scaled = np.round(np.asarray(values, dtype=np.float64) * scale)
+        return np.where(np.isnan(scaled), invalid, scaled)
+
+    fields = [('header', 'u1'), ('timestamp', '<u4'), ('power', '<u2'), ('heart_rate', 'u1'), ('cadence', 'u1'),
+              ('distance', '<u4'), ('speed', '<u4'), ('developer_power', '<u2')]
+    if not developer_power:
+        fields.pop()
+    records = np.zeros(count, dtype=fields if not developer_power else [field for field in fields if field[0] != 'power'])
+    records['timestamp'] = timestamps
+    records['heart_rate'] = column(workout['heart_rate'], 0xFF)
+    records['cadence'] = column(workout['cadence'], 0xFF)
+    records['distance'] = column(workout['distance'], 0xFFFFFFFF, 100.0)
+    speed = np.gradient(workout['distance'], workout['timestamps']) if count > 1 else np.full(count, np.nan)
+    records['speed'] = column(speed, 0xFFFFFFFF, 1000.0)
+    records['developer_power' if developer_power else 'power'] = column(workout['power'], 0xFFFF)
+
+    full = np.ones(count, dtype=bool)
+    if compressed_every:
+        full = np.arange(count) % compressed_every == 0
+        last_full = np.maximum.accumulate(np.where(full, np.arange(count), 0))
+        full |= timestamps - timestamps[last_full] >= 32  # Offsets only span 31 s
+    records['header'] = np.where(full, 2, 0x80 | (3 << 5) | (timestamps & 0x1F))
+    full_bytes = records.view(np.uint8).reshape(count, -1)
+    compressed_bytes = np.delete(full_bytes, np.s_[1:5], axis=1)  # Same record without the timestamp
+    sizes = np.where(full, full_bytes.shape[1], compressed_bytes.shape[1])
+    offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    body = np.empty(int(sizes.sum()), dtype=np.uint8)
+    body[offsets[full, None] + np.arange(full_bytes.shape[1])] = full_bytes[full]
+    body[offsets[~full, None] + np.arange(compressed_bytes.shape[1])] = compressed_bytes[~full]
+    parts.append(body.tobytes())
+
+    data = b"".join(parts)
+    header = struct.pack("<BBHI4s", 14, 0x20, 2132, len(data), b".FIT")
+    header += struct.pack("<H", _fit_crc(header))
+    with open(path, 'wb') as f:
+        f.write(header + data + struct.pack("<H", _fit_crc(data, _fit_crc(header))))
+
+def main(argv=None):
+    """Writes one synthetic workout file."""
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic TCX, GPX or FIT workout.")
+    parser.add_argument('output', help="Output path ending in .tcx, .gpx or .fit.")
+    parser.add_argument('--duration', type=float, default=3600, help="Seconds (default 3600).")
+    parser.add_argument('--rate', type=float, default=1.0, help="Samples per second (default 1).")
+    parser.add_argument('--dropouts', type=int, default=0)
+    parser.add_argument('--missing-power', type=float, default=0.0)
+    parser.add_argument('--missing-hr', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    workout = generate_workout(args.duration, args.rate, dropouts=args.dropouts, missing_power=args.missing_power,
+                               missing_heart_rate=args.missing_hr, seed=args.seed)
+    writers = {'.gpx': write_gpx, '.fit': write_fit}
+    writers.get(os.path.splitext(args.output.lower())[1], write_tcx)(workout, args.output)
+    print(f"Wrote {len(workout['timestamps'])} samples to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+from array import array
+from datetime import datetime, timezone
+
+import numpy as np
+
+METRICS = ('power', 'heart_rate', 'cadence', 'distance', 'speed', 'temperature')
+
+
+def parse_timestamp(timestamp_str):
+    """Parses an ISO 8601 timestamp (with or without 'Z') into epoch seconds."""
+    current_time = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
+    if current_time.tzinfo is None:
+        current_time = current_time.replace(tzinfo=timezone.utc)
+    return current_time.timestamp()
+
+
+def format_timestamp(epoch_seconds):
+    """
+    Formats epoch seconds as a UTC ISO 8601 string, e.g. 2024-12-11T15:49:55.000Z.
+
+    Summary and interval times are rendered with this, not copied from the file: a source time
+    of 2024-01-01T10:00:01.500+01:00 becomes 2024-01-01T09:00:01.500Z, and 10:00:00Z becomes
+    10:00:00.000Z. Streams only keep epoch seconds, and FIT files and resampled streams have no
+    source string to echo.
+    """
+    current_time = datetime.fromtimestamp(float(epoch_seconds), tz=timezone.utc)
+    return current_time.strftime('%Y-%m-%dT%H:%M:%S.') + f"{current_time.microsecond // 1000:03d}Z"
+
+
+class MetricSeries:
+    """
+    A single metric sampled over time, with missing samples removed.
+
+    Holds parallel NumPy arrays of epoch seconds and values. Iterating yields
+    (timestamp, value) pairs so code written against the old list-of-tuples
+    format keeps working.
+    """
+
+    def __init__(self, timestamps, values):
+        self.timestamps = np.asarray(timestamps, dtype=np.float64)
+        self.values = np.asarray(values, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __iter__(self):
+        for timestamp, value in zip(self.timestamps, self.values):
+            yield format_timestamp(timestamp), float(value)
+
+    def with_values(self, values):
+        """Returns a new series on the same timeline with different values."""
+        return MetricSeries(self.timestamps, values)
+
+
+class WorkoutStream:
+    """
+    Columnar container for one parsed workout file.
+
+    Timestamps are stored once as float64 epoch seconds. Every metric is a
+    float64 array of the same length, with NaN where the sample is missing;
+    `masks[metric]` is True where a value is present.
+    """
+
+    def __init__(self, timestamps, **metrics):
+        self.timestamps = np.asarray(timestamps, dtype=np.float64)
+        self.metrics = {}
+        self.masks = {}
+        for metric in METRICS:
+            values = metrics.get(metric)
+            if values is None:
+                values = np.full(len(self.timestamps), np.nan)
+            values = np.asarray(values, dtype=np.float64)
+            self.metrics[metric] = values
+            self.masks[metric] = ~np.isnan(values)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def has(self, metric):
+        """Returns True if at least one sample of `metric` is present."""
+        return bool(self.masks[metric].any())
+
+    def primary_metric(self):
+        """Returns the metric analysis is based on: power if present, else heart rate."""
+        for metric in ('power', 'heart_rate'):
+            if self.has(metric):
+                return metric
+        return None
+
+    def series(self, metric):
+        """Returns a MetricSeries of the present samples of `metric`."""
+        mask = self.masks[metric]
+        return MetricSeries(self.timestamps[mask], self.metrics[metric][mask])
+
+    @classmethod
+    def from_points(cls, points):
+        """
+        Builds a stream from an iterable of point dicts as produced by the parsers.
+
+        Args:
+            points (iterable of dict): Dicts with a 'timestamp' ISO string and
+                optional 'power', 'heart_rate', 'cadence', 'distance', 'speed' and
+                'temperature' values.
+
+        Returns:
+            WorkoutStream: The columnar stream. Timestamps are parsed exactly once here.
+        """
+        nan = float('nan')
+        timestamps = array('d')
+        columns = {metric: array('d') for metric in METRICS}
+        for point in points:
+            timestamps.append(parse_timestamp(point['timestamp']))
+            for metric, column in columns.items():
+                value = point.get(metric)
+                column.append(nan if value is None else value)
+        return cls(np.frombuffer(timestamps, dtype=np.float64),
+                   **{metric: np.frombuffer(column, dtype=np.float64) for metric, column in columns.items()})
+
+
+def as_arrays(data, metric=None):
+    """
+    Returns (timestamps, values) NumPy arrays for any supported series input.
+
+    Args:
+        data (WorkoutStream, MetricSeries or list of tuples): A whole stream, a
+            single MetricSeries, or a list of (ISO timestamp, value) pairs.
+            Missing samples are dropped.
+        metric (str): Metric to take from a WorkoutStream. Defaults to the
+            stream's primary metric.
+
+    Returns:
+        tuple: (epoch seconds, values) as float64 arrays.
+    """
+    if isinstance(data, WorkoutStream):
+        data = data.series(metric or data.primary_metric() or 'power')
+    if isinstance(data, MetricSeries):
+        return data.timestamps, data.values
+    pairs = [(timestamp, value) for timestamp, value in data if value is not None]
+    timestamps = np.fromiter((parse_timestamp(timestamp) for timestamp, _ in pairs), dtype=np.float64, count=len(pairs))
+    values = np.fromiter((value for _, value in pairs), dtype=np.float64, count=len(pairs))
+    return timestamps, values
+
+
+def as_series(data, metric=None):
+    """Returns `data` as a MetricSeries, converting a stream or list of tuples if needed."""
+    if isinstance(data, MetricSeries):
+        return data
+    return MetricSeries(*as_arrays(data, metric))
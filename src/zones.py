@@ -1,92 +1,219 @@
-from datetime import datetime
-
-def analyze_zones(data_points, zone_definitions, analysis_type="power"):
-    """
-    Analyzes the time spent in different power or heart rate zones.
-
-    Args:
-        data_points (list of tuples): A list of (timestamp, value) where value is power or heart rate.
-        zone_definitions (dict): A dictionary defining the zones.
-                                  For power, keys are zone names and values are lists [lower_bound_percent, upper_bound_percent] of FTP.
-                                  For heart rate, keys are zone names and values are lists [lower_bound_percent, upper_bound_percent] of Max HR or LTHR.
-        analysis_type (str): Either "power" or "heart_rate", indicating the type of data being analyzed.
-
-    Returns:
-        dict: A dictionary where keys are zone names and values are the time spent in that zone (in seconds).
-              Also includes the athlete's FTP or Max HR/LTHR if applicable and provided.
-    """
-    if not data_points or not zone_definitions:
-        print("analyze_zones: No data points or zone definitions provided.")
-        return {}
-
-    time_in_zones = {zone: 0 for zone in zone_definitions}
-    previous_time = None
-
-    # Get athlete-specific reference value if available in definitions
-    reference_value = zone_definitions.get("ftp") if analysis_type == "power" else zone_definitions.get("max_hr") or zone_definitions.get("lthr")
-
-    print(f"analyze_zones: Analysis type: {analysis_type}, Reference value: {reference_value}")
-
-    # Create absolute zone boundaries based on percentages (if reference value exists)
-    absolute_zones = {}
-    if reference_value is not None:
-        for zone, bounds in zone_definitions.items():
-            if zone in ["ftp", "max_hr", "lthr"]:  # Skip reference value keys
-                continue
-            if isinstance(bounds, list) and len(bounds) == 2:
-                lower_bound = reference_value * (bounds[0] / 100.0)
-                upper_bound = reference_value * (bounds[1] / 100.0)
-                absolute_zones[zone] = [lower_bound, upper_bound]
-            else:
-                absolute_zones[zone] = bounds  # Assume already absolute if not a percentage list
-    else:
-        absolute_zones = zone_definitions  # Assume already absolute if no reference value
-
-    for i, (timestamp_str, value) in enumerate(data_points):
-        try:
-            current_time = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))  # Handle potential 'Z' timezone
-        except ValueError:
-            try:
-                current_time = datetime.strptime(timestamp_str, '%Y-%m-%dT%H:%M:%S.%fZ')
-            except ValueError:
-                try:
-                    current_time = datetime.strptime(timestamp_str, '%Y-%m-%dT%H:%M:%S%z')
-                except ValueError:
-                    print(f"analyze_zones: Warning: Could not parse timestamp: {timestamp_str}")
-                    continue
-
-        if previous_time:
-            duration = (current_time - previous_time).total_seconds()
-            if value is not None:
-                found_zone = False
-                for zone, bounds in absolute_zones.items():
-                    if isinstance(bounds, list) and len(bounds) == 2:
-                        lower_bound = min(bounds)
-                        upper_bound = max(bounds)
-                        if reference_value is not None:
-                            # Handle percentage-based zones
-                            lower_bound_abs = reference_value * (lower_bound / 100.0)
-                            upper_bound_abs = reference_value * (upper_bound / 100.0)
-                            if lower_bound_abs <= value < upper_bound_abs:
-                                time_in_zones[zone] += duration
-                                found_zone = True
-                                break
-                        else:
-                            # Handle direct BPM ranges
-                            if lower_bound <= value < upper_bound:
-                                time_in_zones[zone] += duration
-                                found_zone = True
-                                break
-                if not found_zone and value is not None:
-                    print(f"analyze_zones: Time: {current_time}, HR: {value}, No zone matched")
-
-        previous_time = current_time
-
-    results = time_in_zones
-    if reference_value is not None:
-        results[f"{analysis_type.upper()} Reference Value"] = reference_value
-
-    print(f"analyze_zones: Final time in zones: {results}")
-
-    return results
-
+import numpy as np
+import workout_stream
+import instrumentation
+
+logger = instrumentation.get_logger("zones")
+
+REFERENCE_KEYS = ("ftp", "max_hr", "lthr")
+
+class ZoneTable:
+    """
+    Zone definitions compiled into sorted boundary arrays.
+
+    Attributes:
+        names (list of str): Zone names in definition order.
+        lower_bounds (np.ndarray): Absolute lower bound of each zone, sorted ascending. Empty
+                                   zones (lower == upper) match nothing and are left out.
+        upper_bounds (np.ndarray): Absolute upper bound of each zone, in the same order.
+        order (np.ndarray): Index into `names` for each sorted bound.
+        reference_value (float or None): FTP / Max HR / LTHR the bounds were derived from.
+    """
+
+    def __init__(self, names, lower_bounds, upper_bounds, reference_value=None):
+        self.names = list(names)
+        lower_bounds = np.asarray(lower_bounds, dtype=np.float64)
+        upper_bounds = np.asarray(upper_bounds, dtype=np.float64)
+        nonempty = np.flatnonzero(upper_bounds > lower_bounds)
+        self.order = nonempty[np.argsort(lower_bounds[nonempty], kind="stable")]
+        self.lower_bounds = lower_bounds[self.order]
+        self.upper_bounds = upper_bounds[self.order]
+        self.reference_value = reference_value
+
+    def __len__(self):
+        return len(self.names)
+
+    def classify(self, values):
+        """
+        Returns the zone index (into `names`) of every value, or -1 where no zone matches.
+
+        A value belongs to a zone when lower_bound <= value < upper_bound.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if not len(self.order):
+            return np.full(values.shape, -1, dtype=np.intp)
+        positions = np.searchsorted(self.lower_bounds, values, side="right") - 1
+        clipped = np.clip(positions, 0, None)
+        matched = (positions >= 0) & (values < self.upper_bounds[clipped])
+        return np.where(matched, self.order[clipped], -1)
+
+    def overlaps(self):
+        """
+        Returns the (name, name) pairs of neighbouring zones that share values.
+
+        `classify` picks the zone with the greatest lower bound, so it only agrees with "the first
+        zone that matches" when no two zones overlap.
+        """
+        overlapping = np.flatnonzero(self.lower_bounds[1:] < self.upper_bounds[:-1])
+        return [(self.names[self.order[i]], self.names[self.order[i + 1]]) for i in overlapping]
+
+    def zone_of(self, value):
+        """Returns the zone name for a single value, or None."""
+        index = int(self.classify([value])[0])
+        return self.names[index] if index >= 0 else None
+
+def get_reference_value(zone_definitions, analysis_type="power"):
+    """
+    Returns the FTP (power) or Max HR/LTHR (heart rate) from the zone definitions, if any.
+    With no analysis type, whichever reference key is present is used.
+    """
+    if analysis_type == "power":
+        return zone_definitions.get("ftp")
+    if analysis_type == "heart_rate":
+        return zone_definitions.get("max_hr") or zone_definitions.get("lthr")
+    return next((zone_definitions[key] for key in REFERENCE_KEYS if zone_definitions.get(key)), None)
+
+def compile_zones(zone_definitions, analysis_type="power"):
+    """
+    Compiles zone definitions into a ZoneTable once, ahead of any analysis.
+
+    Args:
+        zone_definitions (dict or ZoneTable): Zone names mapped to [lower, upper] bounds. When an
+                                  `ftp` (power) or `max_hr`/`lthr` (heart rate) key is present
+                                  the bounds are percentages of it, otherwise they are absolute.
+                                  An already compiled ZoneTable is returned unchanged.
+        analysis_type (str): Either "power" or "heart_rate", or None to use whichever reference
+                             key is present.
+
+    Returns:
+        ZoneTable: The compiled zones.
+
+    Raises:
+        ValueError: If two zones overlap. A value belongs to at most one zone; gaps between zones
+                    are allowed and match no zone.
+    """
+    if isinstance(zone_definitions, ZoneTable):
+        return zone_definitions
+
+    zone_definitions = zone_definitions or {}
+    reference_value = get_reference_value(zone_definitions, analysis_type)
+
+    names, lower_bounds, upper_bounds = [], [], []
+    for zone, bounds in zone_definitions.items():
+        if zone in REFERENCE_KEYS:  # Skip reference value keys
+            continue
+        if not (isinstance(bounds, (list, tuple)) and len(bounds) == 2):
+            continue
+        lower_bound, upper_bound = min(bounds), max(bounds)
+        if reference_value is not None:
+            lower_bound = reference_value * (lower_bound / 100.0)
+            upper_bound = reference_value * (upper_bound / 100.0)
+        names.append(zone)
+        lower_bounds.append(lower_bound)
+        upper_bounds.append(upper_bound)
+
+    zone_table = ZoneTable(names, lower_bounds, upper_bounds, reference_value)
+    overlaps = zone_table.overlaps()
+    if overlaps:
+        raise ValueError("Overlapping zones: " + ", ".join(f"{first} and {second}" for first, second in overlaps))
+    return zone_table
+
+def analyze_zones(data_points, zone_definitions, analysis_type="power"):
+    """
+    Analyzes the time spent in different power or heart rate zones.
+
+    Each sample is credited with the time since the previous sample. All samples are classified
+    in one vectorized pass and the durations are summed per zone with a weighted bincount.
+
+    Args:
+        data_points (WorkoutStream, MetricSeries or list of tuples): The samples to analyze. A
+                                  WorkoutStream contributes its `analysis_type` metric; a list
+                                  holds (timestamp, value) pairs of power or heart rate.
+        zone_definitions (dict or ZoneTable): A dictionary defining the zones, or a table already
+                                  compiled with `compile_zones`.
+                                  For power, keys are zone names and values are lists [lower_bound_percent, upper_bound_percent] of FTP.
+                                  For heart rate, keys are zone names and values are lists [lower_bound_percent, upper_bound_percent] of Max HR or LTHR.
+        analysis_type (str): Either "power" or "heart_rate", indicating the type of data being analyzed.
+
+    Returns:
+        dict: A dictionary where keys are zone names and values are the time spent in that zone (in seconds).
+              Also includes the athlete's FTP or Max HR/LTHR if applicable and provided.
+    """
+    if not len(data_points) or not zone_definitions:
+        logger.warning("analyze_zones: No data points or zone definitions provided.")
+        return {}
+
+    zone_table = compile_zones(zone_definitions, analysis_type)
+    reference_value = zone_table.reference_value
+
+    logger.debug(f"analyze_zones: Analysis type: {analysis_type}, Reference value: {reference_value}")
+
+    timestamps, values = workout_stream.as_arrays(data_points, analysis_type)
+    durations = np.diff(timestamps)
+    zone_indices = zone_table.classify(values[1:])
+    matched = zone_indices >= 0
+
+    totals = np.bincount(zone_indices[matched], weights=durations[matched], minlength=len(zone_table))
+    results = {zone: float(total) for zone, total in zip(zone_table.names, totals)}
+
+    unmatched = int(len(zone_indices) - np.count_nonzero(matched))
+    if unmatched:
+        instrumentation.count('points_unmatched', unmatched)
+        logger.debug(f"analyze_zones: {unmatched} samples matched no zone")
+
+    if reference_value is not None:
+        results[f"{analysis_type.upper()} Reference Value"] = reference_value
+
+    logger.debug(f"analyze_zones: Final time in zones: {results}")
+
+    return results
+
+class OnlineZones:
+    """
+    Chunked counterpart of `analyze_zones`, for recordings too long to hold or still in progress.
+
+    Only the per-zone totals and the last timestamp are carried between chunks. The carried
+    totals are fed to each chunk's weighted bincount ahead of the new durations, so they are
+    added up in the same order, and to the same result, as `analyze_zones` over the whole series.
+    """
+
+    def __init__(self, zone_definitions, analysis_type="power"):
+        self.analysis_type = analysis_type
+        self.zone_table = compile_zones(zone_definitions, analysis_type) if zone_definitions else None
+        self.totals = np.zeros(len(self.zone_table) if self.zone_table else 0)
+        self.previous_time = None
+
+    def update(self, timestamps, values):
+        """
+        Credits the next chunk of samples to their zones.
+
+        Args:
+            timestamps (np.ndarray): Sample times in seconds, ascending and after the previous chunk.
+            values (np.ndarray): Sample values.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        if self.zone_table is None or not len(timestamps):
+            return
+        if self.previous_time is None:
+            durations, values = np.diff(timestamps), values[1:]  # The first sample has no time before it
+        else:
+            durations = np.diff(timestamps, prepend=self.previous_time)
+        self.previous_time = timestamps[-1]
+
+        zone_count = len(self.zone_table)
+        zone_indices = self.zone_table.classify(values)
+        matched = zone_indices >= 0
+        self.totals = np.bincount(np.concatenate((np.arange(zone_count), zone_indices[matched])),
+                                  weights=np.concatenate((self.totals, durations[matched])), minlength=zone_count)
+        unmatched = int(len(zone_indices) - np.count_nonzero(matched))
+        if unmatched:
+            instrumentation.count('points_unmatched', unmatched)
+
+    def result(self):
+        """Returns the time in zones so far, as returned by `analyze_zones`."""
+        if self.previous_time is None:
+            return {}
+        results = {zone: float(total) for zone, total in zip(self.zone_table.names, self.totals)}
+        if self.zone_table.reference_value is not None:
+            results[f"{self.analysis_type.upper()} Reference Value"] = self.zone_table.reference_value
+        return results
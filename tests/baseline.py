@@ -0,0 +1,205 @@
+"""
+The original loop implementations of the analysis stages, kept as a reference for the
+vectorized ones. Only the progress prints were dropped.
+"""
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+import numpy as np
+
+def parse_tcx_file(file_path):
+    """Parses a TCX file and extracts timestamp, power, and heart rate data."""
+    data = []
+    tree = ET.parse(file_path)
+    root = tree.getroot()
+    namespace = {'ns': 'http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2',
+                 'ns3': 'http://www.garmin.com/xmlschemas/ActivityExtension/v2'}
+
+    for lap in root.findall('.//ns:Lap', namespace):
+        for track in lap.findall('.//ns:Track', namespace):
+            for trackpoint in track.findall('.//ns:Trackpoint', namespace):
+                timestamp_elem = trackpoint.find('ns:Time', namespace)
+                hr_elem = trackpoint.find('ns:HeartRateBpm/ns:Value', namespace)
+                power_elem = trackpoint.find('ns:Extensions/ns3:TPX/ns3:Watts', namespace)
+
+                timestamp = timestamp_elem.text if timestamp_elem is not None else None
+                heart_rate = int(hr_elem.text) if hr_elem is not None and hr_elem.text.isdigit() else None
+                power = int(power_elem.text) if power_elem is not None and power_elem.text.isdigit() else None
+
+                if timestamp:
+                    data.append({'timestamp': timestamp, 'power': power, 'heart_rate': heart_rate})
+    return data
+
+def parse_gpx_file(file_path):
+    """Parses a GPX file with gpxpy and extracts timestamp and heart rate data (if available)."""
+    import gpxpy
+    data = []
+    with open(file_path, 'r') as f:
+        gpx = gpxpy.parse(f)
+        for track in gpx.tracks:
+            for segment in track.segments:
+                for point in segment.points:
+                    timestamp = point.time.isoformat() if point.time else None
+                    heart_rate = None
+                    for extension in point.extensions:
+                        if extension.tag.endswith('TrackPointExtension'):
+                            for child in extension:
+                                if child.tag.endswith('hr'):
+                                    if child.text and child.text.isdigit():
+                                        heart_rate = int(child.text)
+                                    break
+                            break
+                    if timestamp:
+                        data.append({'timestamp': timestamp, 'power': None, 'heart_rate': heart_rate})
+    return data
+
+def smooth_data(data, window_size):
+    """Simple moving average; the first `window_size - 1` values are kept as is."""
+    if len(data) < window_size:
+        return data
+
+    smoothed_data = []
+    values = np.array([item[1] for item in data])
+    timestamps = [item[0] for item in data]
+
+    for i in range(len(values)):
+        if i < window_size - 1:
+            smoothed_data.append((timestamps[i], values[i]))
+        else:
+            window = values[i - window_size + 1 : i + 1]
+            average = np.mean(window)
+            smoothed_data.append((timestamps[i], average))
+
+    return smoothed_data
+
+def detect_intervals(data, config, zones=None):
+    """Detects intervals based on power/heart rate crossing `sustain_above`."""
+    if not data or not config or not zones:
+        return []
+
+    intervals = []
+    interval_start = None
+    interval_values = []
+    interval_zones = set()
+
+    def determine_zone(value):
+        for zone_name, (lower_bound, upper_bound) in zones.items():
+            if lower_bound <= value < upper_bound:
+                return zone_name
+        return None
+
+    for timestamp, value in data:
+        current_zone = determine_zone(value)
+        if value >= config.get("sustain_above", 0):
+            if interval_start is None:
+                interval_start = timestamp
+                interval_values = [value]
+                interval_zones = {current_zone} if current_zone else set()
+            else:
+                interval_values.append(value)
+                if current_zone:
+                    interval_zones.add(current_zone)
+        elif interval_start and value < config.get("sustain_above", 0):
+            interval_end = timestamp
+            duration = (datetime.fromisoformat(interval_end) - datetime.fromisoformat(interval_start)).total_seconds()
+            if duration >= config.get("sustain_duration", 15):
+                intervals.append({
+                    "start_time": interval_start,
+                    "end_time": interval_end,
+                    "duration": duration,
+                    "average_value": sum(interval_values) / len(interval_values),
+                    "max_value": max(interval_values),
+                    "zones": sorted(interval_zones)
+                })
+            interval_start = None
+            interval_values = []
+            interval_zones = set()
+
+    return intervals
+
+def analyze_zones(data_points, zone_definitions, analysis_type="power"):
+    """Time in zone in seconds, crediting each sample with the time since the previous one."""
+    if not data_points or not zone_definitions:
+        return {}
+
+    time_in_zones = {zone: 0 for zone in zone_definitions}
+    previous_time = None
+    reference_value = zone_definitions.get("ftp") if analysis_type == "power" else zone_definitions.get("max_hr") or zone_definitions.get("lthr")
+
+    absolute_zones = {}
+    if reference_value is not None:
+        for zone, bounds in zone_definitions.items():
+            if zone in ["ftp", "max_hr", "lthr"]:
+                continue
+            if isinstance(bounds, list) and len(bounds) == 2:
+                absolute_zones[zone] = [reference_value * (bounds[0] / 100.0), reference_value * (bounds[1] / 100.0)]
+            else:
+                absolute_zones[zone] = bounds
+    else:
+        absolute_zones = zone_definitions
+
+    for timestamp_str, value in data_points:
+        try:
+            current_time = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
+        except ValueError:
+            try:
+                current_time = datetime.strptime(timestamp_str, '%Y-%m-%dT%H:%M:%S.%fZ')
+            except ValueError:
+                try:
+                    current_time = datetime.strptime(timestamp_str, '%Y-%m-%dT%H:%M:%S%z')
+                except ValueError:
+                    continue
+
+        if previous_time:
+            duration = (current_time - previous_time).total_seconds()
+            if value is not None:
+                for zone, bounds in absolute_zones.items():
+                    if isinstance(bounds, list) and len(bounds) == 2:
+                        lower_bound = min(bounds)
+                        upper_bound = max(bounds)
+                        if reference_value is not None:
+                            if reference_value * (lower_bound / 100.0) <= value < reference_value * (upper_bound / 100.0):
+                                time_in_zones[zone] += duration
+                                break
+                        elif lower_bound <= value < upper_bound:
+                            time_in_zones[zone] += duration
+                            break
+
+        previous_time = current_time
+
+    results = time_in_zones
+    if reference_value is not None:
+        results[f"{analysis_type.upper()} Reference Value"] = reference_value
+    return results
+
+def group_intervals(intervals, min_break_duration=300, duration_tolerance=5):
+    """Groups intervals based on proximity and similarity."""
+    if not intervals:
+        return []
+
+    grouped_intervals = []
+    current_group = [intervals[0]]
+
+    for i in range(1, len(intervals)):
+        prev_end_time = datetime.fromisoformat(intervals[i - 1]["end_time"])
+        curr_start_time = datetime.fromisoformat(intervals[i]["start_time"])
+        time_difference = (curr_start_time - prev_end_time).total_seconds()
+        duration_difference = abs(intervals[i]["duration"] - intervals[i - 1]["duration"])
+
+        if time_difference >= min_break_duration or duration_difference > duration_tolerance:
+            grouped_intervals.append({
+                "intervals": current_group,
+                "number_of_intervals": len(current_group),
+                "average_duration": sum(interval["duration"] for interval in current_group) / len(current_group)
+            })
+            current_group = [intervals[i]]
+        else:
+            current_group.append(intervals[i])
+
+    grouped_intervals.append({
+        "intervals": current_group,
+        "number_of_intervals": len(current_group),
+        "average_duration": sum(interval["duration"] for interval in current_group) / len(current_group)
+    })
+
+    return grouped_intervals
@@ -0,0 +1,75 @@
+import functools
+import os
+import sys
+import time
+
+import pytest
+
+# The modules in src/ import each other as top-level modules, as when run from there
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+sys.path.insert(0, SRC_DIR)
+
+RAW_DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw')
+TEST_DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+@pytest.fixture(scope="session")
+def config():
+    """The shipped config.yaml, parsed without going through the config cache."""
+    import config_cache
+    return config_cache.load_config(cache_file=None)
+
+def raw_file(activity_id):
+    """Returns the path of a bundled TCX file."""
+    return os.path.join(RAW_DATA_DIR, f"activity_{activity_id}.tcx")
+
+def data_file(name):
+    """Returns the path of a file in tests/data."""
+    return os.path.join(TEST_DATA_DIR, name)
+
+@pytest.fixture
+def data_dirs(tmp_path, monkeypatch):
+    """Points the raw and processed data directories and the activity store at `tmp_path`."""
+    import activity_store
+    import main
+    monkeypatch.setattr(main, "RAW_DATA_DIR", str(tmp_path / "raw"))
+    monkeypatch.setattr(main, "PROCESSED_DATA_DIR", str(tmp_path / "processed"))
+    monkeypatch.setattr(activity_store, "connect", functools.partial(activity_store.connect,
+                                                                     str(tmp_path / "activities.sqlite")))
+    os.makedirs(main.RAW_DATA_DIR)
+    os.makedirs(main.PROCESSED_DATA_DIR)
+    return tmp_path
+
+@pytest.fixture
+def settings(config):
+    """Compiled settings of the shipped config, without the stream cache."""
+    import main
+    compiled = main.compile_settings(config)
+    compiled['cache_config'] = {'enabled': False}
+    return compiled
+
+# While set, analyses in worker processes wait for this file to exist. Pools fork their workers on
+# first use, so it must be set before that.
+GATE = None
+_ANALYZE = None
+
+def _gated_analysis(job):
+    while GATE and not os.path.exists(GATE):
+        time.sleep(0.01)
+    return _ANALYZE(job)
+
+@pytest.fixture
+def gate(tmp_path, monkeypatch):
+    """Holds every analysis run through `main._analyze_file_timed` until the returned function is called."""
+    import main
+    path = str(tmp_path / "gate")
+    monkeypatch.setattr(f"{__name__}.GATE", path)
+    monkeypatch.setattr(f"{__name__}._ANALYZE", main._analyze_file_timed)
+    monkeypatch.setattr(main, "_analyze_file_timed", _gated_analysis)
+    return lambda: open(path, 'w').close()
+
+def wait_until(condition, seconds=30):
+    """Polls `condition` until it is true; fails the test after `seconds`."""
+    deadline = time.monotonic() + seconds
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
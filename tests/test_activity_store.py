@@ -0,0 +1,24 @@
+import pytest
+
+import activity_store
+import main
+
+@pytest.fixture
+def store_path(tmp_path):
+    path = str(tmp_path / "activities.db")
+    assert activity_store.main(['--db', path, 'import', '--dir', main.PROCESSED_DATA_DIR]) == 0
+    return path
+
+def test_similar_to_a_stored_activity(store_path, capsys):
+    capsys.readouterr()
+    assert activity_store.main(['--db', store_path, 'similar', '--like', "activity_18806050275"]) == 0
+    names = [line.split()[2] for line in capsys.readouterr().out.splitlines()]
+    assert names and "activity_18806050275" not in names
+
+def test_similar_to_an_unknown_activity_fails_cleanly(store_path, capsys):
+    assert activity_store.main(['--db', store_path, 'similar', '--like', "activity_0"]) == 1
+    assert "Unknown activity 'activity_0'" in capsys.readouterr().err
+
+def test_similar_to_an_unparsable_structure_fails_cleanly(store_path, capsys):
+    assert activity_store.main(['--db', store_path, 'similar', '--structure', "lots of hills"]) == 1
+    assert "Cannot parse workout structure" in capsys.readouterr().err
@@ -0,0 +1,24 @@
+import json
+import os
+
+import pytest
+
+import main
+from tests.conftest import RAW_DATA_DIR, raw_file
+
+ACTIVITIES = ["17738425132", "18223135043", "18573846126", "18806050275"]
+
+def _stored_summary(activity_id):
+    """The summary shipped in data/processed, as analyzed by the original code."""
+    path = os.path.join(RAW_DATA_DIR, '..', 'processed', f"activity_{activity_id}_summary.json")
+    with open(path, 'r') as f:
+        return json.load(f)
+
+@pytest.mark.parametrize("activity_id", ACTIVITIES)
+def test_default_config_keeps_the_shipped_titles(data_dirs, settings, activity_id):
+    assert not settings['resampling_config'].get('enabled')
+    summary = main.analyze_workout(raw_file(activity_id), settings)
+    stored = _stored_summary(activity_id)
+    assert summary['title'] == stored['title']
+    assert summary['zone_analysis'] == stored['zone_analysis']
+    assert 'preview' not in summary
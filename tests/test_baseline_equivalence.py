@@ -0,0 +1,84 @@
+"""The vectorized stages against the original loop implementations, on the bundled rides."""
+import functools
+
+import numpy as np
+import pytest
+
+import data_parser
+import grouping
+import interval_detection
+import utils
+import zones
+from tests import baseline
+from tests.conftest import raw_file
+from workout_stream import parse_timestamp
+
+ACTIVITIES = ["17738425132", "18223135043", "18573846126", "18806050275"]
+WINDOWS = {'power': 5, 'heart_rate': 10}
+
+@functools.lru_cache(maxsize=None)
+def _baseline_points(activity_id):
+    return baseline.parse_tcx_file(raw_file(activity_id))
+
+def _baseline_series(activity_id, metric):
+    return [(point['timestamp'], point[metric]) for point in _baseline_points(activity_id) if point[metric] is not None]
+
+@functools.lru_cache(maxsize=None)
+def _stream(activity_id):
+    return data_parser.parse_workout_stream(raw_file(activity_id))
+
+CASES = [pytest.param(activity_id, metric, id=f"{activity_id}-{metric}")
+         for activity_id in ACTIVITIES for metric in WINDOWS if _baseline_series(activity_id, metric)]
+
+@pytest.mark.parametrize("activity_id", ACTIVITIES)
+def test_stream_holds_the_parsed_points(activity_id):
+    points = _baseline_points(activity_id)
+    stream = _stream(activity_id)
+    np.testing.assert_array_equal(stream.timestamps, [parse_timestamp(point['timestamp']) for point in points])
+    for metric in WINDOWS:
+        expected = [np.nan if point[metric] is None else point[metric] for point in points]
+        np.testing.assert_array_equal(stream.metrics[metric], expected)
+
+@pytest.mark.parametrize("activity_id, metric", CASES)
+def test_smoothing(activity_id, metric):
+    expected = baseline.smooth_data(_baseline_series(activity_id, metric), WINDOWS[metric])
+    smoothed = utils.smooth_data(_stream(activity_id).series(metric), WINDOWS[metric])
+    np.testing.assert_array_equal(smoothed.timestamps, [parse_timestamp(timestamp) for timestamp, _ in expected])
+    np.testing.assert_allclose(smoothed.values, [value for _, value in expected], rtol=1e-12)
+
+@pytest.mark.parametrize("activity_id, metric", CASES)
+def test_interval_detection(config, activity_id, metric):
+    thresholds = config[f'{metric}_interval_thresholds']
+    expected = baseline.detect_intervals(baseline.smooth_data(_baseline_series(activity_id, metric), WINDOWS[metric]),
+                                         thresholds, zones=config[f'{metric}_zones'])
+    series = _stream(activity_id).series(metric)
+    intervals = interval_detection.detect_intervals(utils.smooth_data(series, WINDOWS[metric]), thresholds,
+                                                    zones=zones.compile_zones(config[f'{metric}_zones'], metric))
+
+    # The loop dropped an interval still open when the file ends; it is now closed there
+    if len(intervals) == len(expected) + 1:
+        assert intervals[-1]['end_seconds'] == series.timestamps[-1]
+        intervals = intervals[:-1]
+    assert len(intervals) == len(expected)
+    for interval, reference in zip(intervals, expected):
+        assert interval['start_seconds'] == parse_timestamp(reference['start_time'])
+        assert interval['end_seconds'] == parse_timestamp(reference['end_time'])
+        assert interval['duration'] == reference['duration']
+        assert interval['max_value'] == pytest.approx(reference['max_value'], rel=1e-12)
+        assert interval['average_value'] == pytest.approx(reference['average_value'], rel=1e-9)
+        assert interval['zones'] == reference['zones']
+
+@pytest.mark.parametrize("activity_id, metric", CASES)
+def test_time_in_zones(config, activity_id, metric):
+    expected = baseline.analyze_zones(_baseline_series(activity_id, metric), config[f'{metric}_zones'], metric)
+    result = zones.analyze_zones(_stream(activity_id).series(metric), zones.compile_zones(config[f'{metric}_zones'], metric),
+                                 metric)
+    assert result == pytest.approx(expected)
+
+@pytest.mark.parametrize("activity_id, metric", CASES)
+def test_grouping(config, activity_id, metric):
+    intervals = baseline.detect_intervals(baseline.smooth_data(_baseline_series(activity_id, metric), WINDOWS[metric]),
+                                          config[f'{metric}_interval_thresholds'], zones=config[f'{metric}_zones'])
+    assert grouping.group_intervals(intervals) == baseline.group_intervals(intervals)
+    # Short rests and near-equal durations, so intervals actually share groups
+    assert grouping.group_intervals(intervals, 600, 30) == baseline.group_intervals(intervals, 600, 30)
@@ -0,0 +1,116 @@
+import numpy as np
+import pytest
+
+import data_parser
+import workout_generator
+
+@pytest.fixture(scope="module")
+def workout():
+    # Dropouts (gaps) longer than 31 s force full timestamps between compressed ones
+    return workout_generator.generate_workout(1800, dropouts=3, missing_power=0.05, missing_heart_rate=0.05, seed=4)
+
+def _write(workout, tmp_path, **options):
+    path = str(tmp_path / "ride.fit")
+    workout_generator.write_fit(workout, path, **options)
+    return path
+
+def _expected(workout, metric, scale=1.0):
+    return np.round(workout[metric] * scale) / scale
+
+@pytest.mark.parametrize("compressed_every", [0, 1, 4])
+@pytest.mark.parametrize("developer_power", [False, True])
+def test_round_trip(workout, tmp_path, compressed_every, developer_power):
+    stream = data_parser.parse_fit_stream(_write(workout, tmp_path, compressed_every=compressed_every,
+                                                 developer_power=developer_power))
+
+    np.testing.assert_array_equal(stream.timestamps, np.floor(workout['timestamps']))
+    np.testing.assert_array_equal(stream.metrics['power'], _expected(workout, 'power'))
+    np.testing.assert_array_equal(stream.metrics['heart_rate'], _expected(workout, 'heart_rate'))
+    np.testing.assert_array_equal(stream.metrics['cadence'], _expected(workout, 'cadence'))
+    np.testing.assert_allclose(stream.metrics['distance'], _expected(workout, 'distance', 100.0), rtol=0, atol=1e-9)
+    assert stream.has('speed')
+
+def test_truncated_file(workout, tmp_path):
+    path = _write(workout, tmp_path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    for cut in (len(data) // 2, len(data) - 1):
+        with open(path, 'wb') as f:
+            f.write(data[:cut])
+        with pytest.raises(data_parser.FitParseError):
+            data_parser.parse_fit_stream(path)
+    assert data_parser.parse_fit_file(path) == []  # Logged and skipped, like an unreadable TCX
+
+@pytest.mark.parametrize("offset", [-1, 100, 2])  # File CRC, a record byte, the header (profile version)
+def test_bad_crc(workout, tmp_path, offset):
+    path = _write(workout, tmp_path)
+    with open(path, 'rb') as f:
+        data = bytearray(f.read())
+    data[offset] ^= 0x01
+    with open(path, 'wb') as f:
+        f.write(data)
+    with pytest.raises(data_parser.FitParseError, match="CRC"):
+        data_parser.parse_fit_stream(path)
+
+def test_crc_matches_the_bytewise_definition():
+    rng = np.random.default_rng(0)
+    for size in (0, 1, 15, 16, 17, 1000, 65537):
+        data = rng.integers(0, 256, size, dtype=np.uint8)
+        assert data_parser._fit_crc(data) == workout_generator._fit_crc(data.tobytes())
+
+# CRC from the FIT protocol document (nibble table), kept independent of both implementations.
+_SPEC_CRC_TABLE = (0x0000, 0xCC01, 0xD801, 0x1400, 0xF001, 0x3C00, 0x2800, 0xE401,
+                   0xA001, 0x6C00, 0x7800, 0xB401, 0x5000, 0x9C01, 0x8801, 0x4400)
+
+def _spec_crc(data):
+    crc = 0
+    for byte in data:
+        for nibble in (byte & 0x0F, byte >> 4):
+            tmp = _SPEC_CRC_TABLE[crc & 0x0F]
+            crc = (crc >> 4) & 0x0FFF
+            crc = crc ^ tmp ^ _SPEC_CRC_TABLE[nibble]
+    return crc
+
+def _spec_fit_file(messages):
+    """Wraps hand-written message bytes in a 14-byte header and the file CRC."""
+    data = b"".join(messages)
+    header = bytes([14, 0x20]) + (2132).to_bytes(2, 'little') + len(data).to_bytes(4, 'little') + b".FIT"
+    header += _spec_crc(header).to_bytes(2, 'little')
+    return header + data + _spec_crc(header + data).to_bytes(2, 'little')
+
+# Timestamp of the first record; 30 mod 32, so the compressed offsets below roll over after one second.
+T = 1000000030
+
+HAND_BUILT_FIT = _spec_fit_file([
+    # Definition, local 0: developer_data_id (207) with developer_data_index (3, uint8)
+    bytes([0x40, 0, 0, 207, 0, 1, 3, 1, 0x02]),
+    bytes([0x00, 0]),
+    # Definition, local 1: field_description (206): developer_data_index, field_definition_number,
+    # fit_base_type_id and an 8-byte field_name
+    bytes([0x41, 0, 0, 206, 0, 4, 0, 1, 0x02, 1, 1, 0x02, 2, 1, 0x02, 3, 8, 0x07]),
+    bytes([0x01, 0, 0, 0x84]) + b"Power\0\0\0",
+    # Definition, local 2: record (20) with timestamp (253, uint32), heart_rate (3), cadence (4)
+    # and developer field 0 of developer 0 (2 bytes)
+    bytes([0x62, 0, 0, 20, 0, 3, 253, 4, 0x86, 3, 1, 0x02, 4, 1, 0x02, 1, 0, 2, 0]),
+    bytes([0x02]) + T.to_bytes(4, 'little') + bytes([120, 85]) + (250).to_bytes(2, 'little'),
+    # Definition, local 3: the same record without the timestamp, for compressed-timestamp headers
+    bytes([0x63, 0, 0, 20, 0, 2, 3, 1, 0x02, 4, 1, 0x02, 1, 0, 2, 0]),
+    bytes([0xE0 | 31, 121, 86]) + (251).to_bytes(2, 'little'),     # T + 1
+    bytes([0xE0 | 0, 0xFF, 87]) + (252).to_bytes(2, 'little'),     # T + 2: offset rolls over, invalid heart rate
+    bytes([0xE0 | 3, 123, 88]) + (0xFFFF).to_bytes(2, 'little'),  # T + 5: invalid power
+    # Definition, local 0 redefined big-endian: record with timestamp and standard power (7, uint16)
+    bytes([0x40, 0, 1, 0, 20, 2, 253, 4, 0x86, 7, 2, 0x84]),
+    bytes([0x00]) + (T + 40).to_bytes(4, 'big') + (300).to_bytes(2, 'big'),
+])
+
+def test_hand_built_file(tmp_path):
+    path = tmp_path / "hand_built.fit"
+    path.write_bytes(HAND_BUILT_FIT)
+    stream = data_parser.parse_fit_stream(str(path))
+
+    nan = np.nan
+    np.testing.assert_array_equal(stream.timestamps, data_parser.FIT_EPOCH + T + np.array([0, 1, 2, 5, 40]))
+    np.testing.assert_array_equal(stream.metrics['heart_rate'], [120, 121, nan, 123, nan])
+    np.testing.assert_array_equal(stream.metrics['cadence'], [85, 86, 87, 88, nan])
+    np.testing.assert_array_equal(stream.metrics['power'], [250, 251, 252, nan, 300])
+    assert not stream.has('speed')
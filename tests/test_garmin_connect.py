@@ -0,0 +1,46 @@
+import sys
+import types
+
+import pytest
+
+import garmin_connect
+import garmin_fake
+
+def test_client_interface_is_abstract():
+    with pytest.raises(TypeError):
+        garmin_connect.ActivityClient()
+
+    class Partial(garmin_connect.ActivityClient):
+        def list_activities(self, start, limit):
+            return []
+
+    with pytest.raises(TypeError):
+        Partial()
+
+def test_store_password_does_not_compile_settings(monkeypatch):
+    stored = {}
+    monkeypatch.setitem(sys.modules, 'keyring', types.SimpleNamespace(
+        set_password=lambda service, email, password: stored.update({(service, email): password})))
+    monkeypatch.setattr("getpass.getpass", lambda prompt: "secret")
+    monkeypatch.setenv("GARMIN_EMAIL", "rider@example.com")
+
+    def fail(config):
+        raise AssertionError("store-password compiled the analysis settings")
+    monkeypatch.setattr(garmin_connect.analysis, "compile_settings", fail)
+
+    garmin_connect.main(['store-password'])
+    assert stored == {(garmin_connect.KEYRING_SERVICE, "rider@example.com"): "secret"}
+
+def test_sync_is_resumable(tmp_path):
+    service = garmin_fake.FakeActivityService(count=5, duration=300)
+    server = garmin_fake.start_server(service)
+    try:
+        client = garmin_connect.HttpClient(server.url)
+        options = dict(sync_config={'page_size': 2, 'requests_per_second': 100, 'burst': 10},
+                       raw_dir=str(tmp_path / "raw"), checkpoint_path=str(tmp_path / "sync.json"))
+        fetched = garmin_connect.sync_activities(client, **options)
+        assert sorted(fetched) == sorted(garmin_connect.raw_filename(activity['id'], "tcx")
+                                         for activity in service.activities)
+        assert garmin_connect.sync_activities(client, **options) == []
+    finally:
+        server.shutdown()
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+import data_parser
+import workout_generator
+from tests import baseline
+from tests.conftest import data_file, raw_file
+from workout_stream import parse_timestamp
+
+def _points(name):
+    return list(data_parser.iter_gpx_trackpoints(data_file(name)))
+
+def test_garmin_extension_namespaces():
+    points = _points("garmin_extensions.gpx")
+    assert [(point['power'], point['heart_rate'], point['cadence'], point['temperature']) for point in points] == [
+        (201, 118, 84, 21.0), (230, 121, 86, 21.5), (None, 126, None, 22.0)]
+
+def test_bare_power_element():
+    points = _points("bare_power.gpx")
+    assert [(point['power'], point['heart_rate'], point['cadence']) for point in points] == [
+        (250, 140, 90), (262, 141, 91), (None, 143, None)]
+
+def test_points_without_time_are_dropped():
+    assert len(_points("garmin_extensions.gpx")) == 3  # Of four trkpt elements
+
+def test_timezone_offsets():
+    stream = data_parser.parse_workout_stream(data_file("garmin_extensions.gpx"))
+    expected = [parse_timestamp(text) for text in ("2024-06-01T08:00:00Z", "2024-06-01T08:00:01.5Z",
+                                                   "2024-06-01T08:00:03Z")]
+    np.testing.assert_array_equal(stream.timestamps, expected)
+
+def test_same_point_shape_as_tcx():
+    gpx_point = _points("garmin_extensions.gpx")[0]
+    tcx_point = next(point for point in data_parser.iter_tcx_trackpoints(raw_file("18806050275"))
+                     if point['heart_rate'] is not None and point['power'] is not None)
+    assert gpx_point.keys() == tcx_point.keys()
+    for key in ('power', 'heart_rate', 'cadence'):
+        assert type(gpx_point[key]) is type(tcx_point[key]) is int
+
+# Not garmin_extensions.gpx: its "121.0" heart rate is read as 121, where gpxpy's reader skipped it
+@pytest.mark.parametrize("name", ["bare_power.gpx", "generated.gpx"])
+def test_matches_gpxpy(tmp_path, name):
+    pytest.importorskip("gpxpy")
+    if name == "generated.gpx":
+        path = str(tmp_path / name)
+        workout_generator.write_gpx(workout_generator.generate_workout(900, missing_heart_rate=0.1, seed=4), path)
+    else:
+        path = data_file(name)
+    expected = baseline.parse_gpx_file(path)
+    points = list(data_parser.iter_gpx_trackpoints(path))
+    assert len(points) == len(expected)
+    assert [parse_timestamp(point['timestamp']) for point in points] == [
+        parse_timestamp(point['timestamp']) for point in expected]
+    assert [point['heart_rate'] for point in points] == [point['heart_rate'] for point in expected]
@@ -0,0 +1,115 @@
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+import ingest_server
+import main
+from tests.conftest import raw_file, wait_until
+
+@pytest.fixture
+def serve(data_dirs, config, settings):
+    """Starts an IngestService over temporary data directories; returns (service, URL)."""
+    running = []
+
+    def start(**options):
+        service = ingest_server.IngestService(config, settings, **{'workers': 1, 'queue_size': 0, 'timeout': 30,
+                                                                   **options})
+        server = ingest_server.start_server(service)
+        running.append((server, service))
+        return service, server.url
+
+    yield start
+    for server, service in running:
+        server.shutdown()
+        server.server_close()
+        service.close()
+
+def _post(url, body, content_type="application/octet-stream", name=None):
+    query = f"?name={name}" if name else ""
+    request = urllib.request.Request(f"{url}/activities{query}", data=body, method="POST",
+                                     headers={'Content-Type': content_type})
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+def _ride(activity_id):
+    with open(raw_file(activity_id), 'rb') as f:
+        return f.read()
+
+def _multipart(filename, content, boundary="XyZbound"):
+    return (f"--{boundary}\r\nContent-Disposition: form-data; name=\"note\"\r\n\r\nhello\r\n"
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{filename}\"\r\n"
+            f"Content-Type: application/xml\r\n\r\n").encode() + content + f"\r\n--{boundary}--\r\n".encode()
+
+def _wait_until_idle(service):
+    wait_until(lambda: service.status()['in_flight'] == 0)
+
+def test_raw_and_multipart_uploads(serve):
+    service, url = serve()
+    status, reply = _post(url, _ride(18573846126), name="ride.tcx")
+    assert status == 200 and reply['file'] == "ride.tcx" and reply['status'] == "ok" and reply['title']
+
+    status, reply = _post(url, _multipart("../../evil name.tcx", _ride(18806050275)),
+                          content_type="multipart/form-data; boundary=XyZbound")
+    assert status == 200 and reply['file'] == "evil_name.tcx" and reply['title']
+    assert sorted(os.listdir(main.RAW_DATA_DIR)) == ["evil_name.tcx", "ride.tcx"]
+    assert service.status()['in_flight'] == 0
+
+def test_slot_is_free_for_the_next_request_once_answered(serve):
+    _, url = serve()
+    for activity_id in (18573846126, 18806050275, 18223135043):
+        assert _post(url, _ride(activity_id), name=f"{activity_id}.tcx")[0] == 200
+    assert _post(url, b"abc", content_type="text/plain")[0] == 415
+
+def test_second_upload_of_the_same_content_is_cached(serve):
+    _, url = serve()
+    first = _post(url, _ride(18573846126), name="ride.tcx")[1]
+    status, second = _post(url, _ride(18573846126), name="ride.tcx")
+    assert status == 200 and second['status'] == "cached" and second['title'] == first['title']
+
+def test_unsupported_and_oversized_uploads(serve):
+    _, url = serve(max_upload_mb=0.01)
+    assert _post(url, b"abc", content_type="text/plain")[0] == 415
+    assert _post(url, b"abc", name="notes.txt")[0] == 415
+    status, reply = _post(url, _ride(18806050275), name="ride.tcx")
+    assert status == 413 and "larger than" in reply['error']
+    assert os.listdir(main.RAW_DATA_DIR) == []  # Not even a partial file is left behind
+
+def test_saturated_service_answers_429(serve, gate):
+    service, url = serve(timeout=0.2)
+    assert _post(url, _ride(18573846126), name="slow.tcx")[0] == 504
+    status, reply = _post(url, _ride(18806050275), name="other.tcx")
+    assert status == 429 and "full" in reply['error']
+    assert _post(url, _multipart("other.tcx", _ride(18806050275)),
+                 content_type="multipart/form-data; boundary=XyZbound")[0] == 429
+    assert _post(url, b"abc", content_type="text/plain")[0] == 415  # Rejected before asking for a slot
+    gate()
+    _wait_until_idle(service)
+
+def test_timed_out_analysis_keeps_its_slot_until_it_finishes(serve, gate):
+    service, url = serve(timeout=0.2)
+    status, reply = _post(url, _ride(18573846126), name="slow.tcx")
+    assert status == 504 and "did not finish" in reply['error']
+    time.sleep(0.3)
+    assert service.status()['in_flight'] == 1  # Still analyzing: the slot is not handed out again
+
+    gate()
+    _wait_until_idle(service)
+    assert _post(url, _ride(18806050275), name="next.tcx")[0] == 200
+    # The timed-out analysis was recorded when it finished: uploading it again is answered from its summary
+    status, reply = _post(url, _ride(18573846126), name="slow.tcx")
+    assert status == 200 and reply['status'] == "cached"
+
+def test_safe_filename():
+    assert ingest_server.safe_filename("../../etc/passwd") == "passwd"
+    assert ingest_server.safe_filename("../ride.tcx", ".tcx") == "ride.tcx"
+    assert ingest_server.safe_filename("..", ".tcx") is None
+    assert ingest_server.safe_filename("a/../../.hidden ride.fit") == "hidden_ride.fit"
+    assert ingest_server.safe_filename("ride", ".gpx") == "ride.gpx"
+    assert ingest_server.safe_filename(None) is None
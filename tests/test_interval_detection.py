@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+import data_parser
+import interval_detection
+import utils
+import zones
+from tests.conftest import raw_file
+from workout_stream import MetricSeries, parse_timestamp
+
+# Boundaries the original single-threshold detector finds on the bundled rides, with the
+# shipped config: (start_time, end_time, zones)
+POWER_INTERVALS_18806050275 = [
+    ("2025-04-12T12:12:07.000Z", "2025-04-12T12:12:56.000Z", ["zone3", "zone4", "zone5"]),
+    ("2025-04-12T12:15:48.000Z", "2025-04-12T12:17:54.000Z", ["zone3", "zone4", "zone5"]),
+    ("2025-04-12T12:18:09.000Z", "2025-04-12T12:19:15.000Z", ["zone3", "zone4", "zone5", "zone6"]),
+    ("2025-04-12T12:20:09.000Z", "2025-04-12T12:21:38.000Z", ["zone2", "zone3", "zone4", "zone5"]),
+    ("2025-04-12T12:23:09.000Z", "2025-04-12T12:23:45.000Z", ["zone3", "zone4", "zone5"]),
+    ("2025-04-12T12:24:39.000Z", "2025-04-12T12:25:17.000Z", ["zone3", "zone4"]),
+    ("2025-04-12T12:25:36.000Z", "2025-04-12T12:26:42.000Z", ["zone2", "zone3", "zone4", "zone5"]),
+    ("2025-04-12T12:31:03.000Z", "2025-04-12T12:31:38.000Z", ["zone3", "zone4"]),
+    ("2025-04-12T12:34:34.000Z", "2025-04-12T12:35:12.000Z", ["zone3", "zone4"]),
+    ("2025-04-12T12:36:11.000Z", "2025-04-12T12:36:54.000Z", ["zone3", "zone4", "zone5"]),
+    ("2025-04-12T12:40:22.000Z", "2025-04-12T12:40:52.000Z", ["zone3"]),
+]
+HEART_RATE_INTERVALS_18573846126 = [
+    ("2025-03-19T09:01:42.000Z", "2025-03-19T09:02:50.000Z", ["zone3"]),
+    ("2025-03-19T09:10:15.000Z", "2025-03-19T09:11:17.000Z", ["zone3"]),
+]
+
+def _detect(activity_id, metric, window, config):
+    series = data_parser.parse_workout_stream(raw_file(activity_id)).series(metric)
+    smoothed = utils.smooth_data(series, window_size=window)
+    zone_table = zones.compile_zones(config[f'{metric}_zones'], metric)
+    return interval_detection.detect_intervals(smoothed, config[f'{metric}_interval_thresholds'], zones=zone_table)
+
+def _boundaries(intervals):
+    return [(interval['start_time'], interval['end_time'], interval['zones']) for interval in intervals]
+
+@pytest.mark.parametrize("activity_id, metric, window, expected", [
+    ("18806050275", "power", 5, POWER_INTERVALS_18806050275),
+    ("18573846126", "heart_rate", 10, HEART_RATE_INTERVALS_18573846126),
+])
+def test_shipped_config_keeps_the_original_boundaries(config, activity_id, metric, window, expected):
+    assert _boundaries(_detect(activity_id, metric, window, config)) == expected
+
+def _series(values, step=1.0):
+    return MetricSeries(np.arange(len(values)) * step, np.asarray(values, dtype=np.float64))
+
+ZONES = {'low': [0, 250], 'high': [250, 1000]}
+
+def test_exit_below_adds_hysteresis():
+    values = [100] * 5 + [300] * 20 + [230] * 5 + [300] * 20 + [100] * 5
+    single = interval_detection.detect_intervals(_series(values), {'sustain_above': 250, 'sustain_duration': 10}, ZONES)
+    assert [(i['start_seconds'], i['end_seconds']) for i in single] == [(5.0, 25.0), (30.0, 50.0)]
+
+    config = {'sustain_above': 250, 'exit_below': 200, 'sustain_duration': 10}
+    merged = interval_detection.detect_intervals(_series(values), config, ZONES)
+    assert [(i['start_seconds'], i['end_seconds']) for i in merged] == [(5.0, 50.0)]
+    assert merged[0]['zones'] == ["high", "low"]
+    assert merged[0]['average_value'] == pytest.approx((40 * 300 + 5 * 230) / 45)
+
+def test_enter_above_delays_the_start():
+    values = [100] * 5 + [260] * 10 + [320] * 20 + [100] * 5
+    config = {'sustain_above': 250, 'enter_above': 300, 'sustain_duration': 10}
+    intervals = interval_detection.detect_intervals(_series(values), config, ZONES)
+    assert [(i['start_seconds'], i['end_seconds']) for i in intervals] == [(15.0, 35.0)]
+
+def test_short_dips_merge_and_gaps_split():
+    values = [300] * 20 + [100] * 3 + [300] * 20 + [100] * 10
+    config = {'sustain_above': 250, 'sustain_duration': 10, 'max_dip_duration': 5}
+    intervals = interval_detection.detect_intervals(_series(values), config, ZONES)
+    assert [(i['start_seconds'], i['end_seconds']) for i in intervals] == [(0.0, 43.0)]
+
+    timestamps = np.concatenate((np.arange(20.0), np.arange(60.0, 80.0)))
+    series = MetricSeries(timestamps, np.full(40, 300.0))
+    intervals = interval_detection.detect_intervals(series, dict(config, max_gap=10), ZONES)
+    assert [(i['start_seconds'], i['end_seconds']) for i in intervals] == [(0.0, 19.0), (60.0, 79.0)]
+
+def test_interval_open_at_the_end_is_closed():
+    values = [100] * 10 + [300] * 30
+    intervals = interval_detection.detect_intervals(_series(values), {'sustain_above': 250, 'sustain_duration': 10}, ZONES)
+    assert [(i['start_seconds'], i['end_seconds'], i['duration']) for i in intervals] == [(10.0, 39.0, 29.0)]
+
+@pytest.mark.parametrize("source, rendered", [
+    ("2024-01-01T10:00:01.500+01:00", "2024-01-01T09:00:01.500Z"),
+    ("2024-01-01T10:00:00Z", "2024-01-01T10:00:00.000Z"),
+    ("2024-01-01T10:00:00", "2024-01-01T10:00:00.000Z"),  # No offset: read as UTC
+])
+def test_times_are_rendered_in_utc(source, rendered):
+    values = [100] * 5 + [300] * 20
+    series = MetricSeries(parse_timestamp(source) - 5 + np.arange(len(values)), np.asarray(values, dtype=np.float64))
+    intervals = interval_detection.detect_intervals(series, {'sustain_above': 250, 'sustain_duration': 10}, ZONES)
+    assert [i['start_time'] for i in intervals] == [rendered]
@@ -0,0 +1,45 @@
+import numpy as np
+
+import mean_max
+
+DAY = 86400.0
+
+def _curves(rng, length=80):
+    return {'power': mean_max.curve_to_json(np.sort(rng.uniform(100, 900, length))[::-1]),
+            'heart_rate': mean_max.curve_to_json(np.sort(rng.uniform(100, 190, length))[::-1])}
+
+def _expected(activities, metric, since=-np.inf):
+    return mean_max.curve_to_json(mean_max._best_of([mean_max.curve_from_json(entry[metric])
+                                                     for entry in activities.values() if entry['start'] >= since]))
+
+def test_batched_refresh_matches_the_best_of_every_activity():
+    rng = np.random.default_rng(7)
+    per_file = mean_max.load_history("/nonexistent")
+    batched = mean_max.load_history("/nonexistent")
+    workouts = [(f"ride{i}.tcx", i * 10 * DAY, _curves(rng)) for i in range(20)]
+
+    for activity, start, curves in workouts:
+        mean_max.update_history(per_file, activity, start, curves)
+        mean_max.refresh_bests(per_file, [activity])
+    for activity, start, curves in workouts:
+        assert not mean_max.update_history(batched, activity, start, curves)
+    mean_max.refresh_bests(batched, [activity for activity, _, _ in workouts])
+
+    assert batched == per_file
+    for metric in mean_max.CURVE_METRICS:
+        assert batched['all_time'][metric] == _expected(batched['activities'], metric)
+        assert batched['rolling'][metric] == _expected(batched['activities'], metric, since=190 * DAY - 90 * DAY)
+
+def test_replacing_an_activity_rebuilds_the_all_time_best():
+    rng = np.random.default_rng(3)
+    history = mean_max.load_history("/nonexistent")
+    for i in range(3):
+        mean_max.update_history(history, f"ride{i}.tcx", i * DAY, _curves(rng))
+    mean_max.refresh_bests(history, ["ride0.tcx", "ride1.tcx", "ride2.tcx"])
+
+    # The best ride is reprocessed with lower values: its old curve must no longer count
+    best = max(history['activities'], key=lambda activity: history['activities'][activity]['power'][0])
+    lowered = {metric: [value / 2 for value in history['activities'][best][metric]] for metric in mean_max.CURVE_METRICS}
+    assert mean_max.update_history(history, best, history['activities'][best]['start'], lowered)
+    mean_max.refresh_bests(history, [best], replaced=True)
+    assert history['all_time']['power'] == _expected(history['activities'], 'power')
@@ -0,0 +1,28 @@
+import json
+
+import data_parser
+import main
+import metric_analysis
+from tests.conftest import raw_file
+
+def test_heart_rate_response_is_aligned_with_the_intervals(config):
+    settings = main.compile_settings(config)
+    stream = data_parser.parse_workout_stream(raw_file("17738425132"))
+    results = metric_analysis.analyze_stream(stream, settings)
+
+    intervals = results['metrics']['power']['intervals']
+    assert intervals and not any('heart_rate_response' in interval for interval in intervals)
+    responses = results['cross_metric']['heart_rate_response']
+    assert responses == metric_analysis.heart_rate_response(stream.series('heart_rate'), intervals)
+    assert len(responses) == len(intervals)
+    # A list survives the JSON summary as it is (integer dict keys would turn into strings)
+    assert json.loads(json.dumps(responses)) == responses
+    # The primary results are those of analyzing power alone
+    alone = metric_analysis.analyze_metric(stream.series('power'), 'power', settings)
+    assert intervals == alone['intervals']
+
+def test_heart_rate_response_without_heart_rate_samples():
+    heart_rate = data_parser.parse_workout_stream(raw_file("17738425132")).series('heart_rate')
+    end = heart_rate.timestamps[-1]
+    intervals = [{'start_seconds': end + 100, 'end_seconds': end + 200}]
+    assert metric_analysis.heart_rate_response(heart_rate, intervals) == [None]
@@ -0,0 +1,92 @@
+"""The chunked (online) analysis against the whole-series one, at several chunk sizes."""
+import functools
+
+import numpy as np
+import pytest
+
+import data_parser
+import main
+import metric_analysis
+import utils
+import workout_generator
+from tests.conftest import raw_file
+from workout_stream import MetricSeries
+
+CHUNK_SIZES = [50, 1000, 3600]
+METHODS = list(utils.SMOOTHING_METHODS)
+
+@pytest.fixture(scope="module")
+def generated_ride(tmp_path_factory):
+    """Two hours with recording gaps and missing samples, so dips and gaps cross chunk boundaries."""
+    path = str(tmp_path_factory.mktemp("online") / "generated.fit")
+    workout = workout_generator.generate_workout(7200, dropouts=6, missing_power=0.02, missing_heart_rate=0.02, seed=11)
+    workout_generator.write_fit(workout, path)
+    return path
+
+def _settings(config, method, hysteresis):
+    config = dict(config, smoothing=dict(config.get('smoothing') or {}, method=method))
+    if hysteresis:
+        # Hysteresis and dip merging, which the shipped config leaves off
+        for section, exit_below in (('power_interval_thresholds', 219), ('heart_rate_interval_thresholds', 140)):
+            config[section] = dict(config[section], exit_below=exit_below, max_dip_duration=5)
+    return main.compile_settings(config)
+
+def _assert_same_intervals(online, batch):
+    assert len(online) == len(batch)
+    for interval, expected in zip(online, batch):
+        assert interval['average_value'] == pytest.approx(expected['average_value'], rel=1e-9)
+        assert dict(interval, average_value=None) == dict(expected, average_value=None)
+
+def _assert_same_analysis(online, batch):
+    _assert_same_intervals(online['intervals'], batch['intervals'])
+    assert len(online['grouped_intervals']) == len(batch['grouped_intervals'])
+    for group, expected in zip(online['grouped_intervals'], batch['grouped_intervals']):
+        assert group['number_of_intervals'] == expected['number_of_intervals']
+        assert group['average_duration'] == expected['average_duration']
+        _assert_same_intervals(group['intervals'], expected['intervals'])
+    assert online['zone_analysis'] == pytest.approx(batch['zone_analysis'])
+    assert online['average_value'] == pytest.approx(batch['average_value'], rel=1e-9)
+    assert online['max_value'] == batch['max_value']
+
+@functools.lru_cache(maxsize=None)
+def _parse(path):
+    return data_parser.parse_workout_stream(path)
+
+def _check(path, settings, chunk_size):
+    stream = _parse(path)
+    *partial, final = metric_analysis.analyze_chunks(data_parser.iter_workout_chunks(path, chunk_size), settings)
+    assert len(partial) == -(-len(stream) // chunk_size)
+    metrics = [metric for metric in metric_analysis.ANALYZED_METRICS if stream.has(metric)]
+    assert sorted(final) == sorted(metrics)
+    for metric in metrics:
+        assert final[metric]['complete'] and final[metric]['samples'] == len(stream.series(metric))
+        _assert_same_analysis(final[metric], metric_analysis.analyze_metric(stream.series(metric), metric, settings))
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+@pytest.mark.parametrize("method", METHODS)
+@pytest.mark.parametrize("activity_id", ["17738425132", "18223135043", "18573846126", "18806050275"])
+def test_bundled_rides(config, activity_id, method, chunk_size):
+    _check(raw_file(activity_id), _settings(config, method, hysteresis=False), chunk_size)
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+@pytest.mark.parametrize("method", METHODS)
+@pytest.mark.parametrize("hysteresis", [False, True])
+def test_generated_ride(config, generated_ride, hysteresis, method, chunk_size):
+    _check(generated_ride, _settings(config, method, hysteresis), chunk_size)
+
+@pytest.mark.parametrize("method", METHODS)
+def test_single_sample_chunks(config, method):
+    _check(raw_file("18573846126"), _settings(config, method, hysteresis=True), 1)
+
+@pytest.mark.parametrize("method", METHODS)
+def test_online_smoother_is_exact(method):
+    rng = np.random.default_rng(5)
+    timestamps = np.cumsum(rng.choice([1.0, 1.0, 1.0, 2.0, 0.5, 12.0], 2000))
+    values = rng.uniform(50, 400, 2000)
+    expected = utils.smooth_data(MetricSeries(timestamps, values), 10, method=method).values
+    for chunk_size in (1, 3, 64, 5000):
+        smoother = utils.OnlineSmoother(10, method)
+        parts = [smoother.update(timestamps[i:i + chunk_size], values[i:i + chunk_size])
+                 for i in range(0, len(values), chunk_size)] + [smoother.finish()]
+        np.testing.assert_array_equal(np.concatenate([part[0] for part in parts]), timestamps)
+        np.testing.assert_array_equal(np.concatenate([part[1] for part in parts]), expected)
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+import resampling
+from workout_stream import WorkoutStream
+
+def _stream(timestamps, power):
+    return WorkoutStream(np.asarray(timestamps, dtype=np.float64), power=np.asarray(power, dtype=np.float64))
+
+def _same(left, right):
+    np.testing.assert_array_equal(left.timestamps, right.timestamps)
+    np.testing.assert_array_equal(left.metrics['power'], right.metrics['power'])
+    np.testing.assert_array_equal(left.markers, right.markers)
+
+def test_out_of_order_samples_are_sorted():
+    timestamps = np.arange(100.0, 160.0)
+    power = np.arange(60.0)
+    shuffled = np.random.default_rng(1).permutation(60)
+    # Includes samples before the first one recorded, which would give negative grid steps
+    _same(resampling.resample(_stream(timestamps[shuffled], power[shuffled])),
+          resampling.resample(_stream(timestamps, power)))
+
+def test_far_off_timestamp_is_dropped():
+    timestamps = 1.7e9 + np.arange(600.0)
+    power = np.full(600, 250.0)
+    corrupt = _stream(np.append(timestamps, 4e9), np.append(power, 100.0))
+    resampled = resampling.resample(corrupt)
+    assert len(resampled) == 600
+    _same(resampled, resampling.resample(_stream(timestamps, power)))
+
+    early = _stream(np.insert(timestamps, 0, 0.0), np.insert(power, 0, 100.0))
+    assert resampling.resample(early).timestamps[0] == 1.7e9
+
+def test_grid_is_capped():
+    # Steps just below MAX_PAUSE_SECONDS are kept together, but make too long a grid
+    timestamps = np.arange(60) * (resampling.MAX_PAUSE_SECONDS - 1.0)
+    with pytest.raises(ValueError, match="grid points"):
+        resampling.resample(_stream(timestamps, np.full(60, 200.0)), interval=1.0)
+
+def test_missing_timestamps_are_dropped():
+    resampled = resampling.resample(_stream([0.0, np.nan, 2.0, 3.0], [100.0, 999.0, 100.0, 100.0]))
+    np.testing.assert_array_equal(resampled.metrics['power'], [100.0] * 4)
@@ -0,0 +1,37 @@
+import os
+
+import numpy as np
+
+import manifest
+import stream_cache
+import workout_generator
+
+def _same(left, right):
+    np.testing.assert_array_equal(left.timestamps, right.timestamps)
+    for metric, values in left.metrics.items():
+        np.testing.assert_array_equal(values, right.metrics[metric])
+
+def test_files_differing_only_in_extension_get_separate_entries(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    tcx_path, fit_path = str(tmp_path / "ride.tcx"), str(tmp_path / "ride.fit")
+    workout_generator.write_tcx(workout_generator.generate_workout(600, seed=1), tcx_path)
+    workout_generator.write_fit(workout_generator.generate_workout(900, seed=2), fit_path)
+
+    parsed_tcx = stream_cache.get_stream(tcx_path, cache_dir=cache_dir)
+    parsed_fit = stream_cache.get_stream(fit_path, cache_dir=cache_dir)
+    assert len(parsed_tcx) == 600 and len(parsed_fit) == 900
+    assert sorted(os.listdir(cache_dir)) == sorted(os.path.basename(stream_cache.cache_path(path, manifest.hash_file(path), cache_dir))
+                                                   for path in (tcx_path, fit_path))
+    # Both are hits now, each with its own stream
+    _same(stream_cache.get_stream(tcx_path, cache_dir=cache_dir), parsed_tcx)
+    _same(stream_cache.get_stream(fit_path, cache_dir=cache_dir), parsed_fit)
+
+def test_changed_source_replaces_its_entry(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    path = str(tmp_path / "ride.tcx")
+    workout_generator.write_tcx(workout_generator.generate_workout(600, seed=1), path)
+    stream_cache.get_stream(path, cache_dir=cache_dir)
+    workout_generator.write_tcx(workout_generator.generate_workout(300, seed=1), path)
+
+    assert len(stream_cache.get_stream(path, cache_dir=cache_dir)) == 300
+    assert os.listdir(cache_dir) == [os.path.basename(stream_cache.cache_path(path, manifest.hash_file(path), cache_dir))]
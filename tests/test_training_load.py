@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+import mean_max
+import training_load
+from workout_stream import MetricSeries
+
+def _reference_np(series, max_gap=10):
+    """Normalized power with a plain loop over the full 30 s windows."""
+    held = mean_max.to_one_second_grid(series.timestamps, series.values, max_gap)
+    window = training_load.NP_WINDOW_SECONDS
+    rolling = []
+    for end in range(window, len(held) + 1):
+        if not np.isnan(held[end - 1]):
+            rolling.append(np.nanmean(held[end - window:end]))
+    return float(np.mean(np.asarray(rolling) ** 4) ** 0.25)
+
+def test_constant_power():
+    value, seconds = training_load.normalized_power(MetricSeries(np.arange(600.0), np.full(600, 200.0)))
+    assert value == pytest.approx(200.0) and seconds == 600
+
+def test_rolling_average_starts_with_the_first_full_window():
+    # A 10 s sprint at the start: partial windows over the first 30 s would weight it more
+    values = np.concatenate((np.full(10, 1000.0), np.full(290, 100.0)))
+    value, _ = training_load.normalized_power(MetricSeries(np.arange(300.0), values))
+    rolling = [np.mean(values[end - 30:end]) for end in range(30, 301)]
+    assert value == pytest.approx(np.mean(np.asarray(rolling) ** 4) ** 0.25)
+
+def test_matches_loop_reference_with_gaps():
+    rng = np.random.default_rng(3)
+    timestamps = np.arange(1800.0)
+    timestamps[900:] += 120  # A stop longer than max_gap
+    keep = rng.random(len(timestamps)) > 0.05
+    series = MetricSeries(timestamps[keep], rng.uniform(50, 400, len(timestamps))[keep])
+    value, _ = training_load.normalized_power(series)
+    assert value == pytest.approx(_reference_np(series))
+
+def test_ride_shorter_than_one_window_uses_its_average_power():
+    value, seconds = training_load.normalized_power(MetricSeries(np.arange(20.0), np.linspace(100.0, 200.0, 20)))
+    assert value == pytest.approx(150.0) and seconds == 20
+
+def test_no_samples():
+    assert training_load.normalized_power(MetricSeries([], [])) == (None, 0)
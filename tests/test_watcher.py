@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+
+import pytest
+
+import main
+import watcher
+import workout_generator
+from tests.conftest import wait_until
+
+# Long enough for the polling watcher to have looked at the directory several times
+QUIET_SECONDS = 0.3
+
+@pytest.fixture
+def watch(data_dirs, config, settings):
+    """Runs polling Watchers over the temporary raw data directory on background threads."""
+    running = []
+
+    def start(**options):
+        file_watcher = watcher.Watcher(main.RAW_DATA_DIR, config, settings,
+                                       **{'workers': 1, 'settle_seconds': 0, 'poll_interval': 0.02,
+                                          'use_inotify': False, **options})
+        thread = threading.Thread(target=file_watcher.run)
+        thread.start()
+        running.append((file_watcher, thread))
+        return file_watcher
+
+    yield start
+    for file_watcher, thread in running:
+        if thread.is_alive():
+            file_watcher.stop()
+            thread.join(30)
+
+def _write(name, seed=0, content=None):
+    """Writes a raw file under a temporary name and renames it into place, as a download would."""
+    temp_path = os.path.join(main.RAW_DATA_DIR, f".{name}.tmp")
+    if content is None:
+        workout_generator.write_tcx(workout_generator.generate_workout(600, seed=seed), temp_path)
+    else:
+        with open(temp_path, 'wb') as f:
+            f.write(content)
+    os.replace(temp_path, os.path.join(main.RAW_DATA_DIR, name))
+
+def _files(file_watcher):
+    return [report['file'] for report in file_watcher.reports]
+
+def _stop(file_watcher):
+    file_watcher.stop()
+    wait_until(lambda: not file_watcher.running and not file_watcher.in_flight)
+
+def test_only_new_and_changed_files_are_analyzed(watch):
+    _write("a.tcx", seed=1)
+    file_watcher = watch()
+    wait_until(lambda: _files(file_watcher) == ["a.tcx"])
+
+    _write("b.tcx", seed=2)
+    _write("c.tcx.part", seed=3)
+    _write(".hidden.tcx", seed=4)
+    wait_until(lambda: len(file_watcher.reports) == 2)
+    os.utime(os.path.join(main.RAW_DATA_DIR, "a.tcx"))  # Touched, but the content is unchanged
+    time.sleep(QUIET_SECONDS)
+    _write("a.tcx", seed=5)
+    wait_until(lambda: len(file_watcher.reports) == 3)
+    time.sleep(QUIET_SECONDS)
+    assert _files(file_watcher) == ["a.tcx", "b.tcx", "a.tcx"]
+    assert all(report['status'] == "ok" for report in file_watcher.reports)
+
+    # A new watcher finds everything up to date
+    _stop(file_watcher)
+    restarted = watch()
+    time.sleep(QUIET_SECONDS)
+    assert restarted.reports == []
+
+def test_malformed_file_is_not_retried_until_it_changes(watch):
+    _write("bad.tcx", content=b"<not a workout")
+    file_watcher = watch()
+    wait_until(lambda: len(file_watcher.reports) == 1)
+    assert file_watcher.reports[0]['status'] == "skipped"
+
+    _write("good.tcx", seed=1)  # The loop keeps going
+    wait_until(lambda: len(file_watcher.reports) == 2)
+    assert file_watcher.reports[1]['status'] == "ok"
+
+    _write("bad.tcx", content=b"<not a workout")  # Rewritten with the same content
+    time.sleep(QUIET_SECONDS)
+    assert len(file_watcher.reports) == 2
+
+    _write("bad.tcx", seed=2)
+    wait_until(lambda: len(file_watcher.reports) == 3)
+    assert file_watcher.reports[2]['file'] == "bad.tcx" and file_watcher.reports[2]['status'] == "ok"
+
+_ANALYZE = main._analyze_file_timed
+
+def _crash_on_marked_files(job):
+    file_path, _ = job
+    if "crash" in os.path.basename(file_path):
+        raise RuntimeError("worker crashed")
+    return _ANALYZE(job)
+
+def test_failed_analysis_is_retried_only_after_the_file_changes(watch, monkeypatch):
+    monkeypatch.setattr(main, "_analyze_file_timed", _crash_on_marked_files)
+    _write("crash.tcx", seed=1)
+    file_watcher = watch()
+    wait_until(lambda: len(file_watcher.reports) == 1)
+    assert file_watcher.reports[0]['status'] == "failed" and "worker crashed" in file_watcher.reports[0]['error']
+
+    _write("good.tcx", seed=2)
+    wait_until(lambda: len(file_watcher.reports) == 2)
+    _write("crash.tcx", seed=1)  # Same content: not retried
+    time.sleep(QUIET_SECONDS)
+    assert _files(file_watcher) == ["crash.tcx", "good.tcx"]
+
+    _write("crash.tcx", seed=3)
+    wait_until(lambda: len(file_watcher.reports) == 3)
+    assert _files(file_watcher)[2] == "crash.tcx"
+
+def test_file_changed_while_analyzed_is_analyzed_again(watch, gate):
+    _write("a.tcx", seed=1)
+    file_watcher = watch()
+    wait_until(lambda: len(file_watcher.in_flight) == 1)
+    _write("a.tcx", seed=2)
+    wait_until(lambda: "a.tcx" in file_watcher.deferred)
+
+    gate()
+    wait_until(lambda: len(file_watcher.reports) == 2)
+    time.sleep(QUIET_SECONDS)
+    assert _files(file_watcher) == ["a.tcx", "a.tcx"] and not file_watcher.deferred
+
+def test_queue_limit_and_stop_drains_in_flight_work(watch, gate):
+    for index in range(3):
+        _write(f"{index}.tcx", seed=index)
+    file_watcher = watch(queue_size=2)
+    wait_until(lambda: len(file_watcher.in_flight) == 2)
+    time.sleep(QUIET_SECONDS)
+    assert len(file_watcher.in_flight) == 2 and not file_watcher.reports  # The third waits for a free slot
+
+    file_watcher.stop()
+    gate()
+    wait_until(lambda: not file_watcher.in_flight and len(file_watcher.reports) == 3)
+    assert sorted(_files(file_watcher)) == ["0.tcx", "1.tcx", "2.tcx"]
+    assert all(report['status'] == "ok" for report in file_watcher.reports)
+    assert os.path.isfile(os.path.join(main.PROCESSED_DATA_DIR, "2_summary.json"))
+
+def test_event_queue_overflow_rescans_the_directory(data_dirs, config, settings):
+    for name in ("a.tcx", "b.fit", ".c.tcx", "d.tcx.crdownload"):
+        open(os.path.join(main.RAW_DATA_DIR, name), 'w').close()
+    file_watcher = watcher.Watcher(main.RAW_DATA_DIR, config, settings, workers=1, use_inotify=False)
+    file_watcher._handle_events(None)
+    assert sorted(file_watcher.pending) == ["a.tcx", "b.fit"]
+    file_watcher._handle_events([("a.tcx", None)])  # Deleted before it was due
+    assert sorted(file_watcher.pending) == ["b.fit"]
+    file_watcher.source.close()
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+import config_cache
+import zones
+
+GAPPED = {'low': [0, 100], 'mid': [150, 200], 'high': [200, 300]}
+
+def _first_match(zone_definitions, value):
+    """The original lookup: the first configured zone with lower <= value < upper."""
+    for name, (lower, upper) in zone_definitions.items():
+        if lower <= value < upper:
+            return name
+    return None
+
+def test_gapped_zones_match_the_first_configured_zone():
+    zone_table = zones.compile_zones(dict(reversed(GAPPED.items())), analysis_type=None)
+    values = np.arange(-10.0, 320.0, 0.5)
+    assert [zone_table.zone_of(value) for value in values] == [_first_match(GAPPED, value) for value in values]
+
+def test_empty_zones_do_not_overlap():
+    zone_table = zones.compile_zones({'low': [0, 100], 'none': [50, 50], 'high': [100, 200]}, analysis_type=None)
+    assert zone_table.overlaps() == []
+    assert zone_table.zone_of(50) == 'low'
+
+@pytest.mark.parametrize("zone_definitions, pairs", [
+    ({'low': [0, 120], 'high': [100, 200]}, "low and high"),
+    ({'all': [0, 1000], 'low': [0, 100], 'high': [300, 400]}, "all and low"),
+    ({'ftp': 250, 'z1': [0, 60], 'z2': [55, 80]}, "z1 and z2"),
+])
+def test_overlapping_zones_are_rejected(zone_definitions, pairs):
+    with pytest.raises(ValueError, match=f"Overlapping zones: {pairs}"):
+        zones.compile_zones(zone_definitions)
+
+def test_validate_config_reports_overlapping_zones(config):
+    overlapping = dict(config, heart_rate_zones={'zone1': [0, 140], 'zone2': [135, 150]})
+    with pytest.raises(ValueError, match="heart_rate_zones: Overlapping zones: zone1 and zone2"):
+        config_cache.validate_config(overlapping)
+    assert config_cache.validate_config(config) is config